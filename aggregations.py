@@ -0,0 +1,242 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# --- Agregações da EDA em Passagem Única ---
+#
+# Calcula todos os resumos usados nos gráficos de eda_analysis.py (estatísticas e
+# histogramas numéricos, vendas mensais, por categoria, região, produto, dia da semana,
+# hora e uso dos métodos de pagamento) numa única passagem sobre os blocos de dados.
+# Os agregados parciais são somas/contagens por chave, combináveis (merge) entre blocos
+# ou partições, e podem ser persistidos em JSON para refazer os gráficos sem reler as linhas.
+
+numeric_columns = ['Quantity', 'UnitPrice', 'TotalPrice']
+
+# Largura dos bins finos dos histogramas (rebinados para 30 bins no gráfico)
+histogram_bin_width = {'Quantity': 1.0, 'UnitPrice': 1.0, 'TotalPrice': 1.0}
+discrete_columns = {'Quantity'} # Valores inteiros: o bin representa o próprio valor
+float32_decimals = 2 # Colunas float32 (UnitPrice, ver schema.py) voltam aos centavos ao virar float64
+summaries_version = 2 # Resumos gravados com outra versão são recalculados (v2: float32 arredondado)
+
+day_names = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo']
+
+# Resumos por chave: nome -> (coluna da chave, coluna somada ou None para contagem)
+keyed_sums = {
+    'monthly_sales': ('Month', 'TotalPrice'),
+    'category_sales': ('Category', 'TotalPrice'),
+    'region_sales': ('Region', 'TotalPrice'),
+    'product_quantity': ('ProductName', 'Quantity'),
+    'product_revenue': ('ProductName', 'TotalPrice'),
+    'dayofweek_sales': ('DayOfWeek', 'TotalPrice'),
+    'hourly_sales': ('Hour', 'TotalPrice'),
+    'payment_usage': ('PaymentMethod', None),
+}
+
+
+def derived_keys(df):
+    """Chaves que não são colunas do bloco (o mês como inteiro: meses desde 1970-01).
+
+    Um código inteiro por linha, sem criar um texto 'AAAA-MM' por linha; o texto só é
+    gerado em results(), uma vez por mês.
+    """
+    months = df['Date'].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+    return {'Month': pd.Series(months, index=df.index)}
+
+
+def month_periods(keys):
+    """PeriodIndex mensal a partir das chaves de monthly_sales (códigos inteiros ou 'AAAA-MM' antigos)."""
+    labels = [np.datetime64(int(k), 'M').astype(str) if not isinstance(k, str) else k for k in keys]
+    return pd.PeriodIndex(labels, freq='M')
+
+
+def _add(a, b):
+    """Soma duas séries por chave (agregado parcial combinável)."""
+    if a is None:
+        return b
+    return a.add(b, fill_value=0)
+
+
+class EDAAggregator:
+    """Acumula os resumos da EDA bloco a bloco; update() e merge() são associativos."""
+
+    def __init__(self):
+        self.rows = 0
+        self.source = None
+        self.version = summaries_version
+        self.sums = {name: None for name in keyed_sums}
+        # Estatísticas numéricas: contagem, média e M2 (Chan et al.), mínimo e máximo
+        self.moments = {col: (0, 0.0, 0.0, np.inf, -np.inf) for col in numeric_columns}
+        self.histograms = {col: None for col in numeric_columns}
+
+    def update(self, df):
+        """Incorpora um bloco já limpo (com os atributos de data de cleaning.add_date_features)."""
+        self.rows += len(df)
+        with instrumentation.stage('eda.month_key', rows_in=len(df)):
+            keys = derived_keys(df)
+        for name in keyed_sums:
+            with instrumentation.stage(f'eda.{name}', rows_in=len(df)):
+                self.update_sum(name, df, keys)
+        for col in numeric_columns:
+            with instrumentation.stage(f'eda.stats_{col}', rows_in=len(df)):
+                self.update_numeric(col, df)
+        return self
+
+    def update_sum(self, name, df, keys=None):
+        """Incorpora o bloco num único resumo por chave (keys: chaves derivadas já calculadas)."""
+        key, value = keyed_sums[name]
+        keys = keys if keys is not None else derived_keys(df)
+        by = keys[key] if key in keys else df[key]
+        if value is None:
+            part = by.value_counts()
+        else:
+            part = df[value].groupby(by, observed=True).sum()
+        part.index = part.index.astype(object) # Chaves comparáveis entre blocos com vocabulários diferentes
+        # Somas parciais em 64 bits: o pandas devolve int16 quando a soma do bloco cabe, e a
+        # combinação entre blocos transbordaria
+        part = part.astype(np.int64 if pd.api.types.is_integer_dtype(part.dtype) else np.float64)
+        self.sums[name] = _add(self.sums[name], part)
+
+    def update_numeric(self, col, df):
+        """Incorpora o bloco nas estatísticas e no histograma fino de uma coluna numérica."""
+        values = df[col].to_numpy(dtype=float)
+        if df[col].dtype == np.float32:
+            values = np.round(values, float32_decimals) # 4724.49 e não 4724.490234375 nas estatísticas
+        if len(values):
+            m2 = ((values - values.mean()) ** 2).sum()
+            self._merge_moments(col, (len(values), values.mean(), m2, values.min(), values.max()))
+        bins, counts = np.unique(np.floor(values / histogram_bin_width[col]).astype(np.int64), return_counts=True)
+        self.histograms[col] = _add(self.histograms[col], pd.Series(counts, index=bins))
+
+    def _merge_moments(self, col, other):
+        n_a, mean_a, m2_a, min_a, max_a = self.moments[col]
+        n_b, mean_b, m2_b, min_b, max_b = other
+        n = n_a + n_b
+        if n == 0:
+            return
+        delta = mean_b - mean_a
+        mean = mean_a + delta * n_b / n
+        m2 = m2_a + m2_b + delta ** 2 * n_a * n_b / n
+        self.moments[col] = (n, mean, m2, min(min_a, min_b), max(max_a, max_b))
+
+    def merge(self, other):
+        """Combina os agregados de outro EDAAggregator (ex: de outra partição) neste."""
+        self.rows += other.rows
+        for name in keyed_sums:
+            if other.sums[name] is not None:
+                self.sums[name] = _add(self.sums[name], other.sums[name])
+        for col in numeric_columns:
+            self._merge_moments(col, other.moments[col])
+            if other.histograms[col] is not None:
+                self.histograms[col] = _add(self.histograms[col], other.histograms[col])
+        return self
+
+    # --- Resultados finais ---
+
+    def _quantile(self, col, q):
+        # Posição q * (n - 1) da interpolação do pandas, localizada no bin fino e interpolada
+        # linearmente dentro dele (exato para Quantity, inteira)
+        hist = self.histograms[col].sort_index()
+        counts = hist.to_numpy()
+        cum = counts.cumsum()
+        position = q * (cum[-1] - 1)
+        b = np.searchsorted(cum, position, side='right')
+        if col in discrete_columns:
+            return float(hist.index[b] * histogram_bin_width[col])
+        inside = (position - (cum[b] - counts[b]) + 0.5) / counts[b]
+        return float((hist.index[b] + inside) * histogram_bin_width[col])
+
+    def describe(self):
+        """Equivalente ao df[numeric_columns].describe(); os quartis (aprox.) vêm dos histogramas finos."""
+        stats = {}
+        for col in numeric_columns:
+            n, mean, m2, vmin, vmax = self.moments[col]
+            stats[col] = [n, mean, np.sqrt(m2 / (n - 1)) if n > 1 else np.nan, vmin,
+                          self._quantile(col, 0.25), self._quantile(col, 0.5), self._quantile(col, 0.75), vmax]
+        return pd.DataFrame(stats, index=['count', 'mean', 'std', 'min', '25% (aprox.)', '50% (aprox.)',
+                                          '75% (aprox.)', 'max'])
+
+    def histogram(self, col):
+        """Centros e contagens dos bins finos, para plotar com weights (sem reler as linhas)."""
+        hist = self.histograms[col].sort_index()
+        offset = 0.0 if col in discrete_columns else 0.5
+        return (hist.index.to_numpy() + offset) * histogram_bin_width[col], hist.to_numpy()
+
+    def results(self, top_n=10):
+        """Séries prontas para os gráficos, no mesmo formato do cálculo original em memória."""
+        monthly = self.sums['monthly_sales'].sort_index()
+        months = month_periods(monthly.index)
+        full_range = pd.period_range(months.min(), months.max(), freq='M')
+        monthly = pd.Series(monthly.to_numpy(), index=months).reindex(full_range, fill_value=0)
+        monthly_sales = pd.DataFrame({'Date': full_range.to_timestamp(how='end').normalize(),
+                                      'TotalPrice': monthly.to_numpy()})
+
+        dayofweek = self.sums['dayofweek_sales'].rename(index=lambda d: day_names[int(d)])
+        hourly = self.sums['hourly_sales'].rename(index=int)
+
+        return {
+            'describe': self.describe(),
+            'monthly_sales': monthly_sales,
+            'category_sales': self.sums['category_sales'].sort_values(ascending=False),
+            'region_sales': self.sums['region_sales'].sort_values(ascending=False),
+            'top_products_quantity': self.sums['product_quantity'].nlargest(top_n),
+            'top_products_revenue': self.sums['product_revenue'].nlargest(top_n),
+            'dayofweek_sales': dayofweek.reindex(day_names),
+            'hourly_sales': hourly.sort_index(),
+            'payment_usage': self.sums['payment_usage'].astype(int).sort_values(ascending=False),
+        }
+
+    # --- Persistência ---
+
+    def save(self, path, source=None):
+        """Grava os agregados parciais em JSON (opcionalmente com a impressão digital da entrada)."""
+        def pairs(series):
+            return [[k.item() if hasattr(k, 'item') else k, v.item() if hasattr(v, 'item') else v]
+                    for k, v in series.items()]
+        payload = {
+            'version': summaries_version,
+            'rows': self.rows,
+            'source': source,
+            'sums': {name: pairs(s) for name, s in self.sums.items() if s is not None},
+            'moments': {col: list(map(float, m)) for col, m in self.moments.items()},
+            'histograms': {col: pairs(h) for col, h in self.histograms.items() if h is not None},
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            payload = json.load(f)
+        agg = cls()
+        agg.rows = payload['rows']
+        agg.source = payload.get('source')
+        agg.version = payload.get('version', 1)
+        for name, pairs in payload['sums'].items():
+            agg.sums[name] = pd.Series([v for _, v in pairs], index=pd.Index([k for k, _ in pairs], dtype=object))
+        for col, m in payload['moments'].items():
+            agg.moments[col] = (int(m[0]), m[1], m[2], m[3], m[4])
+        for col, pairs in payload['histograms'].items():
+            agg.histograms[col] = pd.Series([v for _, v in pairs], index=[k for k, _ in pairs])
+        return agg
+
+
+def source_fingerprint(path):
+    """Identifica a versão do arquivo (ou diretório Parquet) de entrada por tamanho e data de modificação."""
+    files = [path]
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    return [[os.path.relpath(f, path) if f != path else os.path.basename(f), os.path.getsize(f), os.path.getmtime(f)]
+            for f in files]
+
+
+def load_if_current(summaries_path, source_path):
+    """Carrega os resumos persistidos se ainda correspondem à entrada atual; senão retorna None."""
+    if not (os.path.exists(summaries_path) and os.path.exists(source_path)):
+        return None
+    agg = EDAAggregator.load(summaries_path)
+    if agg.source != source_fingerprint(source_path) or agg.version != summaries_version:
+        return None
+    return agg
@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import sklearn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import aggregations
+import cleaning
+import clustering
+import generate_data
+import instrumentation
+import rfm
+import schema
+import storage
+from rfm_state import RFMStateStore
+from sales_db import SalesDatabase
+
+# --- Benchmark de Escalabilidade do Pipeline, Etapa por Etapa ---
+#
+# Gera datasets com o esquema de generate_data.py (50K, 1M, 10M, 100M linhas) e mede tempo
+# e memória de cada etapa separadamente: carga, tipos compactos, nulos, duplicatas, atributos
+# de data, cada agregação da EDA, escrita dos processados, carga no SQLite, groupby do RFM,
+# scores (qcut), segmentos, busca do cotovelo e K-Means final. Os resultados vão para um JSON
+# e são comparados com uma baseline gravada; etapas mais lentas (ou com mais memória) que a
+# tolerância são apontadas como regressão e o script termina com código 1.
+#
+# Acima de stream_above linhas carga, limpeza, EDA, SQLite e RFM rodam em blocos (como no modo
+# streaming de eda_analysis.py + rfm_state.py), e os tempos de cada etapa são somados entre os blocos.
+
+size_presets = {'50k': 50_000, '1m': 1_000_000, '10m': 10_000_000, '100m': 100_000_000}
+default_sizes = ['50k', '1m']
+stream_above = 20_000_000
+stream_chunk_size = 1_000_000
+elbow_k_values = range(1, 11)
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+default_baseline = os.path.join(bench_dir, 'baseline.json')
+default_work_dir = storage.data_path('bench')
+
+# Regressão: mais lenta que a baseline além da tolerância relativa E da diferença mínima absoluta
+time_tolerance = 0.25
+min_time_delta = 0.05 # segundos
+memory_tolerance = 0.25
+min_memory_delta = 32 # MB
+
+optional_stages = ('write_processed', 'sqlite_load', 'elbow')
+
+
+# --- Medição ---
+
+class StageRecorder:
+    """Tempo e memória por etapa; chamadas repetidas da mesma etapa (blocos) são acumuladas.
+
+    peak_delta_mb é o quanto o pico de RSS subiu acima do RSS do início da etapa (exato
+    quando o pico pode ser zerado; senão o pico é o do processo inteiro).
+    """
+
+    def __init__(self, skip=()):
+        self.stages = {}
+        self.skip = set(skip)
+        self.exact_peak = instrumentation.reset_peak_rss()
+
+    @contextmanager
+    def measure(self, name, rows_in=None):
+        info = {}
+        rss_before, _ = instrumentation.memory_mb()
+        instrumentation.reset_peak_rss()
+        start = time.perf_counter()
+        yield info
+        seconds = time.perf_counter() - start
+        _, peak = instrumentation.memory_mb()
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_rss_mb': 0.0, 'peak_delta_mb': 0.0,
+                                              'rows_in': 0, 'rows_out': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+        stage['peak_rss_mb'] = max(stage['peak_rss_mb'], peak)
+        stage['peak_delta_mb'] = max(stage['peak_delta_mb'], peak - rss_before)
+        stage['rows_in'] += rows_in or 0
+        stage['rows_out'] += info.get('rows_out', rows_in or 0)
+
+    def result(self):
+        return {name: {k: round(v, 4) if isinstance(v, float) else v for k, v in s.items()}
+                for name, s in self.stages.items()}
+
+
+# --- Etapas ---
+
+def dataset_path(work_dir, rows, customers, seed, fmt):
+    return storage.table_path(os.path.join(work_dir, f'bench_{rows}_{customers}_{seed}.csv'), fmt)
+
+
+def prepare_dataset(rec, path, rows, customers, seed):
+    """Gera o dataset se ainda não existir (a geração também é medida)."""
+    if os.path.exists(path):
+        return
+    with rec.measure('generate') as info:
+        generate_data.generate_dataset(path, rows, min(rows, generate_data.chunk_size), seed, num_customers=customers)
+        info['rows_out'] = rows
+
+
+def aggregate_eda(rec, aggregator, df):
+    """Cada resumo do EDAAggregator medido como uma etapa própria."""
+    aggregator.rows += len(df)
+    with rec.measure('eda_month_key', len(df)):
+        keys = aggregations.derived_keys(df)
+    for name in aggregations.keyed_sums:
+        with rec.measure(f'eda_{name}', len(df)):
+            aggregator.update_sum(name, df, keys)
+    for col in aggregations.numeric_columns:
+        with rec.measure(f'eda_stats_{col}', len(df)):
+            aggregator.update_numeric(col, df)
+
+
+def run_in_memory(rec, path, processed_path, db_path):
+    """Mesmo caminho de eda_analysis.py + customer_segmentation_corrected.py, com tudo em memória."""
+    with rec.measure('load') as info:
+        raw_df = storage.read_table(path, parse_dates=['Date'])
+        info['rows_out'] = len(raw_df)
+    with rec.measure('schema', len(raw_df)):
+        df = schema.apply(raw_df)
+    del raw_df
+    with rec.measure('null_handling', len(df)) as info:
+        df = cleaning.handle_nulls(df)
+        info['rows_out'] = len(df)
+    with rec.measure('dedup', len(df)) as info:
+        df = df.drop_duplicates()
+        info['rows_out'] = len(df)
+    with rec.measure('features', len(df)):
+        df = cleaning.add_date_features(df)
+
+    aggregator = aggregations.EDAAggregator()
+    aggregate_eda(rec, aggregator, df)
+    with rec.measure('eda_results'):
+        aggregator.results()
+
+    if 'write_processed' not in rec.skip:
+        with rec.measure('write_processed', len(df)):
+            storage.write_table(df, processed_path)
+    if 'sqlite_load' not in rec.skip:
+        with rec.measure('sqlite_load', len(df)), SalesDatabase(db_path) as db:
+            db.load(df, mode='replace')
+
+    with rec.measure('rfm_groupby', len(df)) as info:
+        valid = df[df['CustomerID'] != -1]
+        rfm_df = rfm.compute_rfm(valid, valid['Date'].max() + pd.Timedelta(days=1))
+        info['rows_out'] = len(rfm_df)
+    return rfm_df
+
+
+def run_streaming(rec, path, processed_path, db_path, chunk_size):
+    """Carga, limpeza, EDA, SQLite e RFM bloco a bloco (memória limitada pelo tamanho do bloco)."""
+    chunks = storage.iter_table(path, chunk_size, parse_dates=['Date'])
+    dedup = cleaning.RowHashDeduplicator()
+    aggregator = aggregations.EDAAggregator()
+    state = RFMStateStore()
+    write = 'write_processed' not in rec.skip
+    load_sql = 'sqlite_load' not in rec.skip
+    try:
+        with storage.TableWriter(processed_path) as writer, SalesDatabase(db_path) as db:
+            first = True
+            while True:
+                with rec.measure('load') as info:
+                    chunk = next(chunks, None)
+                    info['rows_out'] = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    break
+                with rec.measure('schema', len(chunk)):
+                    chunk = schema.apply(chunk)
+                with rec.measure('null_handling', len(chunk)) as info:
+                    chunk = cleaning.handle_nulls(chunk)
+                    info['rows_out'] = len(chunk)
+                with rec.measure('dedup', len(chunk)) as info:
+                    chunk = dedup.filter(chunk)
+                    info['rows_out'] = len(chunk)
+                with rec.measure('features', len(chunk)):
+                    chunk = cleaning.add_date_features(chunk)
+                aggregate_eda(rec, aggregator, chunk)
+                if write:
+                    with rec.measure('write_processed', len(chunk)):
+                        writer.write(chunk)
+                if load_sql:
+                    with rec.measure('sqlite_load', len(chunk)):
+                        db.load(chunk, mode='replace' if first else 'append')
+                with rec.measure('rfm_groupby', len(chunk)):
+                    state.update(chunk[chunk['CustomerID'] != -1])
+                first = False
+    finally:
+        dedup.close()
+    with rec.measure('eda_results'):
+        aggregator.results()
+    with rec.measure('rfm_groupby') as info:
+        rfm_df = state.to_rfm()
+        info['rows_out'] = len(rfm_df)
+    return rfm_df
+
+
+def run_customer_stages(rec, rfm_df, elbow_workers, k):
+    with rec.measure('qcut_scoring', len(rfm_df)):
+        scores = rfm.score_exact(rfm_df)
+    with rec.measure('segment_mapping', len(rfm_df)):
+        rfm_df = rfm.add_scores(rfm_df, scores)
+    with rec.measure('scale', len(rfm_df)):
+        _, X = clustering.scale_features(rfm_df)
+    if 'elbow' not in rec.skip:
+        with rec.measure('elbow', len(rfm_df)):
+            wcss = clustering.elbow_search(X, elbow_k_values, workers=elbow_workers)
+        k = k or clustering.select_k_elbow(wcss)
+    with rec.measure('kmeans_final', len(rfm_df)):
+        clustering.fit_final(X, k or 4)
+
+
+def run_size(rows, args):
+    """Executa todas as etapas para um tamanho; com repeat > 1 fica o menor tempo de cada etapa."""
+    path = dataset_path(args.work_dir, rows, args.customers, args.seed, args.format)
+    processed_path = storage.table_path(os.path.join(args.work_dir, f'bench_{rows}_processed.csv'), args.format)
+    db_path = os.path.join(args.work_dir, f'bench_{rows}.db')
+    streaming = rows > args.stream_above
+    best = None
+    for _ in range(args.repeat):
+        rec = StageRecorder(skip=args.skip)
+        prepare_dataset(rec, path, rows, args.customers, args.seed)
+        if streaming:
+            rfm_df = run_streaming(rec, path, processed_path, db_path, args.chunk_size)
+        else:
+            rfm_df = run_in_memory(rec, path, processed_path, db_path)
+        run_customer_stages(rec, rfm_df, args.elbow_workers, args.k)
+        stages = rec.result()
+        if best is None:
+            best = stages
+        else:
+            for name, stage in stages.items():
+                kept = best.setdefault(name, stage)
+                kept['seconds'] = min(kept['seconds'], stage['seconds'])
+                kept['peak_delta_mb'] = min(kept['peak_delta_mb'], stage['peak_delta_mb'])
+    return {
+        'rows': rows,
+        'mode': 'streaming' if streaming else 'memory',
+        'customers': len(rfm_df),
+        'exact_peak_rss': rec.exact_peak,
+        'children_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'stages': best,
+    }
+
+
+# --- Baseline ---
+
+def compare(results, baseline, time_tol=time_tolerance, memory_tol=memory_tolerance):
+    """Etapas em que o resultado piorou em relação à baseline (mesmo tamanho e mesmo modo)."""
+    rows = []
+    for size, run in results['runs'].items():
+        base_run = baseline.get('runs', {}).get(size)
+        if base_run is None or base_run['mode'] != run['mode']:
+            continue
+        for name, stage in run['stages'].items():
+            base = base_run['stages'].get(name)
+            if base is None or name == 'generate':
+                continue
+            checks = [('seconds', time_tol, min_time_delta), ('peak_delta_mb', memory_tol, min_memory_delta)]
+            for metric, tol, min_delta in checks:
+                new, old = stage[metric], base[metric]
+                if new > old * (1 + tol) and new - old > min_delta:
+                    rows.append({'size': size, 'stage': name, 'metric': metric, 'baseline': old, 'atual': new,
+                                 'variação': f"{(new / old - 1) if old else float('inf'):+.0%}"})
+    return pd.DataFrame(rows, columns=['size', 'stage', 'metric', 'baseline', 'atual', 'variação'])
+
+
+def parse_size(value):
+    return size_presets.get(value.lower()) or int(value.replace('_', ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline por etapa (tempo e memória) com baseline.')
+    parser.add_argument('--sizes', nargs='+', default=default_sizes,
+                        help=f"Tamanhos em linhas ou presets ({', '.join(size_presets)})")
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.default_format)
+    parser.add_argument('--customers', type=int, default=generate_data.num_customers)
+    parser.add_argument('--seed', type=int, default=generate_data.seed)
+    parser.add_argument('--work-dir', default=default_work_dir, help='Datasets gerados (reaproveitados entre execuções)')
+    parser.add_argument('--output', default=None, help='JSON de resultados (padrão: <work-dir>/bench_pipeline_<data>.json)')
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--save-baseline', action='store_true', help='Grava estes resultados como a nova baseline')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--stream-above', type=int, default=stream_above)
+    parser.add_argument('--chunk-size', type=int, default=stream_chunk_size)
+    parser.add_argument('--elbow-workers', type=int, default=None)
+    parser.add_argument('--k', type=int, default=None, help='k fixo para o K-Means final (padrão: joelho do cotovelo)')
+    parser.add_argument('--skip', nargs='+', default=[], choices=optional_stages)
+    parser.add_argument('--time-tolerance', type=float, default=time_tolerance)
+    parser.add_argument('--memory-tolerance', type=float, default=memory_tolerance)
+    args = parser.parse_args()
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    results = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'format': args.format,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'runs': {},
+    }
+    for size in args.sizes:
+        rows = parse_size(size)
+        print(f"\n=== {rows:,} linhas ===")
+        run = run_size(rows, args)
+        results['runs'][str(rows)] = run
+        table = pd.DataFrame.from_dict(run['stages'], orient='index')[['seconds', 'peak_delta_mb', 'peak_rss_mb', 'rows_in', 'rows_out', 'calls']]
+        print(f"Modo {run['mode']}, {run['customers']:,} clientes")
+        print(table.to_string())
+
+    output = args.output or os.path.join(args.work_dir, f"bench_pipeline_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados salvos em {output}")
+
+    regressions = pd.DataFrame()
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        if regressions.empty:
+            print(f"Nenhuma regressão em relação à baseline {args.baseline}.")
+        else:
+            print(f"\nREGRESSÕES em relação à baseline {args.baseline}:")
+            print(regressions.to_string(index=False))
+    else:
+        print(f"Sem baseline em {args.baseline} (use --save-baseline para criar uma).")
+
+    if args.save_baseline:
+        baseline = {'meta': results['meta'], 'runs': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline['runs'] = json.load(f).get('runs', {}) # Mantém os tamanhos que não foram rodados agora
+        baseline['runs'].update(results['runs'])
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"Baseline atualizada em {args.baseline}")
+    raise SystemExit(1 if not regressions.empty else 0)
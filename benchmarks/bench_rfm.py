@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rfm
+
+# --- Benchmark: RFM original (lambda + regex) x RFM vetorizado ---
+#
+# Compara o cálculo da Recência e o mapeamento de segmentos da implementação original
+# de customer_segmentation_corrected.py com rfm.py, verificando que a saída é idêntica.
+
+
+def make_transactions(num_customers, num_transactions, seed=42):
+    """Transações sintéticas só com as colunas usadas no RFM."""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2023-01-01T00:00:00', 's')
+    return pd.DataFrame({
+        'OrderID': np.arange(1, num_transactions + 1),
+        'CustomerID': rng.integers(1001, 1001 + num_customers, size=num_transactions),
+        'Date': start + rng.integers(0, 730 * 86400, size=num_transactions).astype('timedelta64[s]'),
+        'TotalPrice': np.round(rng.uniform(20, 5000, size=num_transactions), 2),
+    })
+
+
+def legacy_rfm(df, reference_date):
+    rfm_df = df.groupby("CustomerID").agg(
+        Recency=("Date", lambda date: (reference_date - date.max()).days),
+        Frequency=("OrderID", "nunique"),
+        MonetaryValue=("TotalPrice", "sum")
+    ).reset_index()
+    return rfm_df
+
+
+def legacy_segments(rfm_df):
+    codes = rfm_df["R_Score"].astype(str) + rfm_df["F_Score"].astype(str)
+    return codes.replace(rfm.segment_map, regex=True)
+
+
+def score(rfm_df):
+    rfm_df["R_Score"] = pd.qcut(rfm_df["Recency"], q=5, labels=range(5, 0, -1), duplicates='drop').astype(int)
+    rfm_df["F_Score"] = pd.qcut(rfm_df["Frequency"].rank(method='first'), q=5, labels=range(1, 6), duplicates='drop').astype(int)
+    return rfm_df
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark do caminho RFM original x vetorizado.')
+    parser.add_argument('--customers', type=int, default=200_000)
+    parser.add_argument('--transactions', type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    df = make_transactions(args.customers, args.transactions)
+    reference_date = df["Date"].max() + pd.Timedelta(days=1)
+    print(f"{args.transactions:,} transações, {args.customers:,} clientes")
+
+    old_rfm, t_old_rfm = timed(legacy_rfm, df, reference_date)
+    new_rfm, t_new_rfm = timed(rfm.compute_rfm, df, reference_date)
+    # compute_rfm arredonda MonetaryValue para centavos (igual ao estado incremental): a única
+    # diferença em relação ao original é o ruído de ponto flutuante da soma, abaixo de meio centavo
+    pd.testing.assert_frame_equal(old_rfm.drop(columns="MonetaryValue"), new_rfm.drop(columns="MonetaryValue"))
+    monetary_diff = (old_rfm["MonetaryValue"] - new_rfm["MonetaryValue"]).abs().max()
+    assert monetary_diff < 0.005, monetary_diff
+    print(f"MonetaryValue: diferença máxima para o original {monetary_diff:.2e} (arredondamento para centavos)")
+    print(f"RFM (groupby):   original {t_old_rfm:8.3f}s | vetorizado {t_new_rfm:8.3f}s | {t_old_rfm / t_new_rfm:6.1f}x")
+
+    scored = score(new_rfm)
+    old_seg, t_old_seg = timed(legacy_segments, scored)
+    new_seg, t_new_seg = timed(rfm.assign_segments, scored["R_Score"], scored["F_Score"])
+    assert (old_seg.to_numpy() == new_seg).all()
+    print(f"Segmentos:       original {t_old_seg:8.3f}s | vetorizado {t_new_seg:8.3f}s | {t_old_seg / t_new_seg:6.1f}x")
+    print("Saídas equivalentes (idênticas exceto pelo arredondamento de MonetaryValue).")
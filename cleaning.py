@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import schema
+import storage
+
+# --- Limpeza e Engenharia de Atributos (em memória e em streaming) ---
+#
+# Mesmas regras de eda_analysis.py: CustomerID nulo vira -1, linhas sem Region são
+# removidas, duplicatas exatas são descartadas e os atributos de data são derivados.
+# No modo streaming a entrada é lida em blocos e a remoção de duplicatas é global,
+# usando um conjunto de hashes de linha com transbordo (spill) para disco.
+
+date_feature_columns = ['Year', 'Month', 'Week', 'DayOfWeek', 'Hour', 'DateOnly']
+
+
+def handle_nulls(df):
+    """Preenche CustomerID nulo com -1 e remove linhas com Região nula."""
+    df = df.copy()
+    df['CustomerID'] = df['CustomerID'].fillna(-1).astype(int) # Preenche com -1 e converte para int
+    return df.dropna(subset=['Region'])
+
+
+def add_date_features(df):
+    """Cria os atributos de data usados na EDA, já nos tipos compactos de schema.py."""
+    df['Year'] = df['Date'].dt.year
+    df['Month'] = df['Date'].dt.month
+    df['Week'] = df['Date'].dt.isocalendar().week.astype(int)
+    df['DayOfWeek'] = df['Date'].dt.dayofweek # Segunda=0, Domingo=6
+    df['Hour'] = df['Date'].dt.hour
+    df['DateOnly'] = df['Date'].dt.normalize() # datetime64 com resolução de dia (não objetos date)
+    return schema.apply(df)
+
+
+def row_hashes(df):
+    """Hash de 64 bits de cada linha (todas as colunas, sem o índice).
+
+    Categóricas são hasheadas pelo valor, então blocos com vocabulários diferentes
+    produzem o mesmo hash para a mesma linha.
+    """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+class RowHashDeduplicator:
+    """Remoção exata e global de linhas duplicadas ao longo de vários blocos.
+
+    Os hashes já vistos ficam num array ordenado em memória (8 bytes por linha) até
+    max_memory_keys; acima disso são despejados numa tabela SQLite em disco, de modo que
+    o pico de memória fica limitado independentemente do tamanho da entrada.
+    Colisões de hash de 64 bits são desprezíveis (~n²/2^65).
+    """
+
+    def __init__(self, max_memory_keys=5_000_000, spill_dir=None):
+        self.max_memory_keys = max_memory_keys
+        self.spill_dir = spill_dir
+        self.duplicates_removed = 0
+        self._memory = np.empty(0, dtype=np.uint64)
+        self._spill = None
+        self._spill_path = None
+
+    def _spill_to_disk(self):
+        if self._spill is None:
+            fd, self._spill_path = tempfile.mkstemp(suffix='.db', prefix='dedup_', dir=self.spill_dir)
+            os.close(fd)
+            self._spill = sqlite3.connect(self._spill_path)
+            self._spill.execute('PRAGMA journal_mode=OFF')
+            self._spill.execute('PRAGMA synchronous=OFF')
+            self._spill.execute('CREATE TABLE seen (h INTEGER PRIMARY KEY) WITHOUT ROWID')
+        with self._spill:
+            self._spill.executemany('INSERT OR IGNORE INTO seen VALUES (?)',
+                                    ((int(h),) for h in self._memory.view(np.int64)))
+        self._memory = np.empty(0, dtype=np.uint64)
+
+    def _seen_on_disk(self, hashes):
+        if self._spill is None or len(hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        cur = self._spill.cursor()
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS batch (h INTEGER PRIMARY KEY) WITHOUT ROWID')
+        cur.execute('DELETE FROM batch')
+        cur.executemany('INSERT INTO batch VALUES (?)', ((int(h),) for h in hashes.view(np.int64)))
+        found = np.fromiter((row[0] for row in cur.execute('SELECT h FROM batch JOIN seen USING (h)')), dtype=np.int64)
+        return np.isin(hashes.view(np.int64), found)
+
+    def filter(self, df):
+        """Retorna apenas as linhas de df ainda não vistas (nem neste bloco nem em anteriores)."""
+        hashes = row_hashes(df)
+        # Duplicatas dentro do próprio bloco (mantém a primeira ocorrência, como drop_duplicates)
+        new = ~pd.Series(hashes).duplicated().to_numpy()
+        # Duplicatas de blocos anteriores: array em memória e, se houver, o transbordo em disco
+        if len(self._memory):
+            pos = np.searchsorted(self._memory, hashes)
+            new &= self._memory[np.minimum(pos, len(self._memory) - 1)] != hashes
+        new[new] &= ~self._seen_on_disk(hashes[new])
+
+        fresh = np.sort(hashes[new])
+        self._memory = np.insert(self._memory, np.searchsorted(self._memory, fresh), fresh)
+        if len(self._memory) > self.max_memory_keys:
+            self._spill_to_disk()
+        self.duplicates_removed += int((~new).sum())
+        return df[new].copy()
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            os.remove(self._spill_path)
+            self._spill = None
+
+
+def clean_stream(input_path, chunk_size=1_000_000, max_memory_keys=5_000_000, spill_dir=None, stats=None):
+    """Limpa a entrada em blocos de memória limitada, gerando os blocos processados.
+
+    Cada bloco gerado já está sem nulos tratados, sem duplicatas globais e com os
+    atributos de data. Se stats (dict) for informado, recebe as contagens da limpeza.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(rows_in=0, rows_removed_region=0, duplicates_removed=0, rows_out=0)
+    dedup = RowHashDeduplicator(max_memory_keys=max_memory_keys, spill_dir=spill_dir)
+    chunks = storage.iter_table(input_path, chunk_size, parse_dates=['Date'])
+    try:
+        while True:
+            with instrumentation.stage('load', path=input_path) as st:
+                chunk = next(chunks, None)
+                st.set(rows_out=0 if chunk is None else len(chunk))
+            if chunk is None:
+                break
+            with instrumentation.stage('schema', rows_in=len(chunk)):
+                chunk = schema.apply(chunk)
+            stats['rows_in'] += len(chunk)
+            with instrumentation.stage('clean.nulls', rows_in=len(chunk)) as st:
+                cleaned = handle_nulls(chunk)
+                st.set(rows_out=len(cleaned))
+            stats['rows_removed_region'] += len(chunk) - len(cleaned)
+            with instrumentation.stage('clean.dedup', rows_in=len(cleaned)) as st:
+                cleaned = dedup.filter(cleaned)
+                st.set(rows_out=len(cleaned))
+            stats['duplicates_removed'] = dedup.duplicates_removed
+            stats['rows_out'] += len(cleaned)
+            with instrumentation.stage('features', rows_in=len(cleaned)):
+                cleaned = add_date_features(cleaned)
+            yield cleaned
+    finally:
+        dedup.close()
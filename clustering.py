@@ -0,0 +1,154 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+# --- Clustering K-Means Escalável ---
+#
+# - algorithm='kmeans': KMeans completo (mesmos parâmetros do script original).
+# - algorithm='minibatch': MiniBatchKMeans, que ajusta em lotes e escala para milhões de clientes.
+# A busca do cotovelo ajusta cada k num processo separado, a escolha de k é automática
+# (joelho da curva de WCSS ou silhouette amostrado) e o modelo final pode ser salvo para
+# iniciar a próxima execução a partir dos centróides anteriores (warm start).
+
+kmeans_params = {'init': 'k-means++', 'n_init': 10, 'max_iter': 300, 'random_state': 42}
+minibatch_params = {'init': 'k-means++', 'n_init': 3, 'max_iter': 100, 'batch_size': 4096, 'random_state': 42}
+
+
+feature_columns = ['Recency', 'Frequency', 'MonetaryValue']
+
+
+def scale_features(rfm_df):
+    """log1p (para atenuar valores extremos) + StandardScaler das métricas RFM.
+
+    Retorna o scaler ajustado e o DataFrame padronizado.
+    """
+    scaler = StandardScaler()
+    scaled = scaler.fit_transform(np.log1p(rfm_df[feature_columns]))
+    return scaler, pd.DataFrame(scaled, index=rfm_df.index, columns=feature_columns)
+
+
+def choose_k(X, wcss, k_selection='elbow', k_values=range(1, 11), algorithm='kmeans', sample_size=10_000,
+             workers=None):
+    """(k final, silhouettes por k ou None): joelho do cotovelo ('elbow'), maior silhouette amostrado
+    ('silhouette') ou um inteiro fixo."""
+    if k_selection == 'elbow':
+        return select_k_elbow(wcss), None
+    if k_selection == 'silhouette':
+        return select_k_silhouette(X, [k for k in k_values if k >= 2], algorithm=algorithm, sample_size=sample_size,
+                                   workers=workers)
+    return int(k_selection), None
+
+
+def make_model(k, algorithm='kmeans', init=None):
+    """Cria o estimador; init (array de centróides) faz warm start com uma única inicialização."""
+    params = dict(kmeans_params if algorithm == 'kmeans' else minibatch_params)
+    if init is not None:
+        params.update(init=init, n_init=1)
+    if algorithm == 'kmeans':
+        return KMeans(n_clusters=k, **params)
+    if algorithm == 'minibatch':
+        return MiniBatchKMeans(n_clusters=k, **params)
+    raise ValueError(f"Algoritmo de clustering desconhecido: {algorithm!r} (use 'kmeans' ou 'minibatch')")
+
+
+def _attach(shared):
+    name, shape, dtype = shared
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _fit_task(args):
+    shared, k, algorithm, threads, task = args
+    memory, X = _attach(shared) # Matriz lida da memória compartilhada, sem cópia por tarefa
+    try:
+        # Limita as threads OpenMP/BLAS de cada processo para não disputar os núcleos entre si
+        with threadpool_limits(limits=threads):
+            model = make_model(k, algorithm).fit(X)
+            return k, model.inertia_ if task == 'inertia' else model.labels_
+    finally:
+        del X
+        memory.close()
+
+
+def _map_k(X, k_values, algorithm, workers, task):
+    """Ajusta um modelo por k num pool de processos; X fica numa única cópia em memória compartilhada."""
+    X = np.ascontiguousarray(X, dtype=float)
+    k_values = list(k_values)
+    workers = min(workers or os.cpu_count() or 1, len(k_values))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    memory = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+    try:
+        np.ndarray(X.shape, dtype=X.dtype, buffer=memory.buf)[:] = X
+        tasks = [((memory.name, X.shape, X.dtype.str), k, algorithm, threads, task) for k in k_values]
+        if workers <= 1:
+            return dict(map(_fit_task, tasks))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(_fit_task, tasks))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def elbow_search(X, k_values=range(1, 11), algorithm='kmeans', workers=None):
+    """WCSS (inertia) de cada k, com os ajustes distribuídos num pool de processos."""
+    return _map_k(X, k_values, algorithm, workers, 'inertia')
+
+
+def select_k_elbow(wcss):
+    """Joelho da curva de WCSS: o k mais distante da reta entre o primeiro e o último ponto (Kneedle)."""
+    ks = np.array(sorted(wcss))
+    values = np.array([wcss[k] for k in ks], dtype=float)
+    if len(ks) < 3:
+        return int(ks[-1])
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (values - values.min()) / (values.max() - values.min() or 1.0)
+    # Reta de (0, y0) a (1, y1); para uma curva decrescente e convexa o joelho maximiza a distância até ela
+    distance = (y[0] + (y[-1] - y[0]) * x) - y
+    return int(ks[np.argmax(distance)])
+
+
+def select_k_silhouette(X, k_values=range(2, 11), algorithm='kmeans', sample_size=10_000, random_state=42,
+                        workers=None):
+    """(k com maior silhouette, silhouettes por k); cada k é ajustado e avaliado na mesma amostra
+    de sample_size clientes, com os ajustes distribuídos no pool."""
+    X = np.asarray(X, dtype=float)
+    if len(X) > sample_size:
+        X = X[np.random.default_rng(random_state).choice(len(X), sample_size, replace=False)]
+    labels = _map_k(X, [k for k in k_values if k >= 2], algorithm, workers, 'labels')
+    scores = {k: silhouette_score(X, labels[k]) for k in sorted(labels)}
+    return max(scores, key=scores.get), scores
+
+
+def load_model(path):
+    """Carrega o modelo salvo (ou None se não existir)."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_model(model, path):
+    with open(path, 'wb') as f:
+        pickle.dump(model, f)
+
+
+def fit_final(X, k, algorithm='kmeans', warm_start_path=None):
+    """Ajusta o modelo final; se houver um modelo salvo com o mesmo k, parte dos seus centróides.
+
+    Retorna o modelo ajustado (salvo em warm_start_path, quando informado).
+    """
+    previous = load_model(warm_start_path)
+    init = None
+    if previous is not None and previous.n_clusters == k and previous.cluster_centers_.shape[1] == np.shape(X)[1]:
+        init = previous.cluster_centers_
+    model = make_model(k, algorithm, init=init).fit(X)
+    if warm_start_path:
+        save_model(model, warm_start_path)
+    return model
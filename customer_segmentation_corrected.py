@@ -1,46 +1,74 @@
-import pandas as pd
-import numpy as np
-import sqlite3
 import datetime as dt
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
 import os
 
+import clustering
+import instrumentation
+import plotting
+import rfm
+import schema
+import storage
+from segmentation_model import SegmentationModel, sketch_edges
+from rfm_state import RFMStateStore
+
 # --- Configurações e Funções Auxiliares ---
 
-db_path = '/home/ubuntu/sales_database.db'
-processed_data_path = '/home/ubuntu/online_sales_processed.csv'
-output_plot_dir = '/home/ubuntu/plots'
-output_segmented_data_path = '/home/ubuntu/customer_segments.csv'
+db_path = storage.data_path('sales_database.db')
+storage_format = storage.default_format
+processed_data_path = storage.table_path(storage.data_path('online_sales_processed.csv'), storage_format)
+output_plot_dir = storage.data_path('plots')
+output_segmented_data_path = storage.data_path('customer_segments.csv')
+
+# RFM incremental: o estado por cliente é persistido e cada execução incorpora apenas o delta
+incremental_rfm = False
+rfm_state_path = storage.data_path('rfm_state.npz')
+rfm_delta_path = None # Lote novo (mesmo esquema dos dados processados); se None, usa os pedidos com OrderID acima do último incorporado
 
 # Garante que o diretório de plots exista
 if not os.path.exists(output_plot_dir):
     os.makedirs(output_plot_dir)
 
-# Configurações de plotagem
-sns.set_style("whitegrid")
-plt.rcParams["figure.figsize"] = (10, 6)
-
-def save_plot(filename, fig=None):
-    """Salva a figura atual ou especificada no diretório de plots."""
-    if fig:
-        fig.savefig(os.path.join(output_plot_dir, filename), bbox_inches='tight')
-    else:
-        plt.savefig(os.path.join(output_plot_dir, filename), bbox_inches='tight')
-    plt.close() # Fecha a figura para liberar memória
-    print(f"Gráfico salvo: {filename}")
+# Configurações de plotagem (gráficos desenhados em processos separados, com cache; ver plotting.py)
+plot_rc = {"figure.figsize": (10, 6)}
+plot_workers = None
+plots = plotting.PlotRenderer(output_plot_dir, workers=plot_workers, rc=plot_rc)
+
+# Scores RFM: 'exact' (pd.qcut sobre todos os clientes) ou 'sketch' (quintis aproximados via KLL)
+score_method = 'exact'
+sketch_k = 200 # Maior k = menor erro (≈ 2.3 / k^0.97 de erro de rank)
+sketch_partitions = 1 # Partições com sketches independentes, combinados ao final
+sketch_workers = None # Processos para construir os sketches das partições
+sketch_compare_exact = True # Relata o erro em relação ao qcut exato (requer o cálculo exato)
+rank_first = True # F_Score sobre Frequency.rank(method='first'), como no cálculo original
+score_duplicates = 'drop' # Tratamento de limites de quantis repetidos ('drop' ou 'raise')
+
+# K-Means: 'kmeans' (completo) ou 'minibatch'; k escolhido pelo joelho do cotovelo ('elbow'),
+# por silhouette amostrado ('silhouette') ou fixo (um inteiro)
+clustering_algorithm = 'kmeans'
+k_selection = 'elbow'
+elbow_k_values = range(1, 11)
+elbow_workers = None # Processos para a busca do cotovelo (None = todos os núcleos)
+silhouette_sample_size = 10_000
+kmeans_model_path = storage.data_path('kmeans_model.pkl') # Modelo final, reutilizado como warm start na próxima execução
+segmentation_model_dir = storage.data_path('models') # Artefatos versionados para scoring (ver segmentation_model.py)
 
 # --- Carregamento dos Dados Processados ---
 
-print(f"Carregando dados processados de {processed_data_path}...")
-# Ler CustomerID como string inicialmente para evitar problemas com -1 se lido como float
-df = pd.read_csv(processed_data_path, parse_dates=["Date"], dtype={'CustomerID': str})
+input_data_path = rfm_delta_path if incremental_rfm and rfm_delta_path else processed_data_path
+print(f"Carregando dados processados de {input_data_path}...")
+# Projeta apenas as colunas usadas no RFM; CustomerID como Int64 para evitar problemas com -1 se lido como float
+rfm_columns = ["OrderID", "CustomerID", "Date", "TotalPrice"]
+with instrumentation.stage('load', path=input_data_path) as st:
+    loaded_df = storage.read_table(input_data_path, columns=rfm_columns, parse_dates=["Date"], dtype={'CustomerID': 'Int64'})
+    st.set(rows_out=len(loaded_df), bytes_read=lambda: instrumentation.path_size(input_data_path))
+with instrumentation.stage('schema', rows_in=len(loaded_df)):
+    df = schema.apply(loaded_df) # OrderID/CustomerID em int32, Date em datetime64[s]
+print(f"Memória dos dados carregados: {loaded_df.memory_usage(deep=True).sum() / 1024 ** 2:.2f} MB -> "
+      f"{df.memory_usage(deep=True).sum() / 1024 ** 2:.2f} MB com os tipos compactos")
+del loaded_df
 
 # Filtrar clientes válidos (excluir o ID -1 usado para preencher NaNs, se houver)
-df = df[df["CustomerID"] != '-1']
-df["CustomerID"] = df["CustomerID"].astype(int) # Converter para int após filtrar
+df = df[df["CustomerID"] != -1]
+df["CustomerID"] = df["CustomerID"].astype('int32') # Converter para int após filtrar
 
 print(f"Número de registros após filtrar clientes inválidos: {len(df)}")
 
@@ -48,17 +76,27 @@ print(f"Número de registros após filtrar clientes inválidos: {len(df)}")
 
 print("\n--- Iniciando Cálculo RFM ---")
 
-# Definir a data de referência para cálculo da Recência (um dia após a última data no dataset)
-max_date = df["Date"].max()
-reference_date = max_date + dt.timedelta(days=1)
-print(f"Data de referência para Recência: {reference_date.strftime('%Y-%m-%d')}")
+with instrumentation.stage('rfm', rows_in=len(df)) as st:
+    if incremental_rfm:
+        state = RFMStateStore.load_or_create(rfm_state_path)
+        delta = df if rfm_delta_path else df[df["OrderID"] > state.max_order_id]
+        print(f"RFM incremental: {len(state)} clientes no estado, incorporando {len(delta)} novas transações...")
+        state.update(delta)
+        state.save(rfm_state_path)
+
+        # Recência derivada na consulta, a partir da nova data de referência
+        reference_date = state.reference_date()
+        print(f"Data de referência para Recência: {reference_date.strftime('%Y-%m-%d')}")
+        rfm_df = state.to_rfm(reference_date)
+    else:
+        # Definir a data de referência para cálculo da Recência (um dia após a última data no dataset)
+        max_date = df["Date"].max()
+        reference_date = max_date + dt.timedelta(days=1)
+        print(f"Data de referência para Recência: {reference_date.strftime('%Y-%m-%d')}")
 
-# Calcular RFM usando agregação com Pandas
-rfm_df = df.groupby("CustomerID").agg(
-    Recency=("Date", lambda date: (reference_date - date.max()).days),
-    Frequency=("OrderID", "nunique"),
-    MonetaryValue=("TotalPrice", "sum")
-).reset_index()
+        # Calcular RFM usando agregações nativas do Pandas (max/nunique/sum) e subtração vetorizada
+        rfm_df = rfm.compute_rfm(df, reference_date)
+    st.set(rows_out=len(rfm_df))
 
 print("\nDataFrame RFM inicial:")
 print(rfm_df.head())
@@ -68,56 +106,36 @@ print(f"\nNúmero de clientes únicos: {len(rfm_df)}")
 
 print("\n--- Calculando Scores RFM (usando quantis) ---")
 
-# Criar labels para os scores (1=pior, 5=melhor)
-r_labels = range(5, 0, -1)
-f_labels = range(1, 6)
-m_labels = range(1, 6)
-
-# Calcular scores usando qcut
-rfm_df["R_Score"] = pd.qcut(rfm_df["Recency"], q=5, labels=r_labels, duplicates='drop').astype(int)
-rfm_df["F_Score"] = pd.qcut(rfm_df["Frequency"].rank(method='first'), q=5, labels=f_labels, duplicates='drop').astype(int)
-rfm_df["M_Score"] = pd.qcut(rfm_df["MonetaryValue"], q=5, labels=m_labels, duplicates='drop').astype(int)
+# Labels dos scores (1=pior, 5=melhor) em rfm.score_labels
+with instrumentation.stage('scoring', rows_in=len(rfm_df), method=score_method):
+    if score_method == 'sketch':
+        scores, sketches = rfm.score_sketch(rfm_df, k=sketch_k, partitions=sketch_partitions, workers=sketch_workers,
+                                            rank_first=rank_first, duplicates=score_duplicates)
+        if sketch_compare_exact:
+            print("\nErro dos scores aproximados (sketch KLL) em relação ao qcut exato:")
+            print(rfm.sketch_error_report(rfm_df, rfm.score_exact(rfm_df, rank_first, score_duplicates), scores, sketches).round(4))
+        score_edges = sketch_edges(sketches, score_duplicates) # Limites do modelo salvo, sem o qcut exato
+    else:
+        # Calcular scores usando qcut
+        scores = rfm.score_exact(rfm_df, rank_first=rank_first, duplicates=score_duplicates)
+        score_edges = None # O modelo salvo calcula os limites exatos (quintile_edges)
+# Scores, RFM_Score ('RFM' concatenado), RFM_Sum_Score e Segment (tabela 5x5 indexada pelos scores R e F)
+with instrumentation.stage('segments', rows_in=len(rfm_df)):
+    rfm_df = rfm.add_scores(rfm_df, scores)
 
 print("\nScores RFM calculados:")
 print(rfm_df[["CustomerID", "Recency", "Frequency", "MonetaryValue", "R_Score", "F_Score", "M_Score"]].head())
 
-# Combinar scores para obter RFM_Score
-rfm_df["RFM_Score"] = rfm_df["R_Score"].astype(str) + rfm_df["F_Score"].astype(str) + rfm_df["M_Score"].astype(str)
-
-# Calcular score agregado
-rfm_df["RFM_Sum_Score"] = rfm_df["R_Score"] + rfm_df["F_Score"] + rfm_df["M_Score"]
-
 # --- Segmentação Baseada em Scores RFM ---
 
 print("\n--- Segmentando clientes com base nos Scores RFM ---")
 
-segment_map = {
-    r'[1-2][1-2]': 'Hibernando',
-    r'[1-2][3-4]': 'Em Risco',
-    r'[1-2]5': 'Não Pode Perder',
-    r'3[1-2]': 'Quase Dormindo',
-    r'33': 'Precisa Atenção',
-    r'[3-4][4-5]': 'Clientes Leais',
-    r'41': 'Promissor',
-    r'51': 'Novos Clientes',
-    r'[4-5][2-3]': 'Potenciais Leais',
-    r'5[4-5]': 'Campeões'
-}
-
-rfm_df["Segment_RFM_Score"] = rfm_df["R_Score"].astype(str) + rfm_df["F_Score"].astype(str)
-rfm_df["Segment"] = rfm_df["Segment_RFM_Score"].replace(segment_map, regex=True)
-
 print("\nDistribuição dos Segmentos RFM:")
 segment_counts = rfm_df["Segment"].value_counts()
 print(segment_counts)
 
 # Visualizar distribuição dos segmentos
-fig = plt.figure(figsize=(12, 7))
-sns.barplot(x=segment_counts.values, y=segment_counts.index, palette='viridis')
-plt.title("Distribuição dos Clientes por Segmento RFM")
-plt.xlabel("Número de Clientes")
-plt.ylabel("Segmento")
-save_plot("09_rfm_segment_distribution.png", fig)
+plotting.submit_segment_distribution(plots, segment_counts)
 
 # --- Análise dos Segmentos --- 
 
@@ -135,39 +153,30 @@ print(segment_analysis)
 
 print("\n--- Iniciando Segmentação com K-Means (Opcional) ---")
 
-# Selecionar apenas as métricas RFM para clustering
-rfm_for_clustering = rfm_df[["Recency", "Frequency", "MonetaryValue"]]
-
-# Lidar com valores extremos (ex: usando log transform)
-rfm_log = np.log1p(rfm_for_clustering)
-
-# Padronizar os dados
-scaler = StandardScaler()
-rfm_scaled = scaler.fit_transform(rfm_log)
-rfm_scaled_df = pd.DataFrame(rfm_scaled, index=rfm_df.index, columns=['Recency', 'Frequency', 'MonetaryValue'])
+# Métricas RFM com log1p (atenua valores extremos) e padronizadas
+with instrumentation.stage('clustering.scale', rows_in=len(rfm_df)):
+    scaler, rfm_scaled_df = clustering.scale_features(rfm_df)
 
 # Determinar número ótimo de clusters (Método do Cotovelo)
 print("Calculando WCSS para o Método do Cotovelo...")
-wcss = {}
-for k in range(1, 11):
-    kmeans = KMeans(n_clusters=k, init='k-means++', n_init=10, max_iter=300, random_state=42)
-    kmeans.fit(rfm_scaled_df)
-    wcss[k] = kmeans.inertia_
+# Cada k é ajustado num processo separado
+with instrumentation.stage('clustering.elbow', rows_in=len(rfm_df), k_values=list(elbow_k_values)):
+    wcss = clustering.elbow_search(rfm_scaled_df, elbow_k_values, algorithm=clustering_algorithm, workers=elbow_workers)
 
 # Plotar o gráfico do cotovelo
-fig = plt.figure()
-plt.plot(list(wcss.keys()), list(wcss.values()), marker='o')
-plt.title("Método do Cotovelo para K-Means")
-plt.xlabel("Número de Clusters (k)")
-plt.ylabel("WCSS (Within-Cluster Sum of Squares)")
-plt.grid(True)
-save_plot("10_kmeans_elbow_method.png", fig)
-
-# Escolher o número de clusters (ex: baseado no cotovelo, digamos k=4)
-k_optimal = 4
+plotting.submit_elbow(plots, wcss)
+
+# Escolher o número de clusters automaticamente (joelho da curva ou silhouette)
+k_optimal, silhouettes = clustering.choose_k(rfm_scaled_df, wcss, k_selection, elbow_k_values, clustering_algorithm,
+                                            silhouette_sample_size, workers=elbow_workers)
+if k_selection == 'elbow':
+    print(f"\nJoelho da curva do cotovelo em k={k_optimal}")
+elif silhouettes:
+    print(f"\nSilhouette (amostra de {silhouette_sample_size}) por k: " + ", ".join(f"{k}={v:.3f}" for k, v in silhouettes.items()))
 print(f"\nExecutando K-Means com k={k_optimal}...")
-kmeans = KMeans(n_clusters=k_optimal, init='k-means++', n_init=10, max_iter=300, random_state=42)
-rfm_df["KMeans_Cluster"] = kmeans.fit_predict(rfm_scaled_df)
+with instrumentation.stage('clustering.fit', rows_in=len(rfm_df), k=k_optimal):
+    kmeans = clustering.fit_final(rfm_scaled_df, k_optimal, algorithm=clustering_algorithm, warm_start_path=kmeans_model_path)
+    rfm_df["KMeans_Cluster"] = kmeans.predict(rfm_scaled_df)
 
 print("\nDistribuição dos Clusters K-Means:")
 cluster_counts = rfm_df["KMeans_Cluster"].value_counts()
@@ -184,22 +193,30 @@ kmeans_analysis = rfm_df.groupby("KMeans_Cluster").agg(
 
 print(kmeans_analysis)
 
-# Visualizar Clusters (exemplo 2D - Recency vs Monetary)
-fig = plt.figure(figsize=(10, 8))
-sns.scatterplot(data=rfm_df, x='Recency', y='MonetaryValue', hue='KMeans_Cluster', palette='Set1', s=50, alpha=0.7)
-plt.title("Clusters K-Means (Recency vs MonetaryValue)")
-plt.xlabel("Recência (Dias)")
-plt.ylabel("Valor Monetário Total")
-plt.legend(title='Cluster')
-save_plot("11_kmeans_clusters_2d.png", fig)
+# Visualizar Clusters (exemplo 2D - Recency vs Monetary), com no máximo plotting.max_scatter_points clientes
+plotting.submit_cluster_scatter(plots, rfm_df)
+
+# --- Salvar Modelo de Segmentação (quintis RFM + log1p/scaler + K-Means) ---
+
+segmentation_model = SegmentationModel.from_fit(rfm_df, scaler, kmeans, reference_date=reference_date,
+                                                rank_first=rank_first, duplicates=score_duplicates, score_edges=score_edges)
+model_path = segmentation_model.save(segmentation_model_dir)
+print(f"\nModelo de segmentação v{segmentation_model.version} salvo em {model_path}")
+# A API pontua empates por valor; o CSV mantém os scores do qcut/sketch (ver segmentation_model.py)
+rescored = segmentation_model.score_batch(rfm_df)
+print("Concordância do modelo salvo com esta execução (empates pontuados por valor na API): "
+      f"Segment {(rescored['Segment'] == rfm_df['Segment']).mean():.2%}, "
+      f"KMeans_Cluster {(rescored['KMeans_Cluster'] == rfm_df['KMeans_Cluster']).mean():.2%}")
 
 # --- Salvar Resultados da Segmentação ---
 
-# Remover coluna auxiliar antes de salvar
-rfm_df_final = rfm_df.drop(columns=['Segment_RFM_Score'])
+rfm_df_final = rfm_df
 
 print(f"\nSalvando dados segmentados em {output_segmented_data_path}...")
-rfm_df_final.to_csv(output_segmented_data_path, index=False)
+with instrumentation.stage('save_segments', rows_in=len(rfm_df_final), path=output_segmented_data_path) as st:
+    rfm_df_final.to_csv(output_segmented_data_path, index=False)
+    st.set(bytes_written=lambda: instrumentation.path_size(output_segmented_data_path))
 
+plots.close() # Aguarda os gráficos em renderização
 print("\n--- Análise de Segmentação Concluída ---")
 
@@ -0,0 +1,221 @@
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+from threadpoolctl import threadpool_limits
+
+import instrumentation
+import sales_db
+import storage
+
+# --- Previsão de Vendas por Série (Category x Region) a partir dos Agregados Diários ---
+#
+# As vendas diárias de todas as séries formam uma matriz séries x dias (0 nos dias sem venda).
+# Três modelos por série:
+# - seasonal_naive: média dos últimos baseline_weeks valores do mesmo dia da semana;
+# - exp_smoothing: Holt-Winters aditivo (nível + sazonalidade semanal), com alpha/gamma
+#   escolhidos por série numa grade, todas as séries e combinações atualizadas juntas a cada dia;
+# - gbm_lags: HistGradientBoosting por série com defasagens >= horizonte (previsão direta dos
+#   `horizon` dias com um único predict, sem recursão) e atributos de calendário.
+# As séries são divididas em blocos ajustados num pool de processos. O backtest separa os últimos
+# `horizon` dias, calcula MAE/RMSE/WAPE de todas as séries e modelos em operações de matriz e
+# escolhe o modelo de menor WAPE de cada série; as previsões (de todos os modelos, com o
+# escolhido marcado) voltam para o SQLite.
+
+horizon = 28 # Dias previstos (e tamanho do holdout do backtest)
+season_length = 7 # Sazonalidade semanal
+baseline_weeks = 4
+es_alphas = [0.05, 0.1, 0.2, 0.3, 0.5]
+es_gammas = [0.05, 0.1, 0.2, 0.4]
+gbm_lag_weeks = 4 # Defasagens horizon, horizon+7, ..., horizon+7*(gbm_lag_weeks-1)
+# Poucos bins/iterações: metade do tempo de ajuste dos padrões, com o mesmo WAPE no backtest
+gbm_params = {'max_iter': 60, 'learning_rate': 0.08, 'max_bins': 31, 'max_leaf_nodes': 15, 'early_stopping': False,
+              'random_state': 42}
+model_names = ['seasonal_naive', 'exp_smoothing', 'gbm_lags']
+default_keys = ['Category', 'Region']
+forecast_table = 'sales_forecasts'
+backtest_table = 'forecast_backtest'
+
+
+def daily_matrix(df, keys=default_keys):
+    """(chaves das séries, dias, matriz séries x dias) das vendas diárias, com 0 nos dias sem venda."""
+    day = df['Date'].dt.normalize().rename('Day')
+    sums = df.groupby([df[k] for k in keys] + [day], observed=True)['TotalPrice'].sum()
+    days = pd.date_range(day.min(), day.max(), freq='D')
+    wide = sums.unstack('Day').reindex(columns=days, fill_value=0).fillna(0)
+    return wide.index.to_frame(index=False), days, wide.to_numpy(dtype=np.float64)
+
+
+# --- Modelos (vetorizados sobre as séries, exceto o ajuste do GBM) ---
+
+def seasonal_baseline(y, horizon=horizon, season_length=season_length, weeks=baseline_weeks):
+    """Média dos últimos `weeks` valores de cada fase da sazonalidade."""
+    window = y[:, y.shape[1] - weeks * season_length:].reshape(len(y), weeks, season_length).mean(axis=1)
+    # A janela começa num múltiplo de season_length antes do fim: a fase do dia T+h é h % season_length
+    return window[:, np.arange(horizon) % season_length]
+
+
+def exp_smoothing(y, horizon=horizon, season_length=season_length, alphas=es_alphas, gammas=es_gammas):
+    """Holt-Winters aditivo sem tendência; alpha/gamma de menor erro um passo à frente por série."""
+    grid = np.meshgrid(np.asarray(alphas, dtype=np.float64), np.asarray(gammas, dtype=np.float64), indexing='ij')
+    alpha, gamma = (g.reshape(-1, 1) for g in grid) # (combinações, 1)
+    n_series, n_days = y.shape
+    level = np.broadcast_to(y[:, :season_length].mean(axis=1), (len(alpha), n_series)).copy()
+    season = np.broadcast_to(y[:, :season_length] - y[:, :season_length].mean(axis=1, keepdims=True),
+                             (len(alpha), n_series, season_length)).copy()
+    sse = np.zeros((len(alpha), n_series))
+    for t in range(season_length, n_days):
+        phase = t % season_length
+        error = y[:, t] - (level + season[:, :, phase])
+        sse += error ** 2
+        level += alpha * error
+        season[:, :, phase] += gamma * (1 - alpha) * error
+    best = sse.argmin(axis=0)
+    series = np.arange(n_series)
+    phases = (n_days + np.arange(horizon)) % season_length
+    return level[best, series][:, None] + season[best, series][:, phases]
+
+
+def gbm_features(y, days, horizon=horizon, lag_weeks=gbm_lag_weeks, season_length=season_length):
+    """Atributos (séries x dias x atributos) de cada dia até days[-1] + horizon, só com defasagens >= horizon."""
+    n_series, n_days = y.shape
+    total = n_days + horizon
+    y_ext = np.concatenate([y, np.full((n_series, horizon), np.nan)], axis=1)
+    cumsum = np.concatenate([np.zeros((n_series, 1)), np.cumsum(y, axis=1)], axis=1)
+    t = np.arange(total)
+    features = []
+    for k in range(lag_weeks):
+        lag = t - horizon - k * season_length
+        features.append(np.where(lag >= 0, y_ext[:, np.clip(lag, 0, None)], np.nan))
+    for window in (season_length, lag_weeks * season_length):
+        end = t - horizon + 1 # Soma de y[end - window:end]
+        valid = end - window >= 0
+        rolled = (cumsum[:, np.clip(end, 0, n_days)] - cumsum[:, np.clip(end - window, 0, n_days)]) / window
+        features.append(np.where(valid, rolled, np.nan))
+    calendar = pd.date_range(days[0], periods=total, freq='D')
+    for values in (calendar.dayofweek, calendar.day, calendar.month):
+        features.append(np.broadcast_to(np.asarray(values, dtype=np.float64), (n_series, total)))
+    return np.stack(features, axis=2)
+
+
+def gbm_lags(y, days, horizon=horizon, params=gbm_params):
+    """Um HistGradientBoosting por série, treinado nos dias com todas as defasagens disponíveis."""
+    X = gbm_features(y, days, horizon)
+    n_days = y.shape[1]
+    first = horizon + gbm_lag_weeks * season_length # Primeiro dia com a média de 4 semanas completa
+    if n_days - first < 2 * season_length:
+        return seasonal_baseline(y, horizon) # Histórico curto demais para treinar
+    forecasts = np.empty((len(y), horizon))
+    for s in range(len(y)):
+        model = HistGradientBoostingRegressor(**params).fit(X[s, first:n_days], y[s, first:])
+        forecasts[s] = model.predict(X[s, n_days:])
+    return forecasts
+
+
+models = {'seasonal_naive': seasonal_baseline, 'exp_smoothing': exp_smoothing, 'gbm_lags': gbm_lags}
+
+
+def forecast_all(y, days, horizon=horizon):
+    """Previsões (modelos x séries x horizon) dos três modelos, sem valores negativos."""
+    out = np.empty((len(model_names), len(y), horizon))
+    for i, name in enumerate(model_names):
+        fit = models[name]
+        out[i] = fit(y, days, horizon) if name == 'gbm_lags' else fit(y, horizon)
+    return np.clip(out, 0, None)
+
+
+def _fit_chunk(args):
+    y, days, horizon, threads = args
+    # Limita as threads OpenMP do HistGradientBoosting para não disputar os núcleos entre processos
+    with threadpool_limits(limits=threads):
+        backtest = forecast_all(y[:, :-horizon], days[:-horizon], horizon)
+        final = forecast_all(y, days, horizon)
+    return backtest, final
+
+
+def fit_series(y, days, horizon=horizon, workers=None, series_per_task=None):
+    """(previsões do backtest, previsões finais), cada uma modelos x séries x horizon.
+
+    As séries são ajustadas em blocos de series_per_task num pool de processos.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(y)))
+    series_per_task = series_per_task or max(1, math.ceil(len(y) / (workers * 4)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    tasks = [(y[i:i + series_per_task], days, horizon, threads) for i in range(0, len(y), series_per_task)]
+    if workers <= 1 or len(tasks) == 1:
+        results = list(map(_fit_chunk, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_fit_chunk, tasks))
+    return tuple(np.concatenate([r[i] for r in results], axis=1) for i in range(2))
+
+
+def backtest_metrics(actual, forecasts):
+    """MAE, RMSE e WAPE (modelos x séries) do holdout, calculados de uma vez para todas as séries."""
+    error = forecasts - actual[None]
+    totals = np.abs(actual).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wape = np.where(totals > 0, np.abs(error).sum(axis=2) / totals, np.nan)
+    return {'MAE': np.abs(error).mean(axis=2), 'RMSE': np.sqrt((error ** 2).mean(axis=2)), 'WAPE': wape}
+
+
+def run_forecasts(df, keys=default_keys, horizon=horizon, workers=None, series_per_task=None):
+    """(previsões, backtest) em formato longo; a coluna Selected marca o modelo escolhido de cada série."""
+    with instrumentation.stage('forecast.daily_matrix', rows_in=len(df)) as st:
+        series_keys, days, y = daily_matrix(df, keys)
+        st.set(series=len(y), days=len(days))
+    if len(days) < 2 * horizon + gbm_lag_weeks * season_length:
+        raise ValueError(f"Histórico de {len(days)} dias é curto demais para horizon={horizon}")
+    with instrumentation.stage('forecast.fit', series=len(y), horizon=horizon):
+        backtest, final = fit_series(y, days, horizon, workers, series_per_task)
+    metrics = backtest_metrics(y[:, -horizon:], backtest)
+    selected = np.nan_to_num(metrics['WAPE'], nan=np.inf).argmin(axis=0) # Modelo escolhido por série
+
+    n_models, n_series = len(model_names), len(y)
+    model_index = np.repeat(np.arange(n_models), n_series)
+    series_index = np.tile(np.arange(n_series), n_models)
+    backtest_df = series_keys.iloc[series_index].reset_index(drop=True)
+    backtest_df['Model'] = np.array(model_names)[model_index]
+    for name, values in metrics.items():
+        backtest_df[name] = values.ravel()
+    backtest_df['Selected'] = (selected[series_index] == model_index).astype(np.int8)
+    backtest_df['HoldoutStart'] = days[-horizon]
+
+    forecast_df = backtest_df[keys + ['Model', 'Selected']].loc[np.repeat(np.arange(len(backtest_df)), horizon)]
+    forecast_df = forecast_df.reset_index(drop=True)
+    forecast_df.insert(len(keys), 'Date', np.tile(pd.date_range(days[-1] + pd.Timedelta(days=1), periods=horizon), len(backtest_df)))
+    forecast_df['Forecast'] = final.reshape(-1, horizon).ravel().round(2)
+    return forecast_df, backtest_df
+
+
+def store_forecasts(db_path, forecast_df, backtest_df, keys=default_keys):
+    """Regrava as tabelas de previsões e de backtest no banco SQLite."""
+    with instrumentation.stage('forecast.store', rows_in=len(forecast_df)), sales_db.SalesDatabase(db_path) as db:
+        db.replace_table(forecast_df, forecast_table, primary_key=keys + ['Date', 'Model'])
+        db.replace_table(backtest_df, backtest_table, primary_key=keys + ['Model'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Previsão de vendas diárias por série (padrão: Category x Region).')
+    parser.add_argument('--input', default=storage.table_path(storage.data_path('online_sales_processed.csv')))
+    parser.add_argument('--db', default=storage.data_path('sales_database.db'))
+    parser.add_argument('--by', nargs='+', default=default_keys, help='Colunas que definem cada série')
+    parser.add_argument('--horizon', type=int, default=horizon)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = storage.read_table(args.input, columns=args.by + ['Date', 'TotalPrice'], parse_dates=['Date'])
+    forecast_df, backtest_df = run_forecasts(df, args.by, args.horizon, args.workers)
+    store_forecasts(args.db, forecast_df, backtest_df, args.by)
+    n_series = len(backtest_df) // len(model_names)
+    print(f"{n_series} séries x {len(model_names)} modelos ajustados em {time.perf_counter() - start:.1f}s; "
+          f"previsões de {args.horizon} dias gravadas em '{forecast_table}' e métricas em '{backtest_table}' ({args.db})")
+
+    summary = backtest_df.groupby('Model').agg(WAPE_medio=('WAPE', 'mean'), Series_escolhidas=('Selected', 'sum'))
+    print("\nBacktest (últimos", args.horizon, "dias):")
+    print(summary.round(3).to_string())
@@ -1,28 +1,23 @@
 import pandas as pd
 import numpy as np
-import random
-from datetime import datetime, timedelta
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import schema
+import storage
 
 # Configurações
 num_records = 50000
+chunk_size = 1_000_000 # Linhas geradas e gravadas por bloco (limita o uso de memória)
+seed = 42
+output_path = storage.data_path('online_sales_raw.csv')
+num_workers = os.cpu_count() or 1 # Usado apenas no modo paralelo (--workers)
 start_date = datetime(2023, 1, 1)
 end_date = datetime(2024, 12, 31)
 num_customers = 1000
 
-categories = ['Eletrônicos', 'Vestuário', 'Casa', 'Livros', 'Esportes', 'Alimentos', 'Beleza']
-regions = ['América do Norte', 'Europa', 'Ásia', 'América do Sul', 'Oceania']
-payment_methods = ['Cartão de Crédito', 'Boleto', 'PayPal', 'Pix', 'Transferência']
-
-products = {
-    'Eletrônicos': ['Smartphone XYZ', 'Laptop ABC', 'Fone de Ouvido QWE', 'Smartwatch 123', 'Tablet ZXC'],
-    'Vestuário': ['Camiseta Básica', 'Calça Jeans Slim', 'Jaqueta Corta-Vento', 'Tênis Esportivo', 'Vestido Floral'],
-    'Casa': ['Jogo de Panelas', 'Aspirador Robô', 'Luminária de Mesa LED', 'Conjunto de Toalhas', 'Cafeteira Expressa'],
-    'Livros': ['Ficção Científica Vol. 1', 'Romance Histórico', 'Biografia Inspiradora', 'Suspense Psicológico', 'Livro de Culinária Vegana'],
-    'Esportes': ['Bola de Futebol Oficial', 'Tapete de Yoga', 'Garrafa Térmica', 'Bicicleta Ergométrica', 'Raquete de Tênis Pro'],
-    'Alimentos': ['Café Gourmet 500g', 'Azeite Extra Virgem', 'Chocolate Amargo 70%', 'Mix de Castanhas', 'Chá Verde Orgânico'],
-    'Beleza': ['Protetor Solar FPS 50', 'Creme Hidratante Facial', 'Shampoo Anticaspa', 'Perfume Floral', 'Kit de Maquiagem Básico']
-}
-
 base_prices = {
     'Smartphone XYZ': 2500, 'Laptop ABC': 4500, 'Fone de Ouvido QWE': 300, 'Smartwatch 123': 1200, 'Tablet ZXC': 1800,
     'Camiseta Básica': 50, 'Calça Jeans Slim': 150, 'Jaqueta Corta-Vento': 250, 'Tênis Esportivo': 350, 'Vestido Floral': 200,
@@ -33,77 +28,169 @@ base_prices = {
     'Protetor Solar FPS 50': 50, 'Creme Hidratante Facial': 80, 'Shampoo Anticaspa': 30, 'Perfume Floral': 180, 'Kit de Maquiagem Básico': 150
 }
 
-# Geração dos Dados
-data = []
-order_id_counter = 1
+# --- Tabelas de Códigos (usadas pelo gerador vetorizado) ---
+
+# Faixa contígua de códigos de cada categoria em schema.product_names (vocabulários em schema.py)
+product_offsets = np.cumsum([0] + [len(schema.products[c]) for c in schema.categories[:-1]])
+product_counts = np.array([len(schema.products[c]) for c in schema.categories])
+product_base_prices = np.array([base_prices[p] for p in schema.product_names], dtype=float)
 
 date_range = (end_date - start_date).days
 
-for i in range(num_records):
+columns = ['OrderID', 'CustomerID', 'Date', 'Category', 'ProductName', 'Quantity',
+           'UnitPrice', 'TotalPrice', 'Region', 'PaymentMethod']
+
+
+def generate_chunk(rng, first_order_id, n, num_customers=num_customers):
+    """Gera um bloco de n transações de uma só vez, coluna a coluna, usando o gerador NumPy informado.
+
+    Mantém as mesmas distribuições do gerador original (linha a linha): cliente, data,
+    categoria e produto uniformes, quantidade exponencial com viés para valores baixos,
+    variação de ±5% no preço e 1%/0.5% de CustomerID/Region faltantes.
+    """
     # Cliente Aleatório
-    customer_id = random.randint(1001, 1001 + num_customers -1)
+    customer_id = rng.integers(1001, 1001 + num_customers, size=n)
 
-    # Data Aleatória
-    random_days = random.randint(0, date_range)
-    transaction_date = start_date + timedelta(days=random_days, hours=random.randint(0, 23), minutes=random.randint(0, 59), seconds=random.randint(0, 59))
+    # Data Aleatória (dia + hora/minuto/segundo), em resolução de segundos
+    seconds = (rng.integers(0, date_range + 1, size=n) * 86400
+               + rng.integers(0, 24, size=n) * 3600
+               + rng.integers(0, 60, size=n) * 60
+               + rng.integers(0, 60, size=n))
+    transaction_date = np.datetime64(start_date, 's') + seconds.astype('timedelta64[s]')
 
-    # Categoria e Produto Aleatórios
-    category = random.choice(categories)
-    product_name = random.choice(products[category])
+    # Categoria e Produto Aleatórios (produto uniforme dentro da categoria sorteada)
+    category_code = rng.integers(0, len(schema.categories), size=n)
+    product_code = product_offsets[category_code] + (rng.random(n) * product_counts[category_code]).astype(np.int64)
 
     # Quantidade Aleatória (com viés para quantidades menores)
-    quantity = max(1, int(np.random.exponential(scale=1.5)))
-
-    # Preço Unitário (com pequena variação)
-    base_price = base_prices[product_name]
-    unit_price = round(random.uniform(base_price * 0.95, base_price * 1.05), 2)
+    quantity = np.maximum(1, rng.exponential(scale=1.5, size=n).astype(np.int64))
 
-    # Preço Total
-    total_price = round(quantity * unit_price, 2)
+    # Preço Unitário (com pequena variação) e Preço Total
+    base_price = product_base_prices[product_code]
+    unit_price = np.round(rng.uniform(base_price * 0.95, base_price * 1.05), 2)
+    total_price = np.round(quantity * unit_price, 2)
 
     # Região e Método de Pagamento Aleatórios
-    region = random.choice(regions)
-    payment_method = random.choice(payment_methods)
-
-    # Adiciona um pouco de dados faltantes (ex: 1% de chance de CustomerID faltante)
-    if random.random() < 0.01:
-        customer_id_final = np.nan
-    else:
-        customer_id_final = customer_id
-
-    # Adiciona um pouco de dados faltantes (ex: 0.5% de chance de Região faltante)
-    if random.random() < 0.005:
-        region_final = np.nan
-    else:
-        region_final = region
-
-    data.append({
-        'OrderID': order_id_counter,
-        'CustomerID': customer_id_final,
+    region_code = rng.integers(0, len(schema.regions), size=n)
+    payment_code = rng.integers(0, len(schema.payment_methods), size=n)
+
+    # Dados faltantes: 1% de CustomerID e 0.5% de Região
+    customer_missing = rng.random(n) < 0.01
+    region_code[rng.random(n) < 0.005] = -1 # Código -1 = NaN no Categorical
+
+    return schema.apply(pd.DataFrame({
+        'OrderID': np.arange(first_order_id, first_order_id + n, dtype=np.int64),
+        'CustomerID': pd.arrays.IntegerArray(customer_id, customer_missing),
         'Date': transaction_date,
-        'Category': category,
-        'ProductName': product_name,
+        'Category': pd.Categorical.from_codes(category_code, schema.categories),
+        'ProductName': pd.Categorical.from_codes(product_code, schema.product_names),
         'Quantity': quantity,
         'UnitPrice': unit_price,
         'TotalPrice': total_price,
-        'Region': region_final,
-        'PaymentMethod': payment_method
-    })
-    order_id_counter += 1
-
-# Cria DataFrame
-df = pd.DataFrame(data)
-
-# Garante tipo int para CustomerID, permitindo NaNs
-df['CustomerID'] = df['CustomerID'].astype('Int64')
-
-# Salva em CSV
-output_path = '/home/ubuntu/online_sales_raw.csv'
-df.to_csv(output_path, index=False, date_format='%Y-%m-%d %H:%M:%S')
-
-print(f"Dataset sintético gerado e salvo em {output_path}")
-print(df.head())
-print(f"\nNúmero de registros: {len(df)}")
-print(f"Colunas: {df.columns.tolist()}")
-print(f"\nTipos de dados:\n{df.dtypes}")
-
+        'Region': pd.Categorical.from_codes(region_code, schema.regions),
+        'PaymentMethod': pd.Categorical.from_codes(payment_code, schema.payment_methods),
+    }, columns=columns))
+
+
+def shard_seeds(num_records, chunk_size, seed):
+    """Sementes independentes por shard (bloco de chunk_size linhas), via SeedSequence.spawn.
+
+    O shard i sempre recebe a mesma semente e a faixa de OrderID [i*chunk_size+1, ...],
+    independentemente de quantos processos participem da geração.
+    """
+    num_shards = -(-num_records // chunk_size)
+    return np.random.SeedSequence(seed).spawn(num_shards)
+
+
+def generate_shard(shard_index, shard_seed, num_records, chunk_size, num_customers=num_customers):
+    """Gera o shard indicado com seu próprio gerador e faixa disjunta de OrderIDs."""
+    first = shard_index * chunk_size
+    n = min(chunk_size, num_records - first)
+    return generate_chunk(np.random.default_rng(shard_seed), first + 1, n, num_customers)
+
+
+def iter_chunks(num_records, chunk_size, seed, num_customers=num_customers):
+    """Itera sobre os shards em ordem, com OrderIDs sequenciais a partir de 1."""
+    for i, shard_seed in enumerate(shard_seeds(num_records, chunk_size, seed)):
+        yield generate_shard(i, shard_seed, num_records, chunk_size, num_customers)
+
+
+def generate_dataset(output_path, num_records=num_records, chunk_size=chunk_size, seed=seed, num_customers=num_customers):
+    """Gera o dataset completo bloco a bloco, gravando cada bloco direto no disco.
+
+    O formato (CSV, Parquet ou Arrow) é deduzido da extensão de output_path.
+    Retorna o primeiro bloco gerado (útil para inspeção) sem manter o dataset inteiro em memória.
+    """
+    first_chunk = None
+    with storage.TableWriter(output_path) as writer:
+        for i, chunk in enumerate(iter_chunks(num_records, chunk_size, seed, num_customers)):
+            writer.write(chunk)
+            if first_chunk is None:
+                first_chunk = chunk
+            print(f"Bloco {i + 1}: {chunk['OrderID'].iloc[-1]:,} de {num_records:,} registros gravados")
+    return first_chunk
+
+
+def part_path(output_dir, shard_index, fmt='csv'):
+    """Caminho do arquivo-parte de um shard."""
+    return os.path.join(output_dir, f'part-{shard_index:05d}{storage.EXTENSIONS[fmt]}')
+
+
+def _write_shard(task):
+    """Tarefa executada em cada processo: gera um shard e grava seu arquivo-parte."""
+    shard_index, shard_seed, num_records, chunk_size, output_dir, fmt, num_customers = task
+    chunk = generate_shard(shard_index, shard_seed, num_records, chunk_size, num_customers)
+    path = storage.write_part(chunk, part_path(output_dir, shard_index, fmt))
+    return path, len(chunk)
+
+
+def generate_dataset_parallel(output_dir, num_records=num_records, chunk_size=chunk_size, seed=seed, workers=num_workers, fmt='csv',
+                              num_customers=num_customers):
+    """Gera o dataset em paralelo: um arquivo-parte por shard, distribuídos entre `workers` processos.
+
+    Como sementes e faixas de OrderID dependem apenas do índice do shard, os arquivos-parte
+    são idênticos byte a byte para uma mesma semente, com 1 ou 64 processos.
+    Com fmt='parquet' o diretório de saída é diretamente legível como dataset Parquet.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(i, s, num_records, chunk_size, output_dir, fmt, num_customers)
+             for i, s in enumerate(shard_seeds(num_records, chunk_size, seed))]
+    if workers <= 1:
+        return list(map(_write_shard, tasks))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_write_shard, tasks))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera o dataset sintético de vendas online.')
+    parser.add_argument('--num-records', type=int, default=num_records)
+    parser.add_argument('--chunk-size', type=int, default=chunk_size)
+    parser.add_argument('--seed', type=int, default=seed)
+    parser.add_argument('--num-customers', type=int, default=num_customers)
+    parser.add_argument('--output', default=output_path)
+    parser.add_argument('--format', choices=storage.FORMATS, default=storage.default_format,
+                        help='Formato de saída (csv, parquet particionado ou arrow)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Gera em paralelo, gravando um arquivo-parte por shard no diretório --output-dir')
+    parser.add_argument('--output-dir', default=None)
+    args = parser.parse_args()
+    args.output = storage.table_path(args.output, args.format)
+
+    if args.workers is not None:
+        output_dir = args.output_dir or os.path.splitext(args.output)[0] + '_parts'
+        if args.format == 'parquet' and args.output_dir is None:
+            output_dir = args.output # As partes formam o próprio dataset Parquet
+        parts = generate_dataset_parallel(output_dir, args.num_records, args.chunk_size, args.seed, args.workers, args.format,
+                                          args.num_customers)
+        print(f"Dataset sintético gerado em {len(parts)} arquivos-parte em {output_dir} ({args.workers} processos)")
+        raise SystemExit(0)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    df = generate_dataset(args.output, args.num_records, args.chunk_size, args.seed, args.num_customers)
+
+    print(f"Dataset sintético gerado e salvo em {args.output}")
+    print(df.head())
+    print(f"\nNúmero de registros: {args.num_records}")
+    print(f"Colunas: {df.columns.tolist()}")
+    print(f"\nTipos de dados:\n{df.dtypes}")
+    print(f"Memória do primeiro bloco: {df.memory_usage(deep=True).sum() / 1024 ** 2:.2f} MB ({len(df):,} linhas)")
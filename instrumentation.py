@@ -0,0 +1,231 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# --- Instrumentação por Etapa (logs JSON e cProfile opcional) ---
+#
+# Cada etapa lógica dos scripts (carga, nulos, duplicatas, atributos, cada agregação da EDA,
+# carga no SQLite, RFM, scores, clustering, cada gráfico) é envolvida por stage(), que registra
+# tempo de parede, tempo de CPU (da thread da etapa e dos subprocessos encerrados), pico de RSS,
+# linhas de entrada/saída e bytes lidos/gravados, e emite uma linha JSON por etapa.
+# O pico de RSS só pode ser zerado para o processo inteiro: com etapas abertas em outras
+# threads (ex: pipeline.py em paralelo) ele não é zerado e o registro traz peak_scope='process'.
+#
+# Desligada por padrão: stage() devolve um objeto nulo compartilhado (custo de uma chamada).
+# - VAREJO_INSTRUMENT=1 grava em <dados>/logs/instrumentation.jsonl; um caminho grava nesse
+#   arquivo; '-' escreve na saída de erro.
+# <dados> é o diretório de dados da execução: o definido por set_data_dir() (ex: pipeline.py
+# --data-dir, herdado pelos subprocessos via VAREJO_INSTRUMENT_DIR) ou, senão, VAREJO_DATA_DIR.
+# - VAREJO_PROFILE_STAGE=<etapa>[,<etapa>...] grava um cProfile de cada execução da etapa em
+#   <dados>/profiles/<etapa>-<pid>-<n>.prof (abra com snakeviz ou gere o flamegraph com flameprof).
+
+log_target = os.environ.get('VAREJO_INSTRUMENT', '').strip()
+profile_stages = {s.strip() for s in os.environ.get('VAREJO_PROFILE_STAGE', '').split(',') if s.strip()}
+logging_enabled = bool(log_target) and log_target != '0'
+enabled = logging_enabled or bool(profile_stages)
+
+run_id = os.environ.get('VAREJO_RUN_ID') or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+os.environ.setdefault('VAREJO_RUN_ID', run_id) # Subprocessos (pools) herdam o mesmo run_id
+
+_lock = threading.Lock()
+_local = threading.local()
+_profile_count = 0
+_open_stages = {} # Thread -> etapas abertas nela (o pico só é zerado sem etapas em outras threads)
+
+
+# --- Memória e E/S do processo (Linux: /proc; nos demais, via getrusage) ---
+
+def reset_peak_rss():
+    """Zera o pico de RSS do processo (Linux, /proc/self/clear_refs); False se não suportado."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def memory_mb():
+    """(RSS atual, pico de RSS) do processo em MB."""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['VmRSS'].split()[0]) / 1024, int(fields['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # kB no Linux
+        return peak, peak
+
+
+def io_bytes():
+    """(bytes lidos, bytes gravados) pelo processo via chamadas de sistema; (0, 0) se indisponível."""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError):
+        return 0, 0
+
+
+def path_size(path):
+    """Tamanho em bytes de um arquivo ou diretório (dataset Parquet); 0 se não existir."""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def set_data_dir(path):
+    """Grava logs e perfis sob o diretório de dados desta execução (e dos subprocessos criados depois)."""
+    os.environ['VAREJO_INSTRUMENT_DIR'] = os.path.abspath(path)
+
+
+def _run_path(*parts):
+    data_dir = os.environ.get('VAREJO_INSTRUMENT_DIR')
+    if data_dir:
+        return os.path.join(data_dir, *parts)
+    import storage
+    return storage.data_path(*parts)
+
+
+# --- Etapas ---
+
+def _default_log_path():
+    return _run_path('logs', 'instrumentation.jsonl')
+
+
+def _emit(record):
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _lock:
+        if log_target == '-':
+            print(line, file=sys.stderr, flush=True)
+            return
+        path = _default_log_path() if log_target in ('1', 'true', 'yes') else log_target
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f: # Uma linha por write(): atômico entre processos
+            f.write(line + '\n')
+
+
+def _profile_path(name):
+    global _profile_count
+    with _lock:
+        _profile_count += 1
+        count = _profile_count
+    profile_dir = _run_path('profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, f"{name.replace('/', '_')}-{os.getpid()}-{count}.prof")
+
+
+class _NullStage:
+    """Etapa com a instrumentação desligada: não mede nada."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+class Stage:
+    """Medição de uma etapa; use via instrumentation.stage(nome, rows_in=..., **campos)."""
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self._child_peak = 0.0
+
+    def set(self, **fields):
+        """Completa o registro (ex: rows_out, bytes_read, bytes_written ou campos livres).
+
+        Valores chamáveis (ex: lambda: path_size(caminho)) só são avaliados ao emitir o registro.
+        """
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        self._parent = stack[-1] if stack else None
+        stack.append(self)
+        self._profiler = None
+        self._rss_start, _ = memory_mb()
+        thread = threading.get_ident()
+        with _lock:
+            shared = any(count for other, count in _open_stages.items() if other != thread)
+            _open_stages[thread] = _open_stages.get(thread, 0) + 1
+            # Zerado sob o lock: nenhuma outra thread abre uma etapa no meio da medição
+            self._peak_scope = 'process' if shared or not reset_peak_rss() else 'stage'
+        self._io_start = io_bytes()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._children_cpu = children.ru_utime + children.ru_stime
+        self._cpu_start = time.thread_time()
+        if self.name in profile_stages:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall_start
+        if self._profiler is not None:
+            self._profiler.disable()
+            path = _profile_path(self.name)
+            self._profiler.dump_stats(path)
+            self.fields.setdefault('profile', path)
+        _local.stack.pop()
+        cpu = time.thread_time() - self._cpu_start
+        with _lock:
+            thread = threading.get_ident()
+            _open_stages[thread] -= 1
+            if not _open_stages[thread]:
+                del _open_stages[thread]
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        rss_end, peak = memory_mb()
+        # Etapas internas zeram o pico do processo: o da etapa externa inclui o maior pico delas
+        peak = max(peak, self._child_peak)
+        if self._parent is not None:
+            self._parent._child_peak = max(self._parent._child_peak, peak)
+        read, written = io_bytes()
+        if logging_enabled:
+            record = {
+                'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'run_id': run_id,
+                'pid': os.getpid(),
+                'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None,
+                'stage': self.name,
+                'parent': self._parent.name if self._parent is not None else None,
+                'status': 'ok' if exc_type is None else 'error',
+                'wall_s': round(wall, 6),
+                'cpu_s': round(cpu, 6),
+                'cpu_children_s': round(children.ru_utime + children.ru_stime - self._children_cpu, 6),
+                'rss_start_mb': round(self._rss_start, 1),
+                'rss_end_mb': round(rss_end, 1),
+                'peak_rss_mb': round(peak, 1),
+                'peak_scope': self._peak_scope,
+                'io_read_bytes': read - self._io_start[0],
+                'io_write_bytes': written - self._io_start[1],
+            }
+            if exc_type is not None:
+                record['error'] = f"{exc_type.__name__}: {exc}"
+            record.update({k: v() if callable(v) else v for k, v in self.fields.items()})
+            _emit(record)
+        return False
+
+
+def stage(name, **fields):
+    """Context manager de uma etapa; com a instrumentação desligada devolve um objeto nulo.
+
+    Campos usuais: rows_in, rows_out, bytes_read, bytes_written (os dois últimos complementam
+    io_read_bytes/io_write_bytes, medidos pelo sistema).
+    """
+    if not logging_enabled and name not in profile_stages:
+        return _null_stage
+    return Stage(name, **fields)
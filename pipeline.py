@@ -0,0 +1,430 @@
+import argparse
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import pandas as pd
+
+import aggregations
+import cleaning
+import clustering
+import generate_data
+import instrumentation
+import plotting
+import rfm
+import rfm_snapshots
+import sales_db
+import schema
+import segmentation_model
+import storage
+
+# --- Pipeline em DAG com Cache por Etapa ---
+#
+# Encadeia as etapas dos scripts (geração -> limpeza/EDA -> carga SQLite | gráficos da EDA |
+# RFM -> scores -> clustering -> gráficos da segmentação) como um grafo de dependências.
+# A chave de cada etapa é o hash do seu código (função e módulos usados), dos parâmetros e
+# do conteúdo dos arquivos de entrada; se a chave e as saídas não mudaram, a etapa é pulada.
+# Ramos independentes rodam em paralelo e o estado fica em pipeline_manifest.json, de modo
+# que uma nova execução após uma falha retoma a partir da etapa que falhou.
+
+manifest_filename = 'pipeline_manifest.json'
+
+eda_plot_files = ['01_numeric_distributions.png', '02_monthly_sales_trend.png', '03_sales_by_category.png',
+                  '04_sales_by_region.png', '05_top_10_products.png', '06_sales_by_dayofweek.png',
+                  '07_sales_by_hour.png', '08_payment_method_distribution.png']
+segmentation_plot_files = ['09_rfm_segment_distribution.png', '10_kmeans_elbow_method.png', '11_kmeans_clusters_2d.png']
+
+# Mesmos estilos dos scripts, para que os gráficos compartilhem o cache de plotting.py
+eda_plot_rc = {"figure.figsize": (12, 6), "axes.titlesize": 16, "axes.labelsize": 12,
+               "xtick.labelsize": 10, "ytick.labelsize": 10}
+segmentation_plot_rc = {"figure.figsize": (10, 6)}
+
+default_config = {
+    'data_dir': storage.data_dir,
+    'format': storage.default_format,
+    # Geração
+    'num_records': generate_data.num_records,
+    'chunk_size': generate_data.chunk_size,
+    'seed': generate_data.seed,
+    # Limpeza (em streaming) e carga no SQLite
+    'clean_chunk_size': 1_000_000,
+    'dedup_max_memory_keys': 5_000_000,
+    'sqlite_load_mode': 'upsert',
+    # Scores RFM
+    'score_method': 'exact',
+    'sketch_k': 200,
+    'rank_first': True,
+    'score_duplicates': 'drop',
+    'snapshot_windows': rfm_snapshots.default_windows,
+    # Clustering
+    'clustering_algorithm': 'kmeans',
+    'k_selection': 'elbow',
+    'elbow_k_values': list(range(1, 11)),
+    'elbow_workers': None,
+    'silhouette_sample_size': 10_000,
+    # Gráficos
+    'plot_workers': None,
+}
+
+
+class Stage:
+    """Etapa do pipeline: func(paths, config) lê `inputs` e grava `outputs` (chaves de paths)."""
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=(), modules=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = list(params)
+        self.modules = list(modules)
+
+
+def build_paths(config):
+    fmt = config['format']
+    data = lambda *parts: os.path.join(config['data_dir'], *parts)
+    table = lambda name: storage.table_path(data(name), fmt)
+    plots_dir = data('plots')
+    paths = {
+        'raw': table('online_sales_raw.csv'),
+        'processed': table('online_sales_processed.csv'),
+        'summaries': data('eda_summaries.json'),
+        'db': data('sales_database.db'),
+        'rfm': table('rfm_metrics.csv'),
+        'rfm_info': data('rfm_metrics.json'),
+        'scores': table('rfm_scores.csv'),
+        'score_edges': data('rfm_score_edges.json'),
+        'snapshots': table('rfm_snapshots.csv'),
+        'transitions': data('segment_transitions.csv'),
+        'segments': data('customer_segments.csv'),
+        'wcss': data('kmeans_wcss.json'),
+        'models': data('models'),
+        'plots': plots_dir,
+    }
+    for name in eda_plot_files + segmentation_plot_files:
+        paths[name] = os.path.join(plots_dir, name)
+    return paths
+
+
+# --- Etapas ---
+
+def stage_generate(paths, config):
+    os.makedirs(os.path.dirname(paths['raw']), exist_ok=True)
+    generate_data.generate_dataset(paths['raw'], config['num_records'], config['chunk_size'], config['seed'])
+
+
+def stage_clean_eda(paths, config):
+    """Limpeza em streaming, dados processados e resumos da EDA numa única passagem."""
+    stats = {}
+    aggregator = aggregations.EDAAggregator()
+    with storage.TableWriter(paths['processed']) as writer:
+        for chunk in cleaning.clean_stream(paths['raw'], config['clean_chunk_size'], config['dedup_max_memory_keys'],
+                                           stats=stats):
+            writer.write(chunk)
+            aggregator.update(chunk)
+    aggregator.save(paths['summaries'], source=aggregations.source_fingerprint(paths['raw']))
+    print(f"Linhas lidas: {stats['rows_in']:,}; removidas por NaN em 'Region': {stats['rows_removed_region']:,}; "
+          f"duplicadas: {stats['duplicates_removed']:,}; gravadas: {stats['rows_out']:,}")
+
+
+def stage_sqlite_load(paths, config):
+    mode = config['sqlite_load_mode']
+    with sales_db.SalesDatabase(paths['db']) as db:
+        for i, chunk in enumerate(storage.iter_table(paths['processed'], config['clean_chunk_size'], parse_dates=['Date'])):
+            # 'replace' só esvazia a tabela no primeiro bloco; os demais são anexados
+            db.load(schema.apply(chunk), mode='upsert' if mode == 'replace' and i > 0 else mode)
+        print(db.top_categories(5))
+
+
+def stage_eda_plots(paths, config):
+    aggregator = aggregations.EDAAggregator.load(paths['summaries'])
+    with plotting.PlotRenderer(paths['plots'], workers=config['plot_workers'], rc=eda_plot_rc) as plots:
+        plotting.submit_eda_plots(plots, aggregator)
+
+
+def stage_rfm(paths, config):
+    df = schema.apply(storage.read_table(paths['processed'], columns=['OrderID', 'CustomerID', 'Date', 'TotalPrice'],
+                                         parse_dates=['Date'], dtype={'CustomerID': 'Int64'}))
+    df = df[df['CustomerID'] != -1]
+    reference_date = df['Date'].max() + pd.Timedelta(days=1)
+    rfm_df = rfm.compute_rfm(df, reference_date)
+    storage.write_table(rfm_df, paths['rfm'])
+    with open(paths['rfm_info'], 'w', encoding='utf-8') as f:
+        json.dump({'reference_date': str(reference_date), 'customers': len(rfm_df)}, f)
+    print(f"{len(rfm_df):,} clientes; data de referência {reference_date:%Y-%m-%d}")
+
+
+def stage_rfm_snapshots(paths, config):
+    df = schema.apply(storage.read_table(paths['processed'], columns=['OrderID', 'CustomerID', 'Date', 'TotalPrice'],
+                                         parse_dates=['Date'], dtype={'CustomerID': 'Int64'}))
+    df = df[df['CustomerID'] != -1]
+    windows = config['snapshot_windows']
+    snapshots_df = rfm_snapshots.compute_snapshots(df, windows=windows, rank_first=config['rank_first'],
+                                                   duplicates=config['score_duplicates'])
+    storage.write_table(snapshots_df, paths['snapshots'])
+    labels = [rfm_snapshots.window_label(w) for w in windows]
+    pd.concat([rfm_snapshots.transitions(snapshots_df, label).assign(Window=label) for label in labels],
+              ignore_index=True).to_csv(paths['transitions'], index=False)
+    print(f"{snapshots_df['Snapshot'].nunique()} instantes x {len(windows)} janelas: {len(snapshots_df):,} linhas")
+
+
+def stage_scoring(paths, config):
+    rfm_df = storage.read_table(paths['rfm'])
+    if config['score_method'] == 'sketch':
+        scores, sketches = rfm.score_sketch(rfm_df, k=config['sketch_k'], rank_first=config['rank_first'],
+                                            duplicates=config['score_duplicates'])
+        edges = segmentation_model.sketch_edges(sketches, config['score_duplicates'])
+    else:
+        scores = rfm.score_exact(rfm_df, rank_first=config['rank_first'], duplicates=config['score_duplicates'])
+        edges = segmentation_model.quintile_edges(rfm_df, config['rank_first'], config['score_duplicates'])
+    # Limites dos mesmos quintis, para o modelo salvo na etapa de clustering
+    with open(paths['score_edges'], 'w', encoding='utf-8') as f:
+        json.dump(edges, f)
+    rfm_df = rfm.add_scores(rfm_df, scores)
+    storage.write_table(rfm_df, paths['scores'])
+    print(rfm_df['Segment'].value_counts().to_string())
+
+
+def stage_clustering(paths, config):
+    rfm_df = storage.read_table(paths['scores'])
+    rfm_df['RFM_Score'] = rfm_df['RFM_Score'].astype(str)
+    scaler, X = clustering.scale_features(rfm_df)
+    algorithm = config['clustering_algorithm']
+    wcss = clustering.elbow_search(X, config['elbow_k_values'], algorithm=algorithm, workers=config['elbow_workers'])
+    k, _ = clustering.choose_k(X, wcss, config['k_selection'], config['elbow_k_values'], algorithm,
+                               config['silhouette_sample_size'], workers=config['elbow_workers'])
+    kmeans = clustering.fit_final(X, k, algorithm=algorithm)
+    rfm_df['KMeans_Cluster'] = kmeans.predict(X)
+    with open(paths['wcss'], 'w', encoding='utf-8') as f:
+        json.dump({str(k_): v for k_, v in wcss.items()}, f)
+
+    with open(paths['rfm_info'], encoding='utf-8') as f:
+        reference_date = json.load(f)['reference_date']
+    with open(paths['score_edges'], encoding='utf-8') as f:
+        score_edges = json.load(f)
+    model = segmentation_model.SegmentationModel.from_fit(rfm_df, scaler, kmeans, reference_date=reference_date,
+                                                          score_edges=score_edges)
+    model_path = model.save(paths['models'])
+    rfm_df.to_csv(paths['segments'], index=False)
+    print(f"k={k}; modelo de segmentação v{model.version} salvo em {model_path}")
+
+
+def stage_segmentation_plots(paths, config):
+    rfm_df = pd.read_csv(paths['segments'])
+    with open(paths['wcss'], encoding='utf-8') as f:
+        wcss = {int(k): v for k, v in json.load(f).items()}
+    with plotting.PlotRenderer(paths['plots'], workers=config['plot_workers'], rc=segmentation_plot_rc) as plots:
+        plotting.submit_segment_distribution(plots, rfm_df['Segment'].value_counts())
+        plotting.submit_elbow(plots, wcss)
+        plotting.submit_cluster_scatter(plots, rfm_df)
+
+
+def build_stages():
+    return [
+        Stage('generate', stage_generate, outputs=['raw'], params=['num_records', 'chunk_size', 'seed'],
+              modules=[generate_data, schema, storage]),
+        Stage('clean_eda', stage_clean_eda, inputs=['raw'], outputs=['processed', 'summaries'],
+              params=['clean_chunk_size', 'dedup_max_memory_keys'], modules=[cleaning, aggregations, schema, storage]),
+        Stage('sqlite_load', stage_sqlite_load, inputs=['processed'], outputs=['db'],
+              params=['clean_chunk_size', 'sqlite_load_mode'], modules=[sales_db, schema]),
+        Stage('eda_plots', stage_eda_plots, inputs=['summaries'], outputs=eda_plot_files, modules=[plotting, aggregations]),
+        Stage('rfm', stage_rfm, inputs=['processed'], outputs=['rfm', 'rfm_info'], modules=[rfm, schema, storage]),
+        Stage('rfm_snapshots', stage_rfm_snapshots, inputs=['processed'], outputs=['snapshots', 'transitions'],
+              params=['snapshot_windows', 'rank_first', 'score_duplicates'], modules=[rfm_snapshots, rfm, schema, storage]),
+        Stage('scoring', stage_scoring, inputs=['rfm'], outputs=['scores', 'score_edges'],
+              params=['score_method', 'sketch_k', 'rank_first', 'score_duplicates'], modules=[rfm, segmentation_model]),
+        Stage('clustering', stage_clustering, inputs=['scores', 'score_edges', 'rfm_info'], outputs=['segments', 'wcss'],
+              params=['clustering_algorithm', 'k_selection', 'elbow_k_values', 'silhouette_sample_size'],
+              modules=[clustering, segmentation_model]),
+        Stage('segmentation_plots', stage_segmentation_plots, inputs=['segments', 'wcss'], outputs=segmentation_plot_files,
+              modules=[plotting]),
+    ]
+
+
+# --- Hashes de conteúdo ---
+
+def _files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    return [path]
+
+
+class Manifest:
+    """Estado persistido das etapas (chave, status, digests das saídas) e cache de digests de arquivos."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {'stages': {}, 'files': {}}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def file_digest(self, path):
+        """SHA-256 do conteúdo (arquivo ou diretório); reaproveitado enquanto tamanho e mtime não mudam."""
+        h = hashlib.sha256()
+        for file in _files(path):
+            stat = os.stat(file)
+            with self._lock:
+                cached = self.data['files'].get(file)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                digest = cached[2]
+            else:
+                file_hash = hashlib.sha256()
+                with open(file, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        file_hash.update(block)
+                digest = file_hash.hexdigest()
+                with self._lock:
+                    self.data['files'][file] = [stat.st_size, stat.st_mtime_ns, digest]
+            h.update(os.path.relpath(file, path).encode() + digest.encode())
+        return h.hexdigest()
+
+    def stage(self, name):
+        with self._lock:
+            return dict(self.data['stages'].get(name, {}))
+
+    def record(self, name, **entry):
+        with self._lock:
+            self.data['stages'][name] = entry
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2, default=str)
+            os.replace(tmp, self.path)
+
+
+def stage_key(stage, paths, config, manifest):
+    h = hashlib.sha256(inspect.getsource(stage.func).encode())
+    for module in stage.modules:
+        with open(module.__file__, 'rb') as f:
+            h.update(f.read())
+    h.update(json.dumps({p: config[p] for p in stage.params}, sort_keys=True, default=str).encode())
+    h.update(json.dumps({o: paths[o] for o in stage.outputs}, sort_keys=True).encode())
+    for name in stage.inputs:
+        h.update(name.encode() + manifest.file_digest(paths[name]).encode())
+    return h.hexdigest()
+
+
+# --- Execução ---
+
+class Pipeline:
+    def __init__(self, config=None, stages=None):
+        self.config = dict(default_config, **(config or {}))
+        self.paths = build_paths(self.config)
+        self.stages = {s.name: s for s in (stages or build_stages())}
+        producers = {out: s.name for s in self.stages.values() for out in s.outputs}
+        self.deps = {s.name: sorted({producers[i] for i in s.inputs if i in producers}) for s in self.stages.values()}
+        os.makedirs(self.config['data_dir'], exist_ok=True)
+        instrumentation.set_data_dir(self.config['data_dir']) # Logs e perfis junto dos dados desta execução
+        self.manifest = Manifest(os.path.join(self.config['data_dir'], manifest_filename))
+
+    def _with_ancestors(self, targets):
+        selected, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.stages:
+                raise ValueError(f"Etapa desconhecida: {name!r} (etapas: {', '.join(self.stages)})")
+            if name not in selected:
+                selected.add(name)
+                stack.extend(self.deps[name])
+        return selected
+
+    def _up_to_date(self, stage, key):
+        entry = self.manifest.stage(stage.name)
+        if entry.get('status') != 'done' or entry.get('key') != key:
+            return False
+        # Saídas apagadas ou alteradas fora do pipeline também forçam a execução
+        for out in stage.outputs:
+            path = self.paths[out]
+            if not os.path.exists(path) or self.manifest.file_digest(path) != entry['outputs'].get(out):
+                return False
+        return True
+
+    def _run_stage(self, stage, force):
+        key = None
+        try:
+            key = stage_key(stage, self.paths, self.config, self.manifest)
+            if not force and self._up_to_date(stage, key):
+                return 'cached', 0.0
+            print(f"[{stage.name}] iniciando...")
+            start = time.perf_counter()
+            with instrumentation.stage(f'pipeline.{stage.name}'):
+                stage.func(self.paths, self.config)
+            elapsed = time.perf_counter() - start
+            outputs = {out: self.manifest.file_digest(self.paths[out]) for out in stage.outputs}
+        except Exception as e:
+            # Sem status 'done', a próxima execução retoma por esta etapa
+            self.manifest.record(stage.name, status='failed', key=key, error=f"{type(e).__name__}: {e}",
+                                 finished_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            raise
+        self.manifest.record(stage.name, status='done', key=key, outputs=outputs, seconds=round(elapsed, 3),
+                             finished_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        return 'done', elapsed
+
+    def run(self, targets=None, force=(), workers=None):
+        """Executa as etapas pedidas (e as que elas dependem); retorna {etapa: status}."""
+        selected = self._with_ancestors(targets or list(self.stages))
+        force = set(self.stages) if 'all' in force else set(force)
+        status = {name: 'pending' for name in self.stages if name in selected}
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers or len(self.stages)) as executor:
+            while True:
+                for name in list(status):
+                    if status[name] != 'pending':
+                        continue
+                    dep_status = [status.get(d, 'done') for d in self.deps[name]]
+                    if any(s in ('failed', 'skipped') for s in dep_status):
+                        status[name] = 'skipped' # Dependência falhou: fica para a próxima execução
+                    elif all(s in ('done', 'cached') for s in dep_status):
+                        status[name] = 'running'
+                        running[executor.submit(self._run_stage, self.stages[name], name in force)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        status[name], elapsed = future.result()
+                        if status[name] == 'cached':
+                            print(f"[{name}] inalterada (cache)")
+                        else:
+                            print(f"[{name}] concluída em {elapsed:.1f}s")
+                    except Exception:
+                        status[name] = 'failed'
+                        print(f"[{name}] falhou:\n{traceback.format_exc()}")
+        return status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Executa o pipeline de varejo como um DAG com cache por etapa.')
+    parser.add_argument('targets', nargs='*', help='Etapas a executar (com suas dependências); padrão: todas')
+    parser.add_argument('--data-dir', default=default_config['data_dir'], help='Diretório de dados (ou VAREJO_DATA_DIR)')
+    parser.add_argument('--format', choices=storage.FORMATS, default=default_config['format'])
+    parser.add_argument('--num-records', type=int, default=default_config['num_records'])
+    parser.add_argument('--seed', type=int, default=default_config['seed'])
+    parser.add_argument('--force', nargs='+', default=[], help="Etapas a reexecutar mesmo sem mudanças ('all' para todas)")
+    parser.add_argument('--workers', type=int, default=None, help='Etapas executadas em paralelo')
+    parser.add_argument('--list', action='store_true', help='Lista as etapas e suas dependências')
+    args = parser.parse_args()
+
+    # Os pools de processos (cotovelo, gráficos) são criados a partir de threads: forkserver evita fork com threads ativas
+    multiprocessing.set_start_method('forkserver')
+
+    pipeline = Pipeline({'data_dir': args.data_dir, 'format': args.format,
+                         'num_records': args.num_records, 'seed': args.seed})
+    if args.list:
+        for name, deps in pipeline.deps.items():
+            entry = pipeline.manifest.stage(name)
+            print(f"{name:<20} <- {', '.join(deps) or '-':<24} {entry.get('status', 'nunca executada')}")
+        raise SystemExit(0)
+
+    start = time.perf_counter()
+    result = pipeline.run(args.targets, force=args.force, workers=args.workers)
+    print(f"\nPipeline finalizado em {time.perf_counter() - start:.1f}s:")
+    for name, state in result.items():
+        print(f"  {name:<20} {state}")
+    raise SystemExit(1 if any(s in ('failed', 'skipped') for s in result.values()) else 0)
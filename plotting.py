@@ -0,0 +1,282 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import aggregations
+import instrumentation
+
+# --- Renderização de Gráficos em Paralelo, com Cache ---
+#
+# Os scripts montam apenas entradas pequenas e pré-agregadas (contagens, séries por chave,
+# histogramas já binados, amostras limitadas) e as entregam ao PlotRenderer, que desenha
+# cada figura num pool de processos enquanto o script principal continua. Cada PNG é
+# associado ao hash das suas entradas (e do código do gráfico): se nada mudou desde a
+# última execução e o arquivo existe, o gráfico não é redesenhado.
+
+cache_filename = '.plot_cache.json'
+max_scatter_points = 20_000 # Pontos desenhados no máximo num gráfico de dispersão
+_cache_lock = threading.Lock() # Renderers do mesmo diretório em threads diferentes (pipeline.py)
+
+
+def _update_hash(h, obj):
+    if isinstance(obj, (pd.Series, pd.DataFrame, pd.Index)):
+        h.update(pd.util.hash_pandas_object(obj, index=not isinstance(obj, pd.Index)).to_numpy().tobytes())
+        # Só os valores, o índice e os tipos (nomes de séries não aparecem nos gráficos)
+        if isinstance(obj, pd.DataFrame):
+            h.update(repr(list(obj.columns)).encode())
+        h.update(repr(list(obj.dtypes) if isinstance(obj, pd.DataFrame) else obj.dtype).encode())
+    elif isinstance(obj, np.ndarray):
+        h.update(str(obj.dtype).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=str):
+            h.update(repr(key).encode())
+            _update_hash(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            _update_hash(h, item)
+    else:
+        h.update(repr(obj).encode())
+
+
+def data_hash(render_fn, data, rc=None):
+    """Hash das entradas do gráfico, do código da função que o desenha e do estilo."""
+    h = hashlib.sha256(inspect.getsource(render_fn).encode())
+    _update_hash(h, data)
+    _update_hash(h, rc or {})
+    return h.hexdigest()
+
+
+def sample_points(df, max_points=max_scatter_points, random_state=42):
+    """Amostra uniforme de no máximo max_points linhas (o DataFrame inteiro se for menor)."""
+    if len(df) <= max_points:
+        return df
+    return df.sample(n=max_points, random_state=random_state)
+
+
+def _render(task):
+    # Executado nos processos do pool (ou em linha, com workers=1)
+    render_fn, data, path, rc = task
+    with instrumentation.stage(f'plot.{os.path.basename(path)}') as st:
+        _draw(render_fn, data, path, rc)
+        st.set(bytes_written=os.path.getsize(path))
+    return path
+
+
+def _draw(render_fn, data, path, rc):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style("whitegrid")
+    with plt.rc_context(rc or {}):
+        fig = render_fn(**data)
+        fig.savefig(path, bbox_inches='tight')
+    plt.close(fig) # Fecha a figura para liberar memória
+
+
+class PlotRenderer:
+    """Fila de gráficos desenhados em paralelo, com cache por hash das entradas."""
+
+    def __init__(self, output_dir, workers=None, rc=None, use_cache=True):
+        self.output_dir = output_dir
+        self.rc = rc or {}
+        self.use_cache = use_cache
+        os.makedirs(output_dir, exist_ok=True)
+        self._cache_path = os.path.join(output_dir, cache_filename)
+        self._cache = {}
+        if use_cache and os.path.exists(self._cache_path):
+            with open(self._cache_path, encoding='utf-8') as f:
+                self._cache = json.load(f)
+        self._workers = workers or min(4, os.cpu_count() or 1)
+        self._executor = None
+        self._pending = [] # (filename, hash, future ou None)
+        self._rendered = {} # Hashes dos gráficos desenhados por este renderer
+
+    def submit(self, filename, render_fn, **data):
+        """Agenda o gráfico; render_fn(**data) deve retornar a figura (função de módulo, serializável)."""
+        path = os.path.join(self.output_dir, filename)
+        digest = data_hash(render_fn, data, self.rc)
+        if self.use_cache and self._cache.get(filename) == digest and os.path.exists(path):
+            self._pending.append((filename, digest, None))
+            return
+        task = (render_fn, data, path, self.rc)
+        if self._workers <= 1:
+            future = Future()
+            future.set_result(_render(task))
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers)
+            future = self._executor.submit(_render, task)
+        self._pending.append((filename, digest, future))
+
+    def close(self):
+        """Aguarda os gráficos pendentes e grava o cache com os hashes dos que foram desenhados."""
+        try:
+            for filename, digest, future in self._pending:
+                if future is None:
+                    print(f"Gráfico inalterado (cache): {filename}")
+                    continue
+                future.result()
+                self._cache[filename] = self._rendered[filename] = digest
+                print(f"Gráfico salvo: {filename}")
+        finally:
+            self._pending = []
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            if self.use_cache:
+                self._write_cache()
+
+    def _write_cache(self):
+        # Relê o arquivo e grava só os hashes deste renderer: outro renderer do mesmo diretório pode ter gravado no meio tempo
+        with _cache_lock:
+            cache = {}
+            if os.path.exists(self._cache_path):
+                with open(self._cache_path, encoding='utf-8') as f:
+                    cache = json.load(f)
+            cache.update(self._rendered)
+            with open(self._cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Gráficos (funções de módulo, para poderem ser enviadas aos processos) ---
+
+def histograms(columns, titles, figsize=(18, 5)):
+    """Histogramas pré-binados: columns = {coluna: (centros, contagens)} dos bins finos."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    fig, axes = plt.subplots(1, len(columns), figsize=figsize)
+    for ax, (col, (centers, counts)), title in zip(np.atleast_1d(axes), columns.items(), titles):
+        sns.histplot(x=centers, weights=counts, bins=30, kde=True, ax=ax).set_title(title)
+        ax.set_xlabel(col)
+    plt.tight_layout()
+    return fig
+
+
+def line(x, y, title, xlabel, ylabel, xticks=None, rotation=None, grid=False, figsize=None):
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=figsize)
+    plt.plot(x, y, marker='o')
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    if xticks is not None:
+        plt.xticks(xticks)
+    if rotation:
+        plt.xticks(rotation=rotation)
+    if grid:
+        plt.grid(True)
+    plt.tight_layout()
+    return fig
+
+
+def bars(series, title, xlabel, ylabel, palette, horizontal=True, figsize=None):
+    """Barras a partir de uma série (índice = rótulos); horizontais por padrão."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    fig = plt.figure(figsize=figsize)
+    if horizontal:
+        sns.barplot(x=series.values, y=series.index, palette=palette)
+    else:
+        sns.barplot(x=series.index, y=series.values, palette=palette)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.tight_layout()
+    return fig
+
+
+def bars_side_by_side(panels, figsize=(18, 7)):
+    """Vários gráficos de barras horizontais lado a lado: panels = [(série, título, paleta), ...]."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    fig, axes = plt.subplots(1, len(panels), figsize=figsize)
+    for ax, (series, title, palette) in zip(np.atleast_1d(axes), panels):
+        sns.barplot(x=series.values, y=series.index, ax=ax, palette=palette).set_title(title)
+    plt.tight_layout()
+    return fig
+
+
+def pie(series, title, cmap='tab20c'):
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    series.plot(kind='pie', autopct='%1.1f%%', startangle=90, cmap=cmap)
+    plt.title(title)
+    plt.ylabel('') # Remover label do eixo y para pie chart
+    plt.tight_layout()
+    return fig
+
+
+def scatter(data, x, y, hue, title, xlabel, ylabel, legend_title, palette='Set1', figsize=(10, 8)):
+    """Dispersão; data deve chegar já amostrada (ver sample_points)."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    fig = plt.figure(figsize=figsize)
+    sns.scatterplot(data=data, x=x, y=y, hue=hue, palette=palette, s=50, alpha=0.7)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.legend(title=legend_title)
+    return fig
+
+
+# --- Gráficos do projeto (usados pelos scripts e pelo pipeline.py) ---
+
+def submit_eda_plots(plots, aggregator, summary=None):
+    """Agenda os 8 gráficos da EDA (01 a 08) a partir dos resumos do EDAAggregator."""
+    summary = summary if summary is not None else aggregator.results()
+    plots.submit('01_numeric_distributions.png', histograms,
+                 columns={col: aggregator.histogram(col) for col in aggregations.numeric_columns},
+                 titles=['Distribuição da Quantidade', 'Distribuição do Preço Unitário', 'Distribuição do Preço Total'])
+    monthly_sales = summary['monthly_sales']
+    plots.submit('02_monthly_sales_trend.png', line, x=monthly_sales['Date'], y=monthly_sales['TotalPrice'],
+                 title='Vendas Totais Mensais', xlabel='Mês', ylabel='Vendas Totais', rotation=45)
+    plots.submit('03_sales_by_category.png', bars, series=summary['category_sales'],
+                 title='Vendas Totais por Categoria', xlabel='Vendas Totais', ylabel='Categoria', palette='viridis')
+    plots.submit('04_sales_by_region.png', bars, series=summary['region_sales'],
+                 title='Vendas Totais por Região', xlabel='Vendas Totais', ylabel='Região', palette='magma')
+    plots.submit('05_top_10_products.png', bars_side_by_side, panels=[
+        (summary['top_products_quantity'], 'Top 10 Produtos por Quantidade Vendida', 'coolwarm'),
+        (summary['top_products_revenue'], 'Top 10 Produtos por Receita Gerada', 'Spectral'),
+    ])
+    plots.submit('06_sales_by_dayofweek.png', bars, series=summary['dayofweek_sales'], horizontal=False,
+                 title='Vendas Totais por Dia da Semana', xlabel='Dia da Semana', ylabel='Vendas Totais', palette='cubehelix')
+    hourly_sales = summary['hourly_sales']
+    plots.submit('07_sales_by_hour.png', line, x=hourly_sales.index, y=hourly_sales.values,
+                 title='Vendas Totais por Hora do Dia', xlabel='Hora do Dia', ylabel='Vendas Totais',
+                 xticks=range(0, 24), grid=True)
+    plots.submit('08_payment_method_distribution.png', pie, series=summary['payment_usage'],
+                 title='Distribuição de Métodos de Pagamento')
+
+
+def submit_segment_distribution(plots, segment_counts):
+    plots.submit("09_rfm_segment_distribution.png", bars, series=segment_counts, figsize=(12, 7),
+                 title="Distribuição dos Clientes por Segmento RFM", xlabel="Número de Clientes", ylabel="Segmento",
+                 palette='viridis')
+
+
+def submit_elbow(plots, wcss):
+    plots.submit("10_kmeans_elbow_method.png", line, x=list(wcss.keys()), y=list(wcss.values()),
+                 title="Método do Cotovelo para K-Means", xlabel="Número de Clusters (k)",
+                 ylabel="WCSS (Within-Cluster Sum of Squares)", grid=True)
+
+
+def submit_cluster_scatter(plots, rfm_df):
+    """Recency x MonetaryValue por cluster, com no máximo max_scatter_points clientes."""
+    plots.submit("11_kmeans_clusters_2d.png", scatter,
+                 data=sample_points(rfm_df[['Recency', 'MonetaryValue', 'KMeans_Cluster']]), x='Recency',
+                 y='MonetaryValue', hue='KMeans_Cluster', title="Clusters K-Means (Recency vs MonetaryValue)",
+                 xlabel="Recência (Dias)", ylabel="Valor Monetário Total", legend_title='Cluster')
@@ -0,0 +1,122 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# --- Sketch de Quantis KLL (aproximado, em uma passagem e combinável) ---
+#
+# Implementação em NumPy do sketch KLL (Karnin, Lang & Liberty, 2016): os valores entram
+# no nível 0 e, quando um nível enche, ele é ordenado e metade dos itens (alternados, com
+# deslocamento aleatório) sobe para o nível seguinte com peso dobrado. O espaço é
+# O(k log(n/k)) e dois sketches podem ser combinados somando os níveis, o que permite
+# construir sketches em partições paralelas e juntá-los depois.
+
+_CAPACITY_DECAY = 2 / 3
+_MIN_LEVEL_CAPACITY = 8
+
+
+class KLLSketch:
+    """Sketch KLL de quantis para valores numéricos."""
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(_MIN_LEVEL_CAPACITY, int(math.ceil(self.k * _CAPACITY_DECAY ** depth)))
+
+    def _compress(self):
+        while sum(len(lvl) for lvl in self.levels) > sum(self._capacity(h) for h in range(len(self.levels))):
+            for h, items in enumerate(self.levels):
+                if len(items) >= self._capacity(h):
+                    break
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[h])
+            # Com tamanho ímpar, um item permanece no nível para não perder peso
+            keep = items[:len(items) % 2]
+            items = items[len(items) % 2:]
+            promoted = items[self._rng.integers(0, 2)::2]
+            self.levels[h] = keep
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+
+    def update(self, values):
+        """Incorpora um bloco de valores (array-like)."""
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        # Um bloco grande é compactado em cascata (cada compactação ordena e reduz o nível à metade)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Combina outro sketch neste (ex: sketches de partições processadas em paralelo)."""
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2 ** h, dtype=np.int64) for h, lvl in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def rank(self, values, inclusive=False):
+        """Fração estimada de itens < valor (ou <= valor, com inclusive=True)."""
+        items, cum = self._weighted_items()
+        pos = np.searchsorted(items, np.asarray(values, dtype=float), side='right' if inclusive else 'left')
+        return np.where(pos > 0, cum[np.maximum(pos - 1, 0)], 0) / cum[-1]
+
+    def quantiles(self, qs):
+        """Quantis aproximados; 0 e 1 retornam o mínimo e o máximo exatos."""
+        items, cum = self._weighted_items()
+        qs = np.asarray(qs, dtype=float)
+        pos = np.searchsorted(cum, qs * cum[-1], side='left')
+        result = items[np.minimum(pos, len(items) - 1)]
+        return np.where(qs <= 0, self.min, np.where(qs >= 1, self.max, result))
+
+    def normalized_rank_error(self):
+        """Limite aproximado do erro de rank (≈99% de confiança), pela fórmula empírica da Apache DataSketches."""
+        return 2.296 / self.k ** 0.9723
+
+    @classmethod
+    def from_values(cls, values, k=200, seed=None):
+        return cls(k=k, seed=seed).update(values)
+
+
+def _sketch_partition(args):
+    values, k, seed = args
+    return KLLSketch.from_values(values, k=k, seed=seed)
+
+
+def build_sketch(values, k=200, partitions=1, workers=None, seed=42):
+    """Constrói um sketch por partição (em paralelo se workers > 1) e combina todos."""
+    parts = np.array_split(np.asarray(values, dtype=float), max(partitions, 1))
+    seeds = np.random.SeedSequence(seed).spawn(len(parts))
+    tasks = [(part, k, s) for part, s in zip(parts, seeds)]
+    if workers and workers > 1 and len(parts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sketches = list(executor.map(_sketch_partition, tasks))
+    else:
+        sketches = [_sketch_partition(t) for t in tasks]
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    return merged
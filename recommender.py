@@ -0,0 +1,259 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import instrumentation
+import storage
+
+# --- Recomendação por Co-compra com Matrizes Esparsas ---
+#
+# Matriz esparsa binária clientes x itens (ProductName ou Category): 1 se o cliente comprou o
+# item ao menos uma vez. A co-ocorrência item x item é B.T @ B (a diagonal é o número de
+# compradores de cada item) e a similaridade de cosseno divide cada par por
+# sqrt(compradores_i * compradores_j). Só os top_n vizinhos de cada item ficam no índice,
+# uma matriz esparsa itens x itens S.
+# - Recomendação: soma das similaridades dos itens já comprados (linha de B @ S), sem os itens
+#   comprados; clientes desconhecidos recebem os itens mais populares.
+# - Em lote: B @ S em blocos de clientes, com o top-N de cada linha por ordenação vetorizada.
+# - Incremental: os pares (cliente, item) novos D atualizam a co-ocorrência só com as linhas
+#   dos clientes afetados (B'.T B' = B.T B + D.T B' + B.T D) e apenas os itens cujas
+#   similaridades mudaram têm os vizinhos recalculados. Como B é binária, reenviar pedidos
+#   já vistos não altera nada.
+
+top_n_neighbors = 20
+n_recommendations = 10
+batch_customers = 50_000
+levels = ['ProductName', 'Category']
+
+
+def _to_codes(values, vocabulary):
+    """Códigos inteiros de values, acrescentando ao vocabulário (dict valor -> código) os valores novos."""
+    inverse, uniques = pd.factorize(values) # Por hash: evita ordenar milhões de textos
+    codes = np.empty(len(uniques), dtype=np.int64)
+    for i, value in enumerate(uniques.tolist()):
+        codes[i] = vocabulary.setdefault(value, len(vocabulary))
+    return codes[inverse]
+
+
+def _top_per_row(matrix, n):
+    """(linhas, colunas, valores) dos n maiores valores de cada linha de uma matriz CSR."""
+    matrix = matrix.tocsr()
+    matrix.eliminate_zeros()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((matrix.indices, -matrix.data, rows)) # Por linha, do maior valor para o menor (empate: coluna)
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    keep = order[rank < n]
+    return rows[keep], matrix.indices[keep], matrix.data[keep]
+
+
+class CoPurchaseRecommender:
+    """Índice de vizinhos item-item por cosseno sobre a matriz binária clientes x itens."""
+
+    def __init__(self, level='ProductName', top_n=top_n_neighbors):
+        self.level = level
+        self.top_n = top_n
+        self.customers = {} # CustomerID -> linha
+        self.items = {} # item -> coluna
+        self.purchases = sparse.csr_matrix((0, 0), dtype=np.int8) # B (clientes x itens)
+        self.cooccurrence = sparse.csr_matrix((0, 0), dtype=np.int64) # B.T @ B
+        self.neighbors = sparse.csr_matrix((0, 0), dtype=np.float32) # S: top_n vizinhos de cada item
+        self._item_names = np.array([], dtype=object)
+
+    def __len__(self):
+        return len(self.customers)
+
+    @property
+    def item_names(self):
+        if len(self._item_names) != len(self.items): # O vocabulário só cresce
+            self._item_names = np.array(list(self.items), dtype=object)
+        return self._item_names
+
+    def _new_pairs(self, df):
+        """Matriz D dos pares (cliente, item) de df que ainda não estão em B (já no novo tamanho)."""
+        df = df[df['CustomerID'] != -1]
+        rows = _to_codes(df['CustomerID'].to_numpy(dtype=np.int64), self.customers)
+        cols = _to_codes(df[self.level].astype(str).to_numpy(), self.items)
+        shape = (len(self.customers), len(self.items))
+        self.purchases.resize(shape)
+        self.cooccurrence.resize((shape[1], shape[1]))
+        self.neighbors.resize((shape[1], shape[1]))
+        pairs = sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=shape)
+        pairs.data[:] = 1 # Pares repetidos no lote somam; volta a 1
+        return pairs - pairs.multiply(self.purchases).astype(np.int8)
+
+    def update(self, df):
+        """Incorpora pedidos (CustomerID e a coluna do nível) e recalcula os vizinhos afetados.
+
+        Retorna o número de pares (cliente, item) novos.
+        """
+        with instrumentation.stage(f'recommender.update.{self.level}', rows_in=len(df)) as st:
+            new = self._new_pairs(df)
+            new.eliminate_zeros()
+            if new.nnz == 0:
+                return 0
+            self.purchases = (self.purchases + new).tocsr()
+            affected = np.flatnonzero(np.diff(new.indptr)) # Clientes com pares novos
+            new_rows, all_rows = new[affected].astype(np.int64), self.purchases[affected].astype(np.int64)
+            old_rows = all_rows - new_rows
+            delta = new_rows.T @ all_rows + old_rows.T @ new_rows
+            self.cooccurrence = (self.cooccurrence + delta).tocsr()
+            # Itens com co-ocorrência alterada e itens cujo total de compradores mudou (afetam o cosseno)
+            changed_count = np.unique(new.indices)
+            changed = np.union1d(np.unique(delta.tocoo().row), self.cooccurrence[changed_count].tocoo().col)
+            self._rebuild_neighbors(changed)
+            st.set(new_pairs=new.nnz, items_rebuilt=len(changed), customers=len(self.customers))
+        return new.nnz
+
+    def fit(self, df):
+        """Índice completo a partir de todos os pedidos (equivale a update num índice vazio)."""
+        self.__init__(self.level, self.top_n)
+        self.update(df)
+        return self
+
+    def _rebuild_neighbors(self, items):
+        """Recalcula os top_n vizinhos por cosseno das linhas `items` de S."""
+        buyers = self.cooccurrence.diagonal().astype(np.float64)
+        norm = np.zeros_like(buyers)
+        norm[buyers > 0] = 1 / np.sqrt(buyers[buyers > 0])
+        rows = self.cooccurrence[items].tocoo()
+        similarity = rows.data * norm[items[rows.row]] * norm[rows.col]
+        off_diagonal = items[rows.row] != rows.col
+        block = sparse.csr_matrix((similarity[off_diagonal], (rows.row[off_diagonal], rows.col[off_diagonal])),
+                                  shape=(len(items), len(buyers)))
+        top_rows, top_cols, top_values = _top_per_row(block, self.top_n)
+        # Mantém as linhas não recalculadas e substitui as de `items`
+        keep = self.neighbors.tocoo()
+        keep_mask = ~np.isin(keep.row, items)
+        self.neighbors = sparse.csr_matrix(
+            (np.concatenate([keep.data[keep_mask], top_values]).astype(np.float32),
+             (np.concatenate([keep.row[keep_mask], items[top_rows]]), np.concatenate([keep.col[keep_mask], top_cols]))),
+            shape=(len(buyers), len(buyers)))
+
+    # --- Consultas ---
+
+    def popular(self, n=n_recommendations, exclude=()):
+        """Itens com mais compradores (recomendação para clientes sem histórico)."""
+        ranked = np.argsort(-self.cooccurrence.diagonal(), kind='stable')
+        ranked = ranked[~np.isin(ranked, exclude)][:n]
+        return self.item_names[ranked].tolist()
+
+    def similar_items(self, item, n=top_n_neighbors):
+        """Vizinhos mais próximos de um item, como lista de (item, similaridade)."""
+        row = self.neighbors[self.items[item]]
+        order = np.argsort(-row.data, kind='stable')[:n]
+        return list(zip(self.item_names[row.indices[order]].tolist(), row.data[order].astype(np.float64).round(4).tolist()))
+
+    def recommend(self, customer_id, n=n_recommendations):
+        """Lista de (item, score) para um cliente; para cliente desconhecido, os itens populares com score 0."""
+        row_index = self.customers.get(int(customer_id))
+        if row_index is None:
+            return [(item, 0.0) for item in self.popular(n)]
+        history = self.purchases[row_index]
+        scores = (history @ self.neighbors).tocsr() # Linha 1 x itens
+        candidates = ~np.isin(scores.indices, history.indices)
+        items, values = scores.indices[candidates], scores.data[candidates]
+        order = np.lexsort((items, -values))[:n]
+        return list(zip(self.item_names[items[order]].tolist(), values[order].astype(np.float64).round(4).tolist()))
+
+    def recommend_all(self, n=n_recommendations, batch_size=batch_customers):
+        """Recomendações de todos os clientes (CustomerID, Rank, Item, Score), em blocos de clientes."""
+        customer_ids = np.fromiter(self.customers, dtype=np.int64, count=len(self.customers))
+        item_names = self.item_names
+        frames = []
+        for start in range(0, len(customer_ids), batch_size):
+            history = self.purchases[start:start + batch_size]
+            scores = (history @ self.neighbors).tocsr()
+            scores = scores - scores.multiply(history) # Remove itens já comprados
+            rows, cols, values = _top_per_row(scores, n)
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+            frames.append(pd.DataFrame({'CustomerID': customer_ids[start + rows], 'Rank': rank + 1,
+                                        'Item': item_names[cols], 'Score': values.astype(np.float64).round(4)}))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['CustomerID', 'Rank', 'Item', 'Score'])
+
+    # --- Persistência ---
+
+    def save(self, path):
+        """Grava B, a co-ocorrência e os vizinhos como arrays CSR (o load não recalcula nada)."""
+        matrices = {'purchases': self.purchases, 'cooccurrence': self.cooccurrence, 'neighbors': self.neighbors}
+        arrays = {}
+        for name, matrix in matrices.items():
+            matrix = matrix.tocsr()
+            arrays.update({f'{name}_indptr': matrix.indptr, f'{name}_indices': matrix.indices})
+            if name != 'purchases': # B é binária: os valores são todos 1
+                arrays[f'{name}_data'] = matrix.data
+        np.savez(path, level=np.array([self.level]), top_n=np.array([self.top_n]),
+                 customer_ids=np.fromiter(self.customers, dtype=np.int64, count=len(self.customers)),
+                 items=np.array(list(self.items), dtype=str), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Carrega o índice salvo; arquivos antigos, só com B, têm a co-ocorrência e os vizinhos recalculados."""
+        with np.load(path) as data:
+            model = cls(str(data['level'][0]), int(data['top_n'][0]))
+            model.customers = {c: i for i, c in enumerate(data['customer_ids'].tolist())}
+            model.items = {item: i for i, item in enumerate(data['items'].tolist())}
+            shape = (len(model.customers), len(model.items))
+            indices = data['purchases_indices']
+            model.purchases = sparse.csr_matrix((np.ones(len(indices), dtype=np.int8), indices,
+                                                 data['purchases_indptr']), shape=shape)
+            if 'neighbors_data' in data:
+                for name in ('cooccurrence', 'neighbors'):
+                    setattr(model, name, sparse.csr_matrix((data[f'{name}_data'], data[f'{name}_indices'],
+                                                            data[f'{name}_indptr']), shape=(shape[1], shape[1])))
+                return model
+        model.cooccurrence = (model.purchases.T.astype(np.int64) @ model.purchases.astype(np.int64)).tocsr()
+        model.neighbors = sparse.csr_matrix((shape[1], shape[1]), dtype=np.float32)
+        model._rebuild_neighbors(np.arange(shape[1]))
+        return model
+
+    @classmethod
+    def load_or_create(cls, path, level='ProductName', top_n=top_n_neighbors):
+        return cls.load(path) if os.path.exists(path) else cls(level, top_n)
+
+
+def index_path(level):
+    return storage.data_path(f'recommender_{level}.npz')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recomendações por co-compra (cosseno item-item em matrizes esparsas).')
+    parser.add_argument('--input', default=storage.table_path(storage.data_path('online_sales_processed.csv')))
+    parser.add_argument('--update', default=None,
+                        help='Arquivo com pedidos novos: atualiza incrementalmente os índices salvos')
+    parser.add_argument('--levels', nargs='+', default=levels, choices=levels)
+    parser.add_argument('--top-n', type=int, default=top_n_neighbors, help='Vizinhos guardados por item')
+    parser.add_argument('--n', type=int, default=n_recommendations, help='Recomendações por cliente')
+    parser.add_argument('--customer', type=int, default=None, help='Mostra as recomendações de um cliente')
+    parser.add_argument('--output', default=storage.data_path('recommendations.csv'))
+    args = parser.parse_args()
+
+    source = args.update or args.input
+    df = storage.read_table(source, columns=['CustomerID'] + args.levels, dtype={'CustomerID': 'Int64'})
+    df = df.dropna(subset=['CustomerID'])
+    frames = []
+    for level in args.levels:
+        start = time.perf_counter()
+        if args.update:
+            model = CoPurchaseRecommender.load_or_create(index_path(level), level, args.top_n)
+            added = model.update(df)
+            print(f"[{level}] {added:,} pares cliente x item novos incorporados em {time.perf_counter() - start:.2f}s")
+        else:
+            model = CoPurchaseRecommender(level, args.top_n).fit(df)
+            print(f"[{level}] {len(model):,} clientes x {len(model.items):,} itens, "
+                  f"{model.purchases.nnz:,} pares; índice criado em {time.perf_counter() - start:.2f}s")
+        model.save(index_path(level))
+
+        start = time.perf_counter()
+        recommendations = model.recommend_all(args.n)
+        print(f"[{level}] {len(recommendations):,} recomendações para todos os clientes em {time.perf_counter() - start:.2f}s")
+        frames.append(recommendations.assign(Level=level))
+        if args.customer is not None:
+            start = time.perf_counter()
+            result = model.recommend(args.customer, args.n)
+            print(f"[{level}] Cliente {args.customer} ({(time.perf_counter() - start) * 1e3:.2f} ms): {result}")
+
+    pd.concat(frames, ignore_index=True).to_csv(args.output, index=False)
+    print(f"Recomendações salvas em {args.output}")
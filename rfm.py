@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+# --- Cálculo e Segmentação RFM Vetorizados ---
+#
+# Recência por max() nativo do groupby + subtração de arrays (sem lambda por grupo) e
+# segmentos por uma tabela 5x5 indexada pelos scores inteiros R e F, no lugar de
+# concatenar strings e aplicar os 10 regex de segment_map a cada cliente.
+
+segment_map = {
+    r'[1-2][1-2]': 'Hibernando',
+    r'[1-2][3-4]': 'Em Risco',
+    r'[1-2]5': 'Não Pode Perder',
+    r'3[1-2]': 'Quase Dormindo',
+    r'33': 'Precisa Atenção',
+    r'[3-4][4-5]': 'Clientes Leais',
+    r'41': 'Promissor',
+    r'51': 'Novos Clientes',
+    r'[4-5][2-3]': 'Potenciais Leais',
+    r'5[4-5]': 'Campeões'
+}
+
+
+def build_segment_table(segment_map=segment_map):
+    """Tabela 5x5 (R_Score-1, F_Score-1) -> segmento.
+
+    Pré-calculada aplicando o mesmo Series.replace(segment_map, regex=True) às 25
+    combinações possíveis, de modo que o resultado é idêntico ao mapeamento original.
+    """
+    codes = pd.Series([f"{r}{f}" for r in range(1, 6) for f in range(1, 6)])
+    return codes.replace(segment_map, regex=True).to_numpy(dtype=object).reshape(5, 5)
+
+
+segment_table = build_segment_table()
+
+
+def compute_rfm(df, reference_date):
+    """Recency/Frequency/MonetaryValue por cliente com agregações nativas do groupby."""
+    grouped = df.groupby("CustomerID")
+    rfm_df = pd.DataFrame({
+        "LastPurchase": grouped["Date"].max(),
+        "Frequency": grouped["OrderID"].nunique(),
+        "MonetaryValue": grouped["TotalPrice"].sum().round(2), # Centavos (o original não arredondava), como no estado incremental
+    })
+    recency = (np.datetime64(pd.Timestamp(reference_date)) - rfm_df["LastPurchase"].to_numpy()) // np.timedelta64(1, 'D')
+    rfm_df.insert(0, "Recency", recency.astype(np.int64))
+    return rfm_df.drop(columns="LastPurchase").reset_index()
+
+
+def assign_segments(r_scores, f_scores):
+    """Segmento de cada cliente por indexação direta na tabela 5x5."""
+    r = np.asarray(r_scores, dtype=np.intp) - 1
+    f = np.asarray(f_scores, dtype=np.intp) - 1
+    return segment_table[r, f]
+
+
+def rfm_score_codes(r_scores, f_scores, m_scores):
+    """RFM_Score ('RFM' concatenado, ex: '535') a partir de aritmética inteira."""
+    codes = np.asarray(r_scores) * 100 + np.asarray(f_scores) * 10 + np.asarray(m_scores)
+    return codes.astype(str).astype(object)
+
+
+def add_scores(rfm_df, scores):
+    """Acrescenta ao rfm_df os scores R/F/M, RFM_Score, RFM_Sum_Score e o Segment."""
+    rfm_df[["R_Score", "F_Score", "M_Score"]] = scores[["R_Score", "F_Score", "M_Score"]]
+    rfm_df["RFM_Score"] = rfm_score_codes(rfm_df["R_Score"], rfm_df["F_Score"], rfm_df["M_Score"])
+    rfm_df["RFM_Sum_Score"] = rfm_df["R_Score"] + rfm_df["F_Score"] + rfm_df["M_Score"]
+    rfm_df["Segment"] = assign_segments(rfm_df["R_Score"], rfm_df["F_Score"])
+    return rfm_df
+
+
+# --- Scores RFM por Quantis (exato com qcut ou aproximado com sketch KLL) ---
+
+score_labels = {
+    "R_Score": list(range(5, 0, -1)), # Recência menor = score maior
+    "F_Score": list(range(1, 6)),
+    "M_Score": list(range(1, 6)),
+}
+score_metrics = {"R_Score": "Recency", "F_Score": "Frequency", "M_Score": "MonetaryValue"}
+
+
+def score_exact(rfm_df, rank_first=True, duplicates='drop'):
+    """Scores R/F/M com pd.qcut sobre todos os clientes (F via rank(method='first'))."""
+    scores = {}
+    for score, metric in score_metrics.items():
+        values = rfm_df[metric]
+        if score == "F_Score" and rank_first:
+            values = values.rank(method='first')
+        scores[score] = pd.qcut(values, q=5, labels=score_labels[score], duplicates=duplicates).astype(int)
+    return pd.DataFrame(scores, index=rfm_df.index)
+
+
+def _bins_from_edges(values, edges, labels, duplicates):
+    # Mesma convenção do qcut: intervalos fechados à direita, o primeiro inclui o mínimo
+    if duplicates == 'drop':
+        edges = np.unique(edges)
+    elif len(np.unique(edges)) < len(edges):
+        raise ValueError(f"Limites de quantis não são únicos: {edges}; use duplicates='drop'")
+    idx = np.searchsorted(edges[1:-1], values, side='left')
+    return np.asarray(labels)[idx]
+
+
+class RankFirstScorer:
+    """Aproxima qcut(values.rank(method='first')) em streaming.
+
+    O rank de cada cliente é estimado como (itens < valor, pelo sketch) + posição do
+    cliente entre os empates do mesmo valor, na ordem de chegada — como o rank 'first'.
+    """
+
+    def __init__(self, sketch, labels, q=5):
+        self.sketch = sketch
+        self.labels = labels
+        n = sketch.n
+        self.edges = 1 + (n - 1) * np.linspace(0, 1, q + 1) # Quantis dos ranks 1..n
+        self._ties_seen = {}
+
+    def assign(self, values):
+        values = np.asarray(values, dtype=float)
+        uniq, inverse = np.unique(values, return_inverse=True)
+        below = np.rint(self.sketch.rank(uniq, inclusive=False) * self.sketch.n)
+        offset = np.array([self._ties_seen.get(v, 0) for v in uniq])
+        tie_pos = pd.Series(inverse).groupby(inverse).cumcount().to_numpy() + 1
+        ranks = below[inverse] + offset[inverse] + tie_pos
+        for v, count in zip(uniq, np.bincount(inverse)):
+            self._ties_seen[v] = self._ties_seen.get(v, 0) + count
+        return _bins_from_edges(ranks, self.edges, self.labels, 'raise')
+
+
+def score_sketch(rfm_df, k=200, partitions=1, workers=None, rank_first=True, duplicates='drop', chunk_size=1_000_000):
+    """Scores R/F/M por quintis aproximados de sketches KLL.
+
+    1ª passagem: um sketch por métrica (por partição, combinados ao final).
+    2ª passagem (em blocos): score por busca binária nos limites dos quintis.
+    Retorna os scores e os sketches (para o relatório de erro).
+    """
+    from quantile_sketch import build_sketch
+
+    sketches = {score: build_sketch(rfm_df[metric].to_numpy(), k=k, partitions=partitions, workers=workers)
+                for score, metric in score_metrics.items()}
+    edges = {score: sketch.quantiles(np.linspace(0, 1, 6)) for score, sketch in sketches.items()}
+    rank_scorer = RankFirstScorer(sketches["F_Score"], score_labels["F_Score"]) if rank_first else None
+
+    parts = {score: [] for score in score_metrics}
+    for start in range(0, len(rfm_df), chunk_size):
+        chunk = rfm_df.iloc[start:start + chunk_size]
+        for score, metric in score_metrics.items():
+            values = chunk[metric].to_numpy(dtype=float)
+            if score == "F_Score" and rank_scorer is not None:
+                parts[score].append(rank_scorer.assign(values))
+            else:
+                parts[score].append(_bins_from_edges(values, edges[score], score_labels[score], duplicates))
+    scores = pd.DataFrame({score: np.concatenate(p).astype(int) for score, p in parts.items()}, index=rfm_df.index)
+    return scores, sketches
+
+
+def sketch_error_report(rfm_df, exact_scores, approx_scores, sketches):
+    """Compara os scores do sketch com o qcut exato.
+
+    Para cada score: fração de clientes com o mesmo score, erro máximo de rank dos
+    limites aproximados (distância entre o quantil alvo e o intervalo de ranks ocupado
+    pelo valor do limite, que pode ser largo em métricas com muitos empates) e o limite
+    teórico do sketch.
+    """
+    rows = {}
+    targets = np.linspace(0, 1, 6)[1:-1]
+    for score, metric in score_metrics.items():
+        values = np.sort(rfm_df[metric].to_numpy(dtype=float))
+        approx_edges = sketches[score].quantiles(targets)
+        rank_lo = np.searchsorted(values, approx_edges, side='left') / len(values)
+        rank_hi = np.searchsorted(values, approx_edges, side='right') / len(values)
+        rank_error = np.maximum(0, np.maximum(rank_lo - targets, targets - rank_hi))
+        rows[score] = {
+            "Concordancia": float((exact_scores[score] == approx_scores[score]).mean()),
+            "Erro_Rank_Max": float(rank_error.max()),
+            "Erro_Rank_Teorico": sketches[score].normalized_rank_error(),
+        }
+    return pd.DataFrame(rows).T
@@ -0,0 +1,170 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import rfm
+import schema
+import storage
+
+# --- RFM em Vários Instantes e Janelas (uma ordenação, somas de prefixo) ---
+#
+# Calcula R/F/M de todos os clientes para vários instantes (ex: cada fim de mês) e janelas
+# (histórico completo e os últimos 90/180/365 dias) sem reagrupar os dados a cada instante:
+# as transações são ordenadas uma única vez por (CustomerID, Date) e, com somas acumuladas
+# de pedidos distintos e de valor (em centavos), cada par (instante, janela) vira duas buscas
+# binárias por cliente. Cada instante é pontuado com o mesmo qcut do script de segmentação,
+# e as migrações entre segmentos de instantes consecutivos formam a matriz de transição.
+#
+# O instante D usa como data de referência D + 1 dia à meia-noite (transações com Date <
+# referência) e a janela de W dias considera as transações com Date >= referência - W dias.
+# customer_segmentation_corrected.py usa o último horário + 1 dia, então no último instante a
+# Recência pode diferir em 1 dia, mas os quintis (e os segmentos) são os mesmos.
+
+default_windows = [None, 90, 180, 365] # None = histórico completo
+inactive_label = 'Sem Compras' # Cliente sem pedidos na janela de um dos instantes
+
+
+def window_label(window):
+    return 'total' if window is None else f'{window}d'
+
+
+def month_end_snapshots(dates):
+    """Último dia de cada mês presente em dates (o último mês termina na última data disponível)."""
+    dates = pd.to_datetime(pd.Series(dates))
+    last_day = dates.max().normalize()
+    month_ends = pd.period_range(dates.min(), dates.max(), freq='M').to_timestamp(how='end').normalize()
+    return pd.DatetimeIndex(month_ends.where(month_ends <= last_day, last_day), name='Snapshot')
+
+
+class SortedTransactions:
+    """Transações ordenadas por (CustomerID, Date) com somas de prefixo de pedidos e centavos."""
+
+    def __init__(self, df):
+        customers = df['CustomerID'].to_numpy(dtype=np.int64)
+        seconds = df['Date'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        cents = np.round(df['TotalPrice'].to_numpy(dtype=float) * 100).astype(np.int64)
+        orders = df['OrderID'].to_numpy(dtype=np.int64)
+
+        order = np.lexsort((seconds, customers))
+        customers, seconds, cents, orders = customers[order], seconds[order], cents[order], orders[order]
+        self.customer_ids, starts = np.unique(customers, return_index=True)
+        codes = np.repeat(np.arange(len(self.customer_ids), dtype=np.int64), np.diff(np.append(starts, len(customers))))
+
+        # Chave única e ordenada (cliente, tempo): uma busca binária global responde "pedidos do
+        # cliente c antes do instante t" para todos os clientes de uma vez
+        self.t0 = int(seconds.min()) if len(seconds) else 0
+        self.span = (int(seconds.max()) - self.t0 + 2) if len(seconds) else 2
+        self.keys = codes * self.span + (seconds - self.t0)
+        self.seconds = seconds
+        self._customer_base = np.arange(len(self.customer_ids), dtype=np.int64) * self.span
+
+        # Pedido distinto = primeira linha de cada (CustomerID, OrderID) na ordem das datas
+        first_line = ~pd.Series((customers << 32) | orders).duplicated().to_numpy()
+        self.cum_orders = np.concatenate([[0], np.cumsum(first_line, dtype=np.int64)])
+        self.cum_cents = np.concatenate([[0], np.cumsum(cents)])
+
+    def _positions(self, timestamp):
+        # Para cada cliente: índice da primeira transação com Date >= timestamp
+        offset = np.clip(pd.Timestamp(timestamp).value // 10 ** 9 - self.t0, 0, self.span - 1)
+        return np.searchsorted(self.keys, self._customer_base + offset, side='left')
+
+    def rfm_at(self, reference_date, window=None):
+        """rfm_df (CustomerID, Recency, Frequency, MonetaryValue) dos clientes com pedidos na janela."""
+        reference_date = pd.Timestamp(reference_date)
+        hi = self._positions(reference_date)
+        if window is None:
+            lo = self._positions(pd.Timestamp(self.t0, unit='s'))
+        else:
+            lo = self._positions(reference_date - pd.Timedelta(days=window))
+        frequency = self.cum_orders[hi] - self.cum_orders[lo]
+        active = np.flatnonzero(frequency > 0)
+        hi, lo = hi[active], lo[active]
+        last = self.seconds[hi - 1].astype('datetime64[s]')
+        recency = (np.datetime64(reference_date, 's') - last) // np.timedelta64(1, 'D')
+        return pd.DataFrame({
+            'CustomerID': self.customer_ids[active],
+            'Recency': recency.astype(np.int64),
+            'Frequency': frequency[active],
+            'MonetaryValue': (self.cum_cents[hi] - self.cum_cents[lo]) / 100,
+        })
+
+
+def compute_snapshots(df, snapshots=None, windows=default_windows, rank_first=True, duplicates='drop'):
+    """R/F/M, scores e Segment de cada cliente em cada (instante, janela), numa tabela longa.
+
+    df: transações com CustomerID, OrderID, Date e TotalPrice (clientes válidos).
+    snapshots: datas "até o fim do dia" (padrão: fim de cada mês, ver month_end_snapshots).
+    """
+    with instrumentation.stage('rfm_snapshots.sort', rows_in=len(df)):
+        transactions = SortedTransactions(df)
+    snapshots = month_end_snapshots(df['Date']) if snapshots is None else pd.DatetimeIndex(snapshots)
+    frames = []
+    for snapshot in snapshots:
+        reference_date = snapshot.normalize() + pd.Timedelta(days=1)
+        for window in windows:
+            with instrumentation.stage('rfm_snapshots.score', snapshot=snapshot, window=window_label(window)) as st:
+                rfm_df = transactions.rfm_at(reference_date, window)
+                if len(rfm_df) < 5:
+                    continue # Poucos clientes para formar quintis
+                scores = rfm.score_exact(rfm_df, rank_first=rank_first, duplicates=duplicates)
+                rfm_df = rfm.add_scores(rfm_df, scores)
+                rfm_df.insert(0, 'Window', window_label(window))
+                rfm_df.insert(0, 'Snapshot', snapshot)
+                frames.append(rfm_df)
+                st.set(rows_out=len(rfm_df))
+    return pd.concat(frames, ignore_index=True)
+
+
+def transitions(snapshots_df, window='total'):
+    """Contagem de clientes por (Snapshot, From, To) entre cada instante e o anterior, numa janela.
+
+    Clientes sem pedidos na janela em um dos dois instantes aparecem como inactive_label.
+    """
+    wide = (snapshots_df[snapshots_df['Window'] == window]
+            .pivot(index='CustomerID', columns='Snapshot', values='Segment')
+            .sort_index(axis=1).astype(object).fillna(inactive_label))
+    frames = []
+    for previous, current in zip(wide.columns[:-1], wide.columns[1:]):
+        counts = wide.groupby([previous, current]).size()
+        counts.index.names = ['From', 'To']
+        frames.append(counts.rename('Customers').reset_index().assign(Snapshot=current))
+    columns = ['Snapshot', 'From', 'To', 'Customers']
+    return pd.concat(frames, ignore_index=True)[columns] if frames else pd.DataFrame(columns=columns)
+
+
+def transition_matrix(snapshots_df, window='total', normalize=True):
+    """Matriz From x To somada sobre todos os pares de instantes consecutivos (linhas somam 1 com normalize)."""
+    counts = transitions(snapshots_df, window)
+    matrix = counts.pivot_table(index='From', columns='To', values='Customers', aggfunc='sum', fill_value=0)
+    labels = sorted(set(matrix.index) | set(matrix.columns))
+    matrix = matrix.reindex(index=labels, columns=labels, fill_value=0)
+    if normalize:
+        matrix = matrix.div(matrix.sum(axis=1).replace(0, np.nan), axis=0).fillna(0)
+    return matrix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RFM e segmentos em cada fim de mês e janelas móveis, com matriz de transição.')
+    parser.add_argument('--input', default=storage.table_path(storage.data_path('online_sales_processed.csv')))
+    parser.add_argument('--windows', nargs='+', default=['total', '90', '180', '365'],
+                        help="Janelas em dias ('total' = histórico completo)")
+    parser.add_argument('--output', default=storage.table_path(storage.data_path('rfm_snapshots.csv')))
+    parser.add_argument('--transitions-output', default=storage.data_path('segment_transitions.csv'))
+    args = parser.parse_args()
+    windows = [None if w == 'total' else int(w) for w in args.windows]
+
+    df = schema.apply(storage.read_table(args.input, columns=['OrderID', 'CustomerID', 'Date', 'TotalPrice'],
+                                         parse_dates=['Date'], dtype={'CustomerID': 'Int64'}))
+    df = df[df['CustomerID'] != -1]
+    snapshots_df = compute_snapshots(df, windows=windows)
+    storage.write_table(snapshots_df, args.output)
+    print(f"{snapshots_df['Snapshot'].nunique()} instantes x {len(windows)} janelas: {len(snapshots_df):,} linhas salvas em {args.output}")
+
+    all_transitions = pd.concat([transitions(snapshots_df, window_label(w)).assign(Window=window_label(w))
+                                 for w in windows], ignore_index=True)
+    all_transitions.to_csv(args.transitions_output, index=False)
+    print(f"Transições entre instantes consecutivos salvas em {args.transitions_output}")
+    for w in windows:
+        print(f"\nMatriz de transição ({window_label(w)}, proporção de clientes por segmento de origem):")
+        print(transition_matrix(snapshots_df, window_label(w)).round(3).to_string())
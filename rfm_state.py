@@ -0,0 +1,246 @@
+import os
+import numpy as np
+import pandas as pd
+
+# --- Estado RFM Incremental por Cliente ---
+#
+# Guarda, por cliente, a data da última compra, o número de pedidos distintos e a soma
+# monetária (em centavos, para que a soma incremental seja exata). Novos lotes de
+# transações são incorporados olhando apenas o delta; a Recência é derivada na consulta
+# a partir da data de referência, então o rfm_df resultante é igual ao recálculo completo.
+#
+# Custo por lote proporcional ao delta (não ao histórico):
+# - Cada cliente tem uma linha fixa em buffers que crescem por duplicação (clientes novos são
+#   acrescentados no fim). O índice CustomerID -> linha é um vetor ordenado principal mais uma
+#   cauda ordenada pequena que recebe os clientes novos e é fundida ao principal só quando
+#   passa de tail_merge_size.
+# - Pedidos repetidos são descartados com uma marca d'água: OrderID <= order_floor conta como
+#   já visto, e acima dela as chaves (cliente, pedido) recentes ficam numa janela limitada a
+#   recent_orders. Um pedido atrasado com OrderID abaixo da marca é tratado como repetido.
+
+_ORDER_BITS = 32
+_ORDER_MASK = (1 << _ORDER_BITS) - 1
+
+tail_merge_size = 1 << 18 # Clientes novos na cauda do índice antes de fundi-la ao vetor principal
+recent_orders = 1_000_000 # Chaves de pedidos acima da marca d'água guardadas para deduplicação
+_min_capacity = 1024
+
+
+def _order_keys(customer_ids, order_ids):
+    """Chave única (CustomerID, OrderID) em 64 bits, usada para contar pedidos distintos."""
+    customer_ids = np.asarray(customer_ids, dtype=np.int64)
+    order_ids = np.asarray(order_ids, dtype=np.int64)
+    if len(order_ids) and (order_ids.min() < 0 or order_ids.max() >= 1 << _ORDER_BITS
+                           or customer_ids.min() < 0 or customer_ids.max() >= 1 << (63 - _ORDER_BITS)):
+        raise ValueError("CustomerID/OrderID fora da faixa suportada pelo estado RFM incremental")
+    return (customer_ids << _ORDER_BITS) | order_ids
+
+
+def _lookup(sorted_ids, sorted_rows, ids):
+    """Linha de cada id no índice ordenado (-1 se ausente)."""
+    rows = np.full(len(ids), -1, dtype=np.int64)
+    if len(sorted_ids):
+        pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        hit = sorted_ids[pos] == ids
+        rows[hit] = sorted_rows[pos[hit]]
+    return rows
+
+
+class RFMStateStore:
+    """Estado RFM persistido, atualizável com lotes de novas transações em O(delta)."""
+
+    def __init__(self):
+        self._size = 0
+        self._ids = np.empty(_min_capacity, dtype=np.int64)
+        self._last = np.empty(_min_capacity, dtype='datetime64[ns]')
+        self._freq = np.empty(_min_capacity, dtype=np.int64)
+        self._cents = np.empty(_min_capacity, dtype=np.int64)
+        self._index_ids = np.empty(0, dtype=np.int64) # Índice principal (ordenado por CustomerID)
+        self._index_rows = np.empty(0, dtype=np.int64)
+        self._tail_ids = np.empty(0, dtype=np.int64) # Clientes novos desde a última fusão (ordenado)
+        self._tail_rows = np.empty(0, dtype=np.int64)
+        self.recent_keys = np.empty(0, dtype=np.int64) # Ordenado; pares (cliente, pedido) acima de order_floor
+        self.order_floor = 0
+        self.max_date = None
+        self.max_order_id = 0
+
+    def __len__(self):
+        return self._size
+
+    # Colunas por linha do estado (ordem de chegada dos clientes; to_rfm() ordena por CustomerID)
+    @property
+    def customer_ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def last_purchase(self):
+        return self._last[:self._size]
+
+    @property
+    def frequency(self):
+        return self._freq[:self._size]
+
+    @property
+    def monetary_cents(self):
+        return self._cents[:self._size]
+
+    def rows_of(self, customer_ids):
+        """Linha de cada CustomerID no estado (-1 para clientes desconhecidos)."""
+        ids = np.asarray(customer_ids, dtype=np.int64)
+        rows = _lookup(self._index_ids, self._index_rows, ids)
+        missing = rows < 0
+        if missing.any() and len(self._tail_ids):
+            rows[missing] = _lookup(self._tail_ids, self._tail_rows, ids[missing])
+        return rows
+
+    def _append_customers(self, ids, last, freq, cents):
+        # ids ordenados e ausentes do estado; buffers crescem por duplicação (custo amortizado O(1))
+        start, end = self._size, self._size + len(ids)
+        if end > len(self._ids):
+            capacity = max(end, 2 * len(self._ids))
+            for name in ('_ids', '_last', '_freq', '_cents'):
+                old = getattr(self, name)
+                grown = np.empty(capacity, dtype=old.dtype)
+                grown[:start] = old[:start]
+                setattr(self, name, grown)
+        self._ids[start:end], self._last[start:end] = ids, last
+        self._freq[start:end], self._cents[start:end] = freq, cents
+        self._size = end
+        rows = np.arange(start, end, dtype=np.int64)
+        pos = np.searchsorted(self._tail_ids, ids)
+        self._tail_ids = np.insert(self._tail_ids, pos, ids)
+        self._tail_rows = np.insert(self._tail_rows, pos, rows)
+        if len(self._tail_ids) > tail_merge_size:
+            self._merge_tail()
+        return rows
+
+    def _merge_tail(self):
+        if not len(self._tail_ids):
+            return
+        ids = np.concatenate([self._index_ids, self._tail_ids])
+        order = np.argsort(ids, kind='stable') # Duas sequências ordenadas: fusão em tempo linear
+        self._index_ids = ids[order]
+        self._index_rows = np.concatenate([self._index_rows, self._tail_rows])[order]
+        self._tail_ids = self._tail_ids[:0]
+        self._tail_rows = self._tail_rows[:0]
+
+    def _fresh_orders(self, keys, orders):
+        """Máscara das linhas de pedidos ainda não vistos (marca d'água + janela de chaves recentes)."""
+        fresh = orders > self.order_floor
+        if len(self.recent_keys):
+            pos = np.minimum(np.searchsorted(self.recent_keys, keys), len(self.recent_keys) - 1)
+            fresh &= self.recent_keys[pos] != keys
+        return fresh
+
+    def _remember_orders(self, new_keys):
+        # new_keys ordenadas e ausentes da janela
+        self.recent_keys = np.insert(self.recent_keys, np.searchsorted(self.recent_keys, new_keys), new_keys)
+        if len(self.recent_keys) > 2 * recent_orders:
+            # Sobe a marca d'água até restarem as recent_orders chaves de OrderID mais alto
+            order_ids = self.recent_keys & _ORDER_MASK
+            cut = len(order_ids) - recent_orders - 1
+            self.order_floor = max(self.order_floor, int(np.partition(order_ids, cut)[cut]))
+            self.recent_keys = self.recent_keys[order_ids > self.order_floor]
+
+    def update(self, df):
+        """Incorpora um lote com CustomerID, OrderID, Date e TotalPrice (clientes válidos)."""
+        self.apply_delta(df)
+        return self
+
+    def apply_delta(self, df):
+        """Como update(), mas retorna as linhas (ver customer_ids) dos clientes alterados pelo lote."""
+        if len(df) == 0:
+            return np.empty(0, dtype=np.int64)
+        customers = df['CustomerID'].to_numpy(dtype=np.int64)
+        orders = df['OrderID'].to_numpy(dtype=np.int64)
+        keys = _order_keys(customers, orders)
+
+        # Pedidos já incorporados são ignorados (reenvio do mesmo lote não conta em dobro);
+        # cada pedido deve chegar completo num único lote
+        fresh = self._fresh_orders(keys, orders)
+        if not fresh.all():
+            df, customers, orders, keys = df[fresh], customers[fresh], orders[fresh], keys[fresh]
+            if len(df) == 0:
+                return np.empty(0, dtype=np.int64)
+        dates = df['Date'].to_numpy(dtype='datetime64[ns]')
+        cents = np.round(df['TotalPrice'].to_numpy(dtype=float) * 100).astype(np.int64)
+
+        # Pedidos distintos do lote
+        new_keys, first = np.unique(keys, return_index=True)
+        self._remember_orders(new_keys)
+
+        # Agregados do delta por cliente
+        delta_customers, inverse = np.unique(customers, return_inverse=True)
+        delta_last_i8 = np.full(len(delta_customers), np.iinfo(np.int64).min)
+        np.maximum.at(delta_last_i8, inverse, dates.view(np.int64))
+        delta_last = delta_last_i8.view('datetime64[ns]')
+        delta_cents = np.bincount(inverse, weights=cents, minlength=len(delta_customers)).astype(np.int64)
+        delta_freq = np.bincount(inverse[first], minlength=len(delta_customers)).astype(np.int64)
+
+        # Clientes já existentes: combina com o estado nas próprias linhas
+        rows = self.rows_of(delta_customers)
+        exists = rows >= 0
+        idx = rows[exists]
+        self._last[idx] = np.maximum(self._last[idx], delta_last[exists])
+        self._freq[idx] += delta_freq[exists]
+        self._cents[idx] += delta_cents[exists]
+
+        # Clientes novos: linhas acrescentadas no fim
+        new = ~exists
+        rows[new] = self._append_customers(delta_customers[new], delta_last[new], delta_freq[new], delta_cents[new])
+
+        batch_max = dates.max()
+        self.max_date = batch_max if self.max_date is None else max(self.max_date, batch_max)
+        self.max_order_id = max(self.max_order_id, int(orders.max()))
+        return rows
+
+    def reference_date(self):
+        """Data de referência padrão: um dia após a última transação conhecida."""
+        return pd.Timestamp(self.max_date) + pd.Timedelta(days=1)
+
+    def _sorted_rows(self):
+        self._merge_tail()
+        return self._index_rows
+
+    def to_rfm(self, reference_date=None):
+        """rfm_df (CustomerID, Recency, Frequency, MonetaryValue) na data de referência, ordenado por CustomerID."""
+        reference_date = pd.Timestamp(reference_date) if reference_date is not None else self.reference_date()
+        rows = self._sorted_rows()
+        recency = (reference_date.to_datetime64() - self._last[rows]) // np.timedelta64(1, 'D')
+        return pd.DataFrame({
+            'CustomerID': self._ids[rows],
+            'Recency': recency.astype(np.int64),
+            'Frequency': self._freq[rows],
+            'MonetaryValue': self._cents[rows] / 100,
+        })
+
+    def save(self, path):
+        rows = self._sorted_rows()
+        np.savez(path, customer_ids=self._ids[rows], last_purchase=self._last[rows].view(np.int64),
+                 frequency=self._freq[rows], monetary_cents=self._cents[rows], recent_keys=self.recent_keys,
+                 order_floor=np.array([self.order_floor], dtype=np.int64),
+                 max_date=np.array([self.max_date], dtype='datetime64[ns]').view(np.int64),
+                 max_order_id=np.array([self.max_order_id], dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        state = cls()
+        with np.load(path) as data:
+            ids = data['customer_ids']
+            state._append_customers(ids, data['last_purchase'].view('datetime64[ns]'), data['frequency'],
+                                    data['monetary_cents'])
+            if 'recent_keys' in data:
+                state.recent_keys = data['recent_keys']
+                state.order_floor = int(data['order_floor'][0])
+            else: # Estado antigo, com todas as chaves já vistas: passa pela mesma poda da janela
+                state.recent_keys = np.empty(0, dtype=np.int64)
+                state._remember_orders(data['order_keys'])
+            max_date = data['max_date'].view('datetime64[ns]')[0]
+            state.max_date = None if np.isnat(max_date) else max_date
+            state.max_order_id = int(data['max_order_id'][0])
+        state._merge_tail()
+        return state
+
+    @classmethod
+    def load_or_create(cls, path):
+        return cls.load(path) if os.path.exists(path) else cls()
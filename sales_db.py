@@ -0,0 +1,221 @@
+import sqlite3
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# --- Camada SQLite para a Tabela sales_processed ---
+#
+# Carga em massa com executemany em lotes dentro de transações explícitas, WAL e pragmas
+# ajustados para escrita em volume. OrderID é a chave primária, o que permite anexar
+# (pedidos já carregados são ignorados) ou fazer upsert em vez de recriar a tabela.
+# Os índices de CustomerID, Date e Category atendem às consultas agregadas, servidas pela
+# mesma conexão reutilizável.
+
+table_name = 'sales_processed'
+insert_batch_size = 50_000
+load_modes = ('append', 'upsert', 'replace')
+
+# Datas gravadas como texto, no mesmo formato que o to_sql usava (consultas antigas continuam válidas)
+_date_units = {'Date': 's', 'DateOnly': 'D'}
+
+# Índice de Category cobre TotalPrice: o SUM por categoria é resolvido só pelo índice
+index_columns = {
+    'CustomerID': ['CustomerID'],
+    'Date': ['Date'],
+    'Category': ['Category', 'TotalPrice'],
+}
+
+bulk_pragmas = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL', # Com WAL, seguro contra corrupção; só o último commit pode se perder numa queda de energia
+    'temp_store': 'MEMORY',
+    'cache_size': -262144, # 256 MiB
+    'mmap_size': 1 << 30,
+}
+
+
+def connect(db_path, pragmas=bulk_pragmas):
+    """Abre a conexão em modo autocommit (as transações são controladas explicitamente)."""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def _sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _column_values(series):
+    """Valores Python nativos da coluna (None no lugar de nulos), prontos para o sqlite3."""
+    if series.name in _date_units or pd.api.types.is_datetime64_any_dtype(series.dtype):
+        # datetime_as_string é vetorizado (bem mais rápido que dt.strftime); NaT vira 'NaT'
+        dates = pd.to_datetime(series).to_numpy().astype(f"datetime64[{_date_units.get(series.name, 's')}]")
+        values = np.char.replace(np.datetime_as_string(dates), 'T', ' ').astype(object)
+        values[np.isnat(dates)] = None
+        return values.tolist()
+    values = series.to_numpy()
+    if values.dtype == np.float32:
+        # Via texto (repr mais curto) para gravar 51.96 e não 51.959999084472656
+        values = values.astype(str).astype(np.float64)
+    # astype(object) converte escalares NumPy (int64/float64) em int/float do Python
+    values = values.astype(object)
+    mask = pd.isna(values)
+    if mask.any():
+        values[mask] = None
+    return values.tolist()
+
+
+class SalesDatabase:
+    """Conexão reutilizável para carga e consultas da tabela sales_processed."""
+
+    def __init__(self, db_path, table=table_name):
+        self.db_path = db_path
+        self.table = table
+        self.conn = connect(db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.execute("PRAGMA optimize")
+            self.conn.close()
+            self.conn = None
+
+    # --- Esquema ---
+
+    def columns(self):
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info("{self.table}")')]
+
+    def _has_order_key(self):
+        return any(row[1] == 'OrderID' and row[5] for row in self.conn.execute(f'PRAGMA table_info("{self.table}")'))
+
+    def ensure_table(self, df):
+        """Cria a tabela (OrderID como chave primária) a partir dos tipos do DataFrame.
+
+        Uma tabela criada pelo to_sql, sem chave primária, é migrada uma única vez.
+        """
+        existing = self.columns()
+        if existing and self._has_order_key():
+            return
+        column_defs = ', '.join(
+            f'"{col}" INTEGER PRIMARY KEY' if col == 'OrderID' else f'"{col}" {_sql_type(dtype)}'
+            for col, dtype in df.dtypes.items())
+        self.conn.execute("BEGIN")
+        try:
+            if existing:
+                print(f"Migrando a tabela '{self.table}' para OrderID como chave primária...")
+                self.conn.execute(f'ALTER TABLE "{self.table}" RENAME TO "{self.table}_legacy"')
+            self.conn.execute(f'CREATE TABLE "{self.table}" ({column_defs})')
+            if existing:
+                shared = ', '.join(f'"{c}"' for c in df.columns if c in existing)
+                self.conn.execute(f'INSERT OR REPLACE INTO "{self.table}" ({shared}) '
+                                  f'SELECT {shared} FROM "{self.table}_legacy"')
+                self.conn.execute(f'DROP TABLE "{self.table}_legacy"')
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def create_indexes(self):
+        for name, cols in index_columns.items():
+            col_list = ', '.join(f'"{c}"' for c in cols)
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{self.table}_{name}" ON "{self.table}" ({col_list})')
+
+    # --- Carga ---
+
+    def load(self, df, mode='upsert', batch_size=insert_batch_size):
+        """Grava o DataFrame numa única transação, em lotes de executemany.
+
+        - 'append': insere apenas pedidos novos (OrderID já existente é ignorado).
+        - 'upsert': insere pedidos novos e atualiza os existentes.
+        - 'replace': esvazia a tabela antes de inserir.
+        Retorna o número de linhas enviadas.
+        """
+        if mode not in load_modes:
+            raise ValueError(f"Modo de carga desconhecido: {mode!r} (use {', '.join(load_modes)})")
+        if len(df) == 0:
+            return 0
+        self.ensure_table(df)
+        columns = list(df.columns)
+        col_list = ', '.join(f'"{c}"' for c in columns)
+        placeholders = ', '.join('?' * len(columns))
+        if mode == 'upsert':
+            updates = ', '.join(f'"{c}" = excluded."{c}"' for c in columns if c != 'OrderID')
+            sql = (f'INSERT INTO "{self.table}" ({col_list}) VALUES ({placeholders}) '
+                   f'ON CONFLICT("OrderID") DO UPDATE SET {updates}')
+        else:
+            sql = f'INSERT OR IGNORE INTO "{self.table}" ({col_list}) VALUES ({placeholders})'
+
+        with instrumentation.stage('sqlite_load', rows_in=len(df), mode=mode, table=self.table):
+            # Numa tabela vazia os índices são criados depois da carga (mais rápido que mantê-los a cada linha)
+            empty = mode == 'replace' or self.conn.execute(f'SELECT 1 FROM "{self.table}" LIMIT 1').fetchone() is None
+            self.conn.execute("BEGIN")
+            try:
+                if empty:
+                    for name in index_columns:
+                        self.conn.execute(f'DROP INDEX IF EXISTS "idx_{self.table}_{name}"')
+                if mode == 'replace':
+                    self.conn.execute(f'DELETE FROM "{self.table}"')
+                for start in range(0, len(df), batch_size):
+                    batch = df.iloc[start:start + batch_size]
+                    self.conn.executemany(sql, zip(*(_column_values(batch[c]) for c in columns)))
+                self.create_indexes()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(df)
+
+    def replace_table(self, df, table, primary_key=(), batch_size=insert_batch_size):
+        """Recria `table` com o conteúdo de df numa única transação (ex: tabelas de previsões).
+
+        primary_key (lista de colunas) vira a chave primária da nova tabela.
+        """
+        columns = list(df.columns)
+        col_list = ', '.join(f'"{c}"' for c in columns)
+        column_defs = ', '.join(f'"{col}" {_sql_type(dtype)}' for col, dtype in df.dtypes.items())
+        if primary_key:
+            column_defs += ', PRIMARY KEY (' + ', '.join(f'"{c}"' for c in primary_key) + ')'
+        sql = f'INSERT INTO "{table}" ({col_list}) VALUES ({", ".join("?" * len(columns))})'
+        with instrumentation.stage('sqlite_replace', rows_in=len(df), table=table):
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+                self.conn.execute(f'CREATE TABLE "{table}" ({column_defs})')
+                for start in range(0, len(df), batch_size):
+                    batch = df.iloc[start:start + batch_size]
+                    self.conn.executemany(sql, zip(*(_column_values(batch[c]) for c in columns)))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return len(df)
+
+    # --- Consultas ---
+
+    def query(self, sql, params=()):
+        """Executa uma consulta na conexão aberta e retorna um DataFrame."""
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def top_categories(self, n=5):
+        return self.query(f'SELECT Category, SUM(TotalPrice) as TotalSales FROM "{self.table}" '
+                          'GROUP BY Category ORDER BY TotalSales DESC LIMIT ?;', (n,))
+
+    def customer_orders(self, customer_id):
+        return self.query(f'SELECT * FROM "{self.table}" WHERE CustomerID = ? ORDER BY Date;', (customer_id,))
+
+    def sales_between(self, start, end):
+        """Vendas totais por dia no intervalo [start, end)."""
+        return self.query(f'SELECT DateOnly, SUM(TotalPrice) as TotalSales FROM "{self.table}" '
+                          'WHERE Date >= ? AND Date < ? GROUP BY DateOnly ORDER BY DateOnly;',
+                          (str(pd.Timestamp(start)), str(pd.Timestamp(end))))
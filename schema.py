@@ -0,0 +1,94 @@
+import pandas as pd
+
+# --- Esquema Compacto de Tipos ---
+#
+# Tipos usados por todas as etapas ao carregar os dados: textos como categóricas com os
+# vocabulários fixos do gerador (1 byte por linha em vez de uma string Python), inteiros
+# pequenos em int8/int16/int32 e datas em datetime64 (DateOnly com resolução de dia, no
+# lugar de objetos date). TotalPrice continua float64: é a base das somas monetárias do
+# RFM, que são arredondadas para centavos.
+
+# Vocabulários fixos (também usados por generate_data.py para gerar os códigos)
+categories = ['Eletrônicos', 'Vestuário', 'Casa', 'Livros', 'Esportes', 'Alimentos', 'Beleza']
+regions = ['América do Norte', 'Europa', 'Ásia', 'América do Sul', 'Oceania']
+payment_methods = ['Cartão de Crédito', 'Boleto', 'PayPal', 'Pix', 'Transferência']
+
+products = {
+    'Eletrônicos': ['Smartphone XYZ', 'Laptop ABC', 'Fone de Ouvido QWE', 'Smartwatch 123', 'Tablet ZXC'],
+    'Vestuário': ['Camiseta Básica', 'Calça Jeans Slim', 'Jaqueta Corta-Vento', 'Tênis Esportivo', 'Vestido Floral'],
+    'Casa': ['Jogo de Panelas', 'Aspirador Robô', 'Luminária de Mesa LED', 'Conjunto de Toalhas', 'Cafeteira Expressa'],
+    'Livros': ['Ficção Científica Vol. 1', 'Romance Histórico', 'Biografia Inspiradora', 'Suspense Psicológico', 'Livro de Culinária Vegana'],
+    'Esportes': ['Bola de Futebol Oficial', 'Tapete de Yoga', 'Garrafa Térmica', 'Bicicleta Ergométrica', 'Raquete de Tênis Pro'],
+    'Alimentos': ['Café Gourmet 500g', 'Azeite Extra Virgem', 'Chocolate Amargo 70%', 'Mix de Castanhas', 'Chá Verde Orgânico'],
+    'Beleza': ['Protetor Solar FPS 50', 'Creme Hidratante Facial', 'Shampoo Anticaspa', 'Perfume Floral', 'Kit de Maquiagem Básico']
+}
+
+# Produtos achatados na ordem das categorias; cada categoria ocupa uma faixa contígua de códigos
+product_names = [p for c in categories for p in products[c]]
+
+category_dtypes = {
+    'Category': pd.CategoricalDtype(categories),
+    'ProductName': pd.CategoricalDtype(product_names),
+    'Region': pd.CategoricalDtype(regions),
+    'PaymentMethod': pd.CategoricalDtype(payment_methods),
+}
+
+numeric_dtypes = {
+    'OrderID': 'int32',
+    'CustomerID': 'int32', # 'Int32' (anulável) enquanto houver CustomerID faltante
+    'Quantity': 'int16',
+    'UnitPrice': 'float32', # Até ~5 mil com 7 dígitos significativos: centavos preservados
+    'TotalPrice': 'float64',
+    'Year': 'int16',
+    'Month': 'int8',
+    'Week': 'int8',
+    'DayOfWeek': 'int8',
+    'Hour': 'int8',
+}
+
+date_columns = ['Date', 'DateOnly']
+date_unit = 'datetime64[s]'
+
+
+def _categorical(series, dtype):
+    if isinstance(series.dtype, pd.CategoricalDtype) and series.dtype == dtype:
+        return series
+    # Valores fora do vocabulário fixo são acrescentados ao final em vez de virarem NaN
+    unknown = pd.Index(series.dropna().unique()).difference(dtype.categories)
+    if len(unknown):
+        dtype = pd.CategoricalDtype(list(dtype.categories) + sorted(map(str, unknown)))
+    return series.astype(object).astype(dtype)
+
+
+def _integer(series, dtype):
+    if series.isna().any():
+        return series.astype(dtype.capitalize())
+    return series.astype(dtype)
+
+
+def apply(df):
+    """Converte as colunas conhecidas de df para os tipos compactos (as demais ficam como estão)."""
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if col in category_dtypes:
+            df[col] = _categorical(df[col], category_dtypes[col])
+        elif col in date_columns:
+            dates = pd.to_datetime(df[col])
+            df[col] = (dates.dt.normalize() if col == 'DateOnly' else dates).astype(date_unit)
+        elif col in numeric_dtypes:
+            dtype = numeric_dtypes[col]
+            df[col] = _integer(df[col], dtype) if dtype.startswith('int') else df[col].astype(dtype)
+    return df
+
+
+def memory_report(before, after):
+    """Memória (MB, com deep=True) de cada coluna antes e depois da conversão, e o total."""
+    mb = 1024 ** 2
+    report = pd.DataFrame({
+        'Antes (MB)': before.memory_usage(deep=True, index=False) / mb,
+        'Depois (MB)': after.memory_usage(deep=True, index=False) / mb,
+        'Tipo': after.dtypes.astype(str),
+    })
+    report.loc['Total'] = [report['Antes (MB)'].sum(), report['Depois (MB)'].sum(), '']
+    report['Redução'] = (report['Antes (MB)'] / report['Depois (MB)']).map('{:.1f}x'.format)
+    return report.round({'Antes (MB)': 2, 'Depois (MB)': 2})
@@ -0,0 +1,193 @@
+import argparse
+import bisect
+import glob
+import json
+import math
+import os
+import re
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import rfm
+import storage
+
+# --- Modelo de Segmentação Persistido e API de Scoring ---
+#
+# Reúne num artefato versionado (JSON) tudo o que é preciso para segmentar um cliente sem
+# reprocessar a base: limites dos quintis R/F/M, tabela de segmentos, média/escala do
+# StandardScaler (sobre log1p) e centróides do K-Means. Carregado uma vez, pontua um
+# cliente em microssegundos (Python puro, sem DataFrame) ou lotes grandes de forma vetorizada.
+#
+# A API pontua por valor: clientes com o mesmo valor recebem o mesmo score. O customer_segments.csv
+# continua com os scores do qcut (ou do sketch), em que rank_first separa empates pela ordem; por
+# isso alguns clientes empatados num limite de quintil podem ter F_Score/Segment diferente na API.
+
+model_file_pattern = re.compile(r'segmentation_model_v(\d+)\.json$')
+rfm_columns = ['Recency', 'Frequency', 'MonetaryValue']
+batch_block_size = 65_536 # Clientes por bloco no cálculo das distâncias aos centróides (limita a memória)
+
+
+def quintile_edges(rfm_df, rank_first=True, duplicates='drop'):
+    """Limites dos quintis usados pelo qcut, em unidades de cada métrica.
+
+    Com rank_first o qcut do F_Score é feito sobre ranks; os limites são convertidos para
+    valores de Frequency; empates que atravessam um limite vão para o quintil que contém
+    a maioria dos clientes com aquele valor.
+    """
+    edges = {}
+    for score, metric in rfm.score_metrics.items():
+        values = rfm_df[metric]
+        if score == 'F_Score' and rank_first:
+            _, rank_edges = pd.qcut(values.rank(method='first'), q=5, retbins=True, duplicates=duplicates)
+            sorted_values = np.sort(values.to_numpy()).astype(float)
+            value_edges = []
+            for rank_edge in rank_edges:
+                # Último cliente (em ordem de rank) do quintil inferior ao limite
+                last = int(np.clip(np.floor(rank_edge), 1, len(sorted_values)))
+                edge = sorted_values[last - 1]
+                # Empates que atravessam o limite vão para o quintil com mais clientes daquele valor
+                first_tie = np.searchsorted(sorted_values, edge, side='left')
+                end_tie = np.searchsorted(sorted_values, edge, side='right')
+                if end_tie - last > last - first_tie and first_tie > 0:
+                    edge = sorted_values[first_tie - 1]
+                value_edges.append(float(edge))
+            edges[score] = value_edges
+        else:
+            _, bins = pd.qcut(values, q=5, retbins=True, duplicates=duplicates)
+            edges[score] = bins.astype(float).tolist()
+    return edges
+
+
+def sketch_edges(sketches, duplicates='drop'):
+    """Limites dos quintis a partir dos sketches KLL de rfm.score_sketch (sem o qcut exato)."""
+    edges = {}
+    for score, sketch in sketches.items():
+        bins = np.asarray(sketch.quantiles(np.linspace(0, 1, 6)), dtype=float)
+        edges[score] = (np.unique(bins) if duplicates == 'drop' else bins).tolist()
+    return edges
+
+
+class SegmentationModel:
+    """Pipeline log1p + StandardScaler + K-Means e quintis RFM, pronto para pontuar clientes."""
+
+    def __init__(self, score_edges, scaler_mean, scaler_scale, cluster_centers, reference_date=None,
+                 version=None, created_at=None, segment_table=None):
+        self.score_edges = {k: list(map(float, v)) for k, v in score_edges.items()}
+        self.scaler_mean = list(map(float, scaler_mean))
+        self.scaler_scale = list(map(float, scaler_scale))
+        self.cluster_centers = [list(map(float, c)) for c in cluster_centers]
+        self.reference_date = str(reference_date) if reference_date is not None else None
+        self.version = version
+        self.created_at = created_at
+        self.segment_table = segment_table if segment_table is not None else rfm.segment_table.tolist()
+        # Estruturas pré-calculadas para o scoring
+        self._inner_edges = {k: v[1:-1] for k, v in self.score_edges.items()}
+        self._labels = {k: rfm.score_labels[k][:len(v) - 1] for k, v in self.score_edges.items()}
+        self._centers = np.asarray(self.cluster_centers)
+        self._mean = np.asarray(self.scaler_mean)
+        self._scale = np.asarray(self.scaler_scale)
+        self._segments = np.asarray(self.segment_table, dtype=object)
+
+    @classmethod
+    def from_fit(cls, rfm_df, scaler, kmeans, reference_date=None, rank_first=True, duplicates='drop', score_edges=None):
+        """Cria o modelo a partir do rfm_df e dos estimadores já ajustados no script de segmentação.
+
+        score_edges (ex: sketch_edges) evita recalcular os quintis exatos sobre rfm_df.
+        """
+        if score_edges is None:
+            score_edges = quintile_edges(rfm_df, rank_first, duplicates)
+        return cls(score_edges, scaler.mean_, scaler.scale_, kmeans.cluster_centers_, reference_date=reference_date)
+
+    # --- Scoring individual (Python puro, sem alocação de arrays) ---
+
+    def score_one(self, recency, frequency, monetary_value):
+        """Segmento e cluster de um único cliente a partir das suas métricas RFM."""
+        metrics = {'R_Score': recency, 'F_Score': frequency, 'M_Score': monetary_value}
+        scores = {}
+        for score, value in metrics.items():
+            labels = self._labels[score]
+            scores[score] = labels[min(bisect.bisect_left(self._inner_edges[score], value), len(labels) - 1)]
+        point = [(math.log1p(v) - m) / s for v, m, s in zip((recency, frequency, monetary_value),
+                                                              self.scaler_mean, self.scaler_scale)]
+        best, best_dist = 0, math.inf
+        for i, center in enumerate(self.cluster_centers):
+            dist = sum((p - c) ** 2 for p, c in zip(point, center))
+            if dist < best_dist:
+                best, best_dist = i, dist
+        scores['Segment'] = self.segment_table[scores['R_Score'] - 1][scores['F_Score'] - 1]
+        scores['KMeans_Cluster'] = best
+        return scores
+
+    # --- Scoring em lote (vetorizado) ---
+
+    def score_batch(self, rfm_df):
+        """Scores, Segment e KMeans_Cluster para um DataFrame com Recency/Frequency/MonetaryValue."""
+        result = pd.DataFrame(index=rfm_df.index)
+        for score, metric in rfm.score_metrics.items():
+            labels = np.asarray(self._labels[score])
+            idx = np.searchsorted(self._inner_edges[score], rfm_df[metric].to_numpy(dtype=float), side='left')
+            result[score] = labels[np.minimum(idx, len(labels) - 1)]
+        result['Segment'] = self._segments[result['R_Score'].to_numpy() - 1, result['F_Score'].to_numpy() - 1]
+        scaled = (np.log1p(rfm_df[rfm_columns].to_numpy(dtype=float)) - self._mean) / self._scale
+        clusters = np.empty(len(scaled), dtype=np.int64)
+        for start in range(0, len(scaled), batch_block_size):
+            block = scaled[start:start + batch_block_size]
+            distances = ((block[:, None, :] - self._centers[None, :, :]) ** 2).sum(axis=2)
+            clusters[start:start + batch_block_size] = distances.argmin(axis=1)
+        result['KMeans_Cluster'] = clusters
+        return result
+
+    # --- Persistência versionada ---
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'created_at': self.created_at,
+            'reference_date': self.reference_date,
+            'score_edges': self.score_edges,
+            'scaler_mean': self.scaler_mean,
+            'scaler_scale': self.scaler_scale,
+            'cluster_centers': self.cluster_centers,
+            'segment_table': self.segment_table,
+        }
+
+    def save(self, model_dir):
+        """Grava uma nova versão do artefato (segmentation_model_vNNNN.json) e retorna o caminho."""
+        os.makedirs(model_dir, exist_ok=True)
+        self.version = (latest_version(model_dir) or 0) + 1
+        self.created_at = datetime.now().isoformat(timespec='seconds')
+        path = os.path.join(model_dir, f'segmentation_model_v{self.version:04d}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Carrega um artefato; se path for um diretório, carrega a versão mais recente."""
+        if os.path.isdir(path):
+            version = latest_version(path)
+            if version is None:
+                raise FileNotFoundError(f"Nenhum modelo de segmentação encontrado em {path}")
+            path = os.path.join(path, f'segmentation_model_v{version:04d}.json')
+        with open(path, encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+
+def latest_version(model_dir):
+    versions = [int(m.group(1)) for m in map(model_file_pattern.search, glob.glob(os.path.join(model_dir, '*.json'))) if m]
+    return max(versions) if versions else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pontua clientes com o modelo de segmentação salvo.')
+    parser.add_argument('--model', default=storage.data_path('models'), help='Arquivo do modelo ou diretório (usa a última versão)')
+    parser.add_argument('--input', required=True, help='CSV com CustomerID, Recency, Frequency e MonetaryValue')
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    model = SegmentationModel.load(args.model)
+    customers = pd.read_csv(args.input)
+    scored = pd.concat([customers, model.score_batch(customers)], axis=1)
+    scored.to_csv(args.output, index=False)
+    print(f"{len(scored)} clientes pontuados com o modelo v{model.version} e salvos em {args.output}")
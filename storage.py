@@ -0,0 +1,226 @@
+import os
+import glob
+import pandas as pd
+
+# --- Armazenamento Colunar (CSV / Parquet particionado / Arrow IPC) ---
+#
+# Camada comum de leitura e escrita usada por generate_data.py, eda_analysis.py e
+# customer_segmentation_corrected.py para trocar dados entre as etapas.
+# - 'csv': formato original (texto), mantido por compatibilidade.
+# - 'parquet': diretório com um arquivo .parquet por bloco (ou particionado por colunas).
+# - 'arrow': arquivo Arrow IPC único, lido via memory-map.
+# Colunas de texto são gravadas como categóricas (dictionary-encoded); datas e inteiros
+# anuláveis (Int64) mantêm seus tipos nativos, sem parsing na leitura.
+
+FORMATS = ('csv', 'parquet', 'arrow')
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Formato padrão das trocas entre etapas (pode ser alterado sem editar os scripts)
+default_format = os.environ.get('VAREJO_STORAGE_FORMAT', 'csv')
+
+# Diretório base de dados e artefatos de todas as etapas
+data_dir = os.environ.get('VAREJO_DATA_DIR', '/home/ubuntu')
+
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+CSV_DAY_FORMAT = '%Y-%m-%d'
+CSV_DAY_COLUMNS = ('DateOnly',) # Datas com resolução de dia, gravadas no CSV sem a hora
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Os formatos 'parquet' e 'arrow' requerem o pacote pyarrow (pip install pyarrow).") from e
+    return pyarrow
+
+
+def data_path(*parts):
+    """Caminho dentro do diretório de dados (VAREJO_DATA_DIR)."""
+    return os.path.join(data_dir, *parts)
+
+
+def table_path(base_path, fmt=None):
+    """Troca a extensão de base_path pela extensão do formato (ex: dados.csv -> dados.parquet)."""
+    fmt = fmt or default_format
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato de armazenamento desconhecido: {fmt!r} (use um de {FORMATS})")
+    return os.path.splitext(base_path)[0] + EXTENSIONS[fmt]
+
+
+def infer_format(path):
+    """Deduz o formato pela extensão do caminho."""
+    ext = os.path.splitext(path.rstrip('/'))[1].lower()
+    for fmt, fmt_ext in EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError(f"Não foi possível deduzir o formato de armazenamento de {path!r}")
+
+
+def to_columnar(df):
+    """Converte colunas de texto (object/string) em categóricas para gravação dictionary-encoded."""
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if not isinstance(df[col].dtype, pd.CategoricalDtype) and pd.api.types.infer_dtype(df[col], skipna=True) == 'string':
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _csv_ready(df):
+    day_cols = [col for col in CSV_DAY_COLUMNS if col in df.columns and pd.api.types.is_datetime64_dtype(df[col])]
+    if not day_cols:
+        return df
+    df = df.copy(deep=False)
+    for col in day_cols:
+        df[col] = df[col].dt.strftime(CSV_DAY_FORMAT)
+    return df
+
+
+def _arrow_table(df, schema=None):
+    pa = _require_pyarrow()
+    table = pa.Table.from_pandas(to_columnar(df), preserve_index=False)
+    if schema is None:
+        # Índices de dicionário fixos em int32 para que blocos com vocabulários maiores mantenham o schema
+        fields = [pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type), f.nullable)
+                  if pa.types.is_dictionary(f.type) else f for f in table.schema]
+        schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table.cast(schema), schema
+
+
+def write_table(df, path, fmt=None, partition_cols=None):
+    """Grava um DataFrame inteiro no formato indicado (ou deduzido pela extensão)."""
+    fmt = fmt or infer_format(path)
+    if fmt == 'csv':
+        _csv_ready(df).to_csv(path, index=False, date_format=CSV_DATE_FORMAT)
+        return path
+    with TableWriter(path, fmt, partition_cols=partition_cols) as writer:
+        writer.write(df)
+    return path
+
+
+def write_part(df, path):
+    """Grava um único arquivo-parte (ex: um shard do gerador paralelo dentro de um dataset Parquet)."""
+    fmt = infer_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(_arrow_table(df)[0], path)
+    else:
+        write_table(df, path, fmt)
+    return path
+
+
+class TableWriter:
+    """Escrita incremental, bloco a bloco, em qualquer um dos formatos suportados.
+
+    No Parquet cada bloco vira um arquivo-parte do dataset; no Arrow IPC os blocos são
+    lotes do mesmo arquivo, com os vocabulários das categóricas estendidos via deltas.
+    """
+
+    def __init__(self, path, fmt=None, partition_cols=None):
+        self.path = path
+        self.fmt = fmt or infer_format(path)
+        self.partition_cols = partition_cols
+        self.rows_written = 0
+        self._part = 0
+        self._schema = None
+        self._writer = None
+        self._vocab = {}
+        if self.fmt == 'parquet':
+            _require_pyarrow()
+            if os.path.isdir(path):
+                for old in glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True):
+                    os.remove(old)
+            os.makedirs(path, exist_ok=True)
+        elif self.fmt == 'arrow':
+            _require_pyarrow()
+
+    def _extend_vocab(self, df):
+        # Mantém a ordem das categorias já gravadas e acrescenta as novas ao final
+        df = to_columnar(df)
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                vocab = self._vocab.setdefault(col, [])
+                known = set(vocab)
+                vocab.extend(c for c in df[col].cat.categories if c not in known)
+                df[col] = df[col].cat.set_categories(vocab)
+        return df
+
+    def write(self, df):
+        if self.fmt == 'csv':
+            _csv_ready(df).to_csv(self.path, mode='w' if self.rows_written == 0 else 'a',
+                                  header=self.rows_written == 0, index=False, date_format=CSV_DATE_FORMAT)
+        elif self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            table, self._schema = _arrow_table(df, self._schema)
+            if self.partition_cols:
+                pq.write_to_dataset(table, self.path, partition_cols=self.partition_cols,
+                                    basename_template=f'part-{self._part:05d}-{{i}}.parquet')
+            else:
+                pq.write_table(table, os.path.join(self.path, f'part-{self._part:05d}.parquet'))
+        else:
+            import pyarrow.ipc as ipc
+            table, self._schema = _arrow_table(self._extend_vocab(df), self._schema)
+            if self._writer is None:
+                self._writer = ipc.new_file(self.path, self._schema,
+                                            options=ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+            self._writer.write_table(table)
+        self._part += 1
+        self.rows_written += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_table(path, columns=None, fmt=None, parse_dates=None, dtype=None, filters=None):
+    """Lê uma tabela projetando apenas as colunas pedidas.
+
+    parse_dates e dtype só se aplicam ao CSV; Parquet e Arrow já trazem os tipos nativos.
+    filters (somente Parquet) permite descartar partições/row groups na leitura.
+    """
+    fmt = fmt or infer_format(path)
+    if fmt == 'csv':
+        if parse_dates and columns:
+            parse_dates = [c for c in parse_dates if c in columns]
+        return pd.read_csv(path, usecols=columns, parse_dates=parse_dates, dtype=dtype)
+    pa = _require_pyarrow()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, filters=filters)
+    else:
+        import pyarrow.ipc as ipc
+        # memory_map: os buffers do arquivo são mapeados, sem cópia para a leitura
+        table = ipc.open_file(pa.memory_map(path, 'r')).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    return table.to_pandas()
+
+
+def iter_table(path, chunk_size, columns=None, fmt=None, parse_dates=None, dtype=None):
+    """Itera sobre a tabela em blocos de até chunk_size linhas (memória limitada)."""
+    fmt = fmt or infer_format(path)
+    if fmt == 'csv':
+        if parse_dates and columns:
+            parse_dates = [c for c in parse_dates if c in columns]
+        yield from pd.read_csv(path, usecols=columns, parse_dates=parse_dates, dtype=dtype, chunksize=chunk_size)
+        return
+    pa = _require_pyarrow()
+    if fmt == 'parquet':
+        import pyarrow.dataset as ds
+        batches = ds.dataset(path, format='parquet', partitioning='hive').to_batches(columns=columns, batch_size=chunk_size)
+    else:
+        import pyarrow.ipc as ipc
+        reader = ipc.open_file(pa.memory_map(path, 'r'))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        if columns is not None:
+            batches = (b.select(columns) for b in batches)
+    for batch in batches:
+        df = batch.to_pandas()
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
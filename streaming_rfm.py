@@ -0,0 +1,397 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+import cleaning
+import generate_data
+import instrumentation
+import rfm
+import storage
+from rfm_state import RFMStateStore
+from segmentation_model import SegmentationModel, quintile_edges
+
+# --- Ingestão em Streaming com Segmentos RFM ao Vivo ---
+#
+# Consome eventos de pedido (mesmos campos de generate_data.py) de um arquivo acompanhado
+# como `tail -f`, de um socket TCP (JSON por linha) ou de uma asyncio.Queue no próprio
+# processo (no lugar de um broker). Os eventos são agrupados em micro-lotes, limpos com as
+# regras de eda_analysis.py (CustomerID nulo -> -1, sem Region -> descartado; pedidos repetidos
+# são ignorados pelo estado) e incorporados ao RFMStateStore em memória. A cada lote só são
+# repontuados os clientes do lote e os que a data de referência fez cruzar um limite de R_Score
+# (achados por faixa de data da última compra); os que mudaram de Segment são emitidos. Todos
+# os clientes só são repontuados quando os limites mudam. O estado é gravado periodicamente
+# (snapshot) e recarregado ao reiniciar.
+#
+# Os limites dos quintis vêm do modelo de segmentação salvo (se houver) e são recalculados
+# sobre o estado ao vivo a cada snapshot, como numa nova execução do script de segmentação.
+
+flush_interval = 0.5 # Segundos máximos entre a chegada de um evento e a emissão das mudanças
+max_batch_size = 50_000 # Eventos por micro-lote
+queue_size = 200_000 # Eventos pendentes antes de aplicar contrapressão nas fontes
+snapshot_interval = 60.0 # Segundos entre snapshots do estado (e recálculo dos quintis)
+snapshot_path = storage.data_path('rfm_live_state.npz')
+tail_poll_interval = 0.2
+recency_tail_size = 1 << 16 # Entradas novas do índice por última compra antes de fundi-las ao vetor principal
+
+numeric_event_columns = ['OrderID', 'CustomerID', 'Quantity', 'UnitPrice', 'TotalPrice']
+
+# Segmentos como códigos inteiros (comparação vetorizada); -1 = cliente ainda sem segmento
+segment_names = np.array(sorted(set(rfm.segment_table.flat)), dtype=object)
+_segment_code_table = np.searchsorted(segment_names, rfm.segment_table).astype(np.int8)
+
+
+def events_to_frame(events):
+    """DataFrame com os tipos do CSV bruto a partir de eventos (dicts); eventos malformados viram NaN/NaT."""
+    df = pd.DataFrame.from_records(events, columns=generate_data.columns)
+    for col in numeric_event_columns:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    df['Region'] = df['Region'].replace('', np.nan)
+    return df
+
+
+class LiveRFM:
+    """Estado RFM ao vivo e segmento atual de cada cliente."""
+
+    def __init__(self, state=None, edges=None, rank_first=True, duplicates='drop', emit_new=True):
+        self.state = state if state is not None else RFMStateStore()
+        self.rank_first = rank_first
+        self.duplicates = duplicates
+        self.emit_new = emit_new # Emite também clientes novos (segmento anterior None)
+        self.codes = np.full(len(self.state), -1, dtype=np.int8) # Alinhado a state.customer_ids
+        self.stats = {'events': 0, 'rejected': 0, 'rows_removed_region': 0, 'transactions': 0, 'changes': 0}
+        self.edges = None
+        self._reference = None # Data de referência dos códigos atuais
+        self._index_recency()
+        if edges is not None:
+            self.set_edges(edges)
+        elif len(self.state):
+            self.refresh_edges()
+        if self.edges is not None and len(self.state):
+            self._reference = np.datetime64(self.state.reference_date(), 'ns')
+            self.codes = self._codes_of(np.arange(len(self.state)), self._reference)
+            self._rescore_all = False
+
+    def set_edges(self, edges):
+        # Mesma convenção de SegmentationModel.score_batch: limites internos e labels
+        self.edges = {score: (np.asarray(v[1:-1], dtype=float), np.asarray(rfm.score_labels[score][:len(v) - 1]))
+                      for score, v in edges.items() if score in ('R_Score', 'F_Score')}
+        self._rescore_all = True # Novos limites: todos os clientes são repontuados no próximo lote
+
+    def refresh_edges(self):
+        """Recalcula os quintis sobre o estado atual (equivale a rodar o qcut do script agora)."""
+        self.set_edges(quintile_edges(self.state.to_rfm(), self.rank_first, self.duplicates))
+
+    def _score(self, score, values):
+        inner, labels = self.edges[score]
+        return labels[np.minimum(np.searchsorted(inner, values, side='left'), len(labels) - 1)]
+
+    def _recency(self, rows, reference):
+        return ((reference - self.state.last_purchase[rows]) // np.timedelta64(1, 'D')).astype(np.int64)
+
+    def _codes_of(self, rows, reference):
+        r = self._score('R_Score', self._recency(rows, reference).astype(float))
+        f = self._score('F_Score', self.state.frequency[rows].astype(float))
+        return _segment_code_table[r - 1, f - 1]
+
+    # Índice (última compra, linha) ordenado: vetor principal mais uma cauda pequena com as linhas
+    # alteradas, fundida ao principal em tempo linear. Entradas antigas de uma linha alterada só
+    # geram candidatos a mais (repontuados sem mudança) e são descartadas na fusão.
+
+    def _index_recency(self):
+        last = self.state.last_purchase
+        self._index_rows = np.argsort(last, kind='stable')
+        self._index_last = last[self._index_rows]
+        self._tail_rows = np.empty(0, dtype=np.int64)
+        self._tail_last = np.empty(0, dtype='datetime64[ns]')
+
+    def _track(self, rows):
+        last = self.state.last_purchase[rows]
+        order = np.argsort(last, kind='stable')
+        pos = np.searchsorted(self._tail_last, last[order])
+        self._tail_last = np.insert(self._tail_last, pos, last[order])
+        self._tail_rows = np.insert(self._tail_rows, pos, rows[order])
+        if len(self._tail_rows) > recency_tail_size:
+            self._merge_recency()
+
+    def _merge_recency(self):
+        keys = np.concatenate([self._index_last, self._tail_last])
+        rows = np.concatenate([self._index_rows, self._tail_rows])
+        order = np.argsort(keys, kind='stable') # Duas sequências ordenadas: fusão em tempo linear
+        keys, rows = keys[order], rows[order]
+        current = self.state.last_purchase[rows] == keys
+        keys, rows = keys[current], rows[current]
+        # Uma entrada por linha (a mesma linha reinserida sem mudar a última compra)
+        first = np.empty(len(self.state), dtype=np.int64)
+        first[rows[::-1]] = np.arange(len(rows) - 1, -1, -1)
+        unique = first[rows] == np.arange(len(rows))
+        self._index_last, self._index_rows = keys[unique], rows[unique]
+        self._tail_rows = self._tail_rows[:0]
+        self._tail_last = self._tail_last[:0]
+
+    def _crossing_rows(self, old_reference, new_reference):
+        """Linhas cuja Recência pode cruzar um limite de R_Score quando a referência avança.
+
+        Recência r vira r' > r e o score muda se algum limite e tem r <= e < r', ou seja, se a
+        Recência passa por m = floor(e) + 1: última compra em (old - m dias, new - m dias].
+        """
+        found = []
+        for edge in self.edges['R_Score'][0]:
+            days = np.timedelta64(int(np.floor(edge)) + 1, 'D')
+            bounds = [old_reference - days, new_reference - days]
+            for keys, rows in ((self._index_last, self._index_rows), (self._tail_last, self._tail_rows)):
+                lo, hi = np.searchsorted(keys, bounds, side='right')
+                found.append(rows[lo:hi])
+        return np.concatenate(found)
+
+    def process(self, df):
+        """Incorpora um micro-lote de eventos; retorna os clientes cujo Segment mudou."""
+        self.stats['events'] += len(df)
+        valid = df.dropna(subset=['OrderID', 'Date', 'TotalPrice'])
+        self.stats['rejected'] += len(df) - len(valid)
+        cleaned = cleaning.handle_nulls(valid) # Mesmas regras de eda_analysis.py
+        self.stats['rows_removed_region'] += len(valid) - len(cleaned)
+        cleaned = cleaned[cleaned['CustomerID'] != -1]
+        self.stats['transactions'] += len(cleaned)
+
+        rows = self.state.apply_delta(cleaned)
+        if len(self.state) != len(self.codes):
+            # Clientes novos ganham linhas no fim do estado: ainda sem segmento
+            self.codes = np.concatenate([self.codes, np.full(len(self.state) - len(self.codes), -1, dtype=np.int8)])
+        if not len(self.state):
+            return self._changes(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8))
+        if self.edges is None:
+            self.refresh_edges()
+
+        # Repontua só os clientes do lote e os que cruzaram um limite de Recência (todos se os limites mudaram)
+        reference = np.datetime64(self.state.reference_date(), 'ns')
+        if self._rescore_all:
+            candidates = np.arange(len(self.state))
+            self._index_recency()
+            self._rescore_all = False
+        else:
+            candidates = rows
+            if reference != self._reference:
+                candidates = np.union1d(rows, self._crossing_rows(self._reference, reference))
+            self._track(rows)
+        self._reference = reference
+        new_codes = self._codes_of(candidates, reference)
+        moved = new_codes != self.codes[candidates]
+        if not self.emit_new:
+            moved &= self.codes[candidates] != -1
+        changed = candidates[moved]
+        previous = self.codes[changed]
+        self.codes[candidates] = new_codes
+        return self._changes(changed, previous)
+
+    def _changes(self, idx, previous):
+        changes = pd.DataFrame({
+            'CustomerID': self.state.customer_ids[idx],
+            'OldSegment': np.where(previous >= 0, segment_names[np.maximum(previous, 0)], None),
+            'NewSegment': segment_names[self.codes[idx]],
+            'Recency': self._recency(idx, self._reference) if len(idx) else np.empty(0, dtype=np.int64),
+            'Frequency': self.state.frequency[idx],
+            'MonetaryValue': self.state.monetary_cents[idx] / 100,
+        })
+        self.stats['changes'] += len(changes)
+        return changes
+
+    def segments(self):
+        """Segmento atual de cada cliente (Series indexada por CustomerID)."""
+        names = np.where(self.codes >= 0, segment_names[np.maximum(self.codes, 0)], None)
+        return pd.Series(names, index=pd.Index(self.state.customer_ids, name='CustomerID'), name='Segment')
+
+
+# --- Fontes de eventos (produtores da fila) ---
+
+async def tail_file(path, queue, from_start=False, poll_interval=tail_poll_interval, stop=None):
+    """Acompanha um CSV (com cabeçalho) ou JSON Lines (.jsonl) e põe cada linha nova na fila."""
+    is_json = path.endswith('.jsonl')
+    while not os.path.exists(path):
+        await asyncio.sleep(poll_interval)
+    with open(path, encoding='utf-8', newline='') as f:
+        header = None if is_json else next(csv.reader([f.readline()]))
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        pending = ''
+        while stop is None or not stop.is_set():
+            chunk = f.read(1 << 20)
+            if not chunk:
+                await asyncio.sleep(poll_interval)
+                continue
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop() # Linha ainda incompleta
+            lines = [line for line in lines if line.strip()]
+            if is_json:
+                events = map(json.loads, lines)
+            else:
+                events = (dict(zip(header, row)) for row in csv.reader(lines))
+            for event in events:
+                await queue.put(event)
+
+
+async def serve_socket(queue, host='127.0.0.1', port=9009):
+    """Servidor TCP: cada conexão envia eventos em JSON, um por linha."""
+    async def handle(reader, writer):
+        try:
+            while line := await reader.readline():
+                if line.strip():
+                    await queue.put(json.loads(line))
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+
+# --- Serviço ---
+
+class StreamingRFMService:
+    """Consome a fila em micro-lotes, atualiza o LiveRFM e entrega as mudanças a on_change."""
+
+    def __init__(self, live, on_change, flush_interval=flush_interval, max_batch=max_batch_size,
+                 snapshot_path=snapshot_path, snapshot_interval=snapshot_interval, queue=None):
+        self.live = live
+        self.on_change = on_change # Função (ou corrotina) que recebe o DataFrame de mudanças
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.queue = queue if queue is not None else asyncio.Queue(maxsize=queue_size)
+        self._last_snapshot = time.monotonic()
+
+    async def _next_batch(self):
+        """Primeiro evento (bloqueante) e o que mais chegar até flush_interval ou max_batch; None encerra."""
+        first = await self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            try:
+                event = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if event is None:
+                self.queue.put_nowait(None) # Processa o lote atual e encerra na próxima volta
+                break
+            batch.append(event)
+        return batch
+
+    def _process(self, batch):
+        with instrumentation.stage('stream.batch', rows_in=len(batch)) as st:
+            changes = self.live.process(events_to_frame(batch))
+            st.set(rows_out=len(changes), queue_size=self.queue.qsize())
+        return changes
+
+    def snapshot(self):
+        if self.snapshot_path:
+            self.live.state.save(self.snapshot_path)
+        self._last_snapshot = time.monotonic()
+
+    async def run(self):
+        """Processa até receber None na fila; grava um snapshot final."""
+        while (batch := await self._next_batch()) is not None:
+            # O processamento vetorizado roda numa thread: as fontes continuam enchendo a fila
+            changes = await asyncio.to_thread(self._process, batch)
+            if len(changes):
+                result = self.on_change(changes)
+                if asyncio.iscoroutine(result):
+                    await result
+            if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+                await asyncio.to_thread(self.snapshot)
+                changes = await asyncio.to_thread(self._requantile)
+                if len(changes):
+                    result = self.on_change(changes)
+                    if asyncio.iscoroutine(result):
+                        await result
+        self.snapshot()
+
+    def _requantile(self):
+        # Quintis recalculados sobre o estado atual: clientes podem mudar de segmento sem novos pedidos
+        self.live.refresh_edges()
+        return self.live.process(events_to_frame([]))
+
+
+def load_live(state_path=snapshot_path, model_dir=None, emit_new=True):
+    """LiveRFM a partir do último snapshot (se houver) e dos quintis do modelo salvo (se houver)."""
+    state = RFMStateStore.load_or_create(state_path) if state_path else RFMStateStore()
+    edges = None
+    if model_dir and os.path.exists(model_dir):
+        try:
+            edges = SegmentationModel.load(model_dir).score_edges
+        except FileNotFoundError:
+            pass
+    return LiveRFM(state, edges=edges, emit_new=emit_new)
+
+
+def print_changes(changes):
+    for record in changes.to_dict('records'):
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+async def _demo(service, num_events, seed):
+    """Gera eventos com generate_data.py e mede a vazão do serviço com a fila em memória."""
+    events = []
+    for chunk in generate_data.iter_chunks(num_events, min(num_events, generate_data.chunk_size), seed):
+        chunk['Date'] = chunk['Date'].astype(str)
+        events.extend(chunk.astype(object).where(chunk.notna(), None).to_dict('records'))
+    consumer = asyncio.create_task(service.run())
+    start = time.perf_counter()
+    for event in events:
+        await service.queue.put(event)
+    await service.queue.put(None)
+    await consumer
+    elapsed = time.perf_counter() - start
+    print(f"{len(events):,} eventos em {elapsed:.2f}s ({len(events) / elapsed:,.0f} eventos/s); {service.live.stats}")
+
+
+async def main(args):
+    live = load_live(args.state, args.model, emit_new=not args.changes_only)
+    on_change = print_changes if not args.quiet else (lambda changes: None)
+    service = StreamingRFMService(live, on_change, args.flush_interval, args.max_batch, args.state,
+                                  args.snapshot_interval)
+    if args.demo:
+        await _demo(service, args.demo, args.seed)
+        return
+    producers = []
+    if args.tail:
+        producers.append(asyncio.create_task(tail_file(args.tail, service.queue, from_start=args.from_start)))
+    if args.port:
+        server = await serve_socket(service.queue, args.host, args.port)
+        producers.append(asyncio.create_task(server.serve_forever()))
+    try:
+        await service.run()
+    finally:
+        for task in producers:
+            task.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingestão de pedidos em streaming com segmentos RFM ao vivo.')
+    parser.add_argument('--tail', help='Arquivo CSV (com cabeçalho) ou .jsonl acompanhado como tail -f')
+    parser.add_argument('--from-start', action='store_true', help='Lê o arquivo desde o início antes de acompanhar')
+    parser.add_argument('--port', type=int, help='Porta TCP para eventos JSON (um por linha)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--demo', type=int, default=0, help='Gera N eventos numa fila em memória e mede a vazão')
+    parser.add_argument('--seed', type=int, default=generate_data.seed)
+    parser.add_argument('--state', default=snapshot_path, help='Snapshot do estado RFM (carregado e regravado)')
+    parser.add_argument('--model', default=storage.data_path('models'), help='Modelo de segmentação com os quintis iniciais')
+    parser.add_argument('--flush-interval', type=float, default=flush_interval)
+    parser.add_argument('--max-batch', type=int, default=max_batch_size)
+    parser.add_argument('--snapshot-interval', type=float, default=snapshot_interval)
+    parser.add_argument('--changes-only', action='store_true', help='Não emite clientes novos, só mudanças de segmento')
+    parser.add_argument('--quiet', action='store_true', help='Não imprime as mudanças')
+    args = parser.parse_args()
+    if not (args.tail or args.port or args.demo):
+        parser.error('informe --tail, --port ou --demo')
+    asyncio.run(main(args))